@@ -0,0 +1,526 @@
+#!/usr/bin/python2.7
+
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" benchmarks of the odjo pipeline """
+
+import os, sys
+import re
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import threading
+import warnings
+import itertools
+import subprocess
+import BaseHTTPServer
+from urlparse import urlparse, parse_qs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+# the heavy backends that the start-up of the program must not import, they
+# are loaded by the stages that need them
+BACKENDS = ['Bio', 'scipy', 'lxml', 'pymol', 'mmtf']
+# the script that prints the usage of the program, then the list of the
+# backends it has imported on stderr
+USAGE_SCRIPT = '''
+import sys, json, runpy
+sys.argv = [%r]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted(set(name.split('.')[0]
+    for name in sys.modules if sys.modules[name] is not None) & set(%r))))
+'''
+sys.path.insert(0, ROOT_DIR)
+
+import numpy
+import odjo
+import synthetic
+from Bio.PDB.PDBExceptions import PDBConstructionWarning
+
+
+# a function that removes a flag from the arguments list
+def pop_flag(args, flag):
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
+
+# a function that removes an option and its value from the arguments list
+def pop_option(args, option, default):
+    if option in args:
+        index = args.index(option)
+        value = args[index+1]
+        del args[index:index+2]
+        return value
+    return default
+
+
+class fixture_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """
+    A stand-in for the rcsb rest interface, it answers the hmmer and search
+    requests with the recorded fixtures. The unknown PDB ids get the hmmer
+    xml of the small structure, so any number of ids can be fetched.
+    """
+
+    # keep-alive connections, like rcsb
+    protocol_version = 'HTTP/1.1'
+    # seconds added to each answer, to look like a remote server
+    latency = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith('/hmmer'):
+            return self._reply(404, '')
+        pdb_id = parse_qs(url.query).get('structureId', [''])[0].upper()
+        path = os.path.join(FIXTURES_DIR, 'hmmer', pdb_id+'.xml')
+        if os.path.isfile(path):
+            xml = open(path).read()
+        else:
+            xml = open(os.path.join(FIXTURES_DIR, 'hmmer',
+                '9SML.xml')).read().replace('9SML', pdb_id)
+        self._reply(200, xml)
+
+    def do_POST(self):
+        query = self.rfile.read(int(self.headers.get('content-length', 0)))
+        if not urlparse(self.path).path.endswith('/search'):
+            return self._reply(404, '')
+        # a composite query returns the union of its pfam searches
+        pdb_ids = []
+        for pfam_id in re.findall('<pfamID>(.*?)</pfamID>', query):
+            path = os.path.join(FIXTURES_DIR, 'search', pfam_id+'.txt')
+            if os.path.isfile(path):
+                pdb_ids.extend(pdb_id for pdb_id in
+                        open(path).read().split() if pdb_id not in pdb_ids)
+        self._reply(200, ''.join(pdb_id+'\n' for pdb_id in pdb_ids))
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class fixture_server(BaseHTTPServer.HTTPServer):
+
+    # one thread per connection, like a real server
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self._process, args=(request,
+            client_address))
+        thread.daemon = True
+        thread.start()
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class bench:
+
+    """
+    This class times each stage of the pipeline on the fixtures, without any
+    network access: the annotations are fetched from a local stand-in server
+    and the structures are generated in a temporary directory.
+
+    @param repeat: the number of times each stage is timed
+    @type repeat: int
+
+    @param structures: the synthetic structures used (see synthetic.SPECS)
+    @type structures: list
+
+    @param engines: the contact search engines to time
+    @type engines: list
+
+    @param startup_budget: the maximum time (in seconds) of the start-up of
+    the program, measured on the printing of the usage
+    @type startup_budget: float
+    """
+
+    def __init__(self, repeat=3, structures=None, engines=['kdtree',
+            'compact'], pairs=50, fetch_ids=100, latency=0.02, domains=500,
+            events=200000, startup_budget=0.3):
+        self.repeat = repeat
+        if structures is None:
+            structures = sorted(synthetic.SPECS)
+        self.structures = structures
+        self.engines = engines
+        # the number of domain pairs searched by interaction()
+        self.pairs = pairs
+        # the number of pdb ids fetched from the stand-in server
+        self.fetch_ids = fetch_ids
+        self.latency = latency
+        # the size of the analysis used by the frequencies stage
+        self.domains = domains
+        self.events = events
+        self.startup_budget = startup_budget
+        self.stages = {}
+        self.paths = {}
+
+    def run(self, keep=False, startup_only=False):
+        """Runs all the stages (or only the start-up ones) in a temporary
+        directory and returns the results dict."""
+        work_dir = tempfile.mkdtemp(prefix='odjo-bench-')
+        current_dir = os.getcwd()
+        server = fixture_server(('127.0.0.1', 0), fixture_handler)
+        fixture_handler.latency = self.latency
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:'+str(server.server_address[1])+'/pdb/rest/'
+        try:
+            os.chdir(work_dir)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', PDBConstructionWarning)
+                self.bench_startup()
+                if startup_only:
+                    return self.results()
+                self.bench_annotations(url)
+                self.bench_structures()
+                self.bench_analysis()
+                self.bench_outputs()
+        finally:
+            os.chdir(current_dir)
+            server.shutdown()
+            server.server_close()
+            if keep:
+                print "Work directory kept: "+work_dir
+            else:
+                shutil.rmtree(work_dir)
+        return self.results()
+
+    def bench_startup(self):
+        """Times the start-up of the program in new processes: the import
+        of the package and the printing of the usage. The backends imported
+        by the usage are recorded."""
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR,
+            environment.get('PYTHONPATH')]))
+        def command(arguments):
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([sys.executable]+arguments,
+                        stdout=devnull, stderr=devnull, env=environment)
+        def package():
+            command(['-c', 'import odjo'])
+        self.measure('startup.import', package)
+        script = USAGE_SCRIPT % (os.path.join(ROOT_DIR, 'odjo.py'), BACKENDS)
+        def usage():
+            command(['-c', script])
+        self.measure('startup.usage', usage)
+        if 'error' in self.stages['startup.usage']:
+            return
+        process = subprocess.Popen([sys.executable, '-c', script],
+                stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE,
+                env=environment)
+        errors = process.communicate()[1]
+        self.stages['startup.usage']['backends'] = json.loads(
+                errors.splitlines()[-1])
+
+    def check_startup(self):
+        """Returns the list of the problems of the start-up: over the time
+        budget, or backends imported."""
+        problems = []
+        stage = self.stages.get('startup.usage', {})
+        if 'median' not in stage:
+            return ['the start-up was not measured: '+
+                    stage.get('error', 'no stage')]
+        if stage['median'] > self.startup_budget:
+            problems.append('the start-up takes %.3fs, the budget is %.3fs' %
+                    (stage['median'], self.startup_budget))
+        if stage['backends']:
+            problems.append('the start-up imports '+
+                    ', '.join(stage['backends']))
+        return problems
+
+    def bench_annotations(self, url):
+        """Times the pdb ids search and the hmmer annotations fetch."""
+        def search():
+            family = odjo.domain('PF90001')
+            family.rcsb_resturl = url
+            family.xml_dir = os.path.join(ROOT_DIR, 'xml')
+            return family.get_pdb_ids()
+        self.measure('search', search)
+        pdb_ids = ['8%03X' % i for i in range(self.fetch_ids)]
+        def fetch_serial():
+            for pdb_id in pdb_ids:
+                struct = odjo.structure(pdb_id)
+                struct.rcsb_resturl = url
+                struct.get_domains()
+        self.measure('fetch.serial', fetch_serial, len(pdb_ids))
+        def fetch_concurrent():
+            odjo.fetcher(base_url=url).get_domains(pdb_ids)
+        self.measure('fetch.concurrent', fetch_concurrent, len(pdb_ids))
+
+    def bench_structures(self):
+        """Times the parsing, the compact representation and the contact
+        search of each structure."""
+        os.mkdir('pdb_and_png')
+        for pdb_id in self.structures:
+            path = synthetic.write(pdb_id, 'pdb_and_png')
+            self.paths[pdb_id] = path
+            struct = odjo.structure(pdb_id)
+            parsed = {}
+            def parse():
+                parsed['model'] = struct.get_model(path, pdb_id)
+            self.measure('parse.'+pdb_id, parse)
+            def compact_build():
+                odjo.compact(parsed['model']).save(path+'.npy')
+            self.measure('compact.build.'+pdb_id, compact_build)
+            def compact_load():
+                odjo.compact(numpy.load(path+'.npy', mmap_mode='r'))
+            self.measure('compact.load.'+pdb_id, compact_load)
+            domains = synthetic.domains(pdb_id)
+            pairs = list(itertools.islice(
+                itertools.combinations(domains, 2), self.pairs))
+            for engine in self.engines:
+                inter = odjo.interaction('whatever', 'whatever', 'whatever',
+                        engine=engine, downloads=0)
+                # the structure is parsed before, only the search is timed
+                inter.interaction(path, pdb_id, pairs[0][0], pairs[0][1])
+                def search():
+                    for domain_1, domain_2 in pairs:
+                        inter.interaction(path, pdb_id, domain_1, domain_2)
+                self.measure('contacts.'+engine+'.'+pdb_id, search,
+                        len(pairs))
+                def contact_map():
+                    inter.contact_map(path, pdb_id, domains)
+                self.measure('contact_map.'+engine+'.'+pdb_id, contact_map,
+                        len(domains))
+            sys.modules['odjo.cache'].shared_cache.clear()
+
+    def bench_analysis(self):
+        """Times the whole list mode analysis on the structures."""
+        struct = odjo.structure('whatever')
+        def analysis():
+            annotations = []
+            for pdb_id in self.structures:
+                domains = synthetic.domains(pdb_id)
+                annotations.append({'pdb_id': pdb_id, 'domains': domains,
+                    'combinations':
+                    struct.get_domain_combinations(domains)})
+            inter = odjo.interaction('whatever', 'whatever', 'whatever',
+                    downloads=0)
+            inter.analysis_3(annotations)
+            sys.modules['odjo.cache'].shared_cache.clear()
+        self.measure('analysis_3', analysis, len(self.structures))
+
+    def bench_outputs(self):
+        """Times the frequencies, the matrix and the graph on a synthetic
+        analysis."""
+        analysis = self.synthetic_analysis()
+        inter = odjo.interaction('whatever', 'whatever', 'whatever')
+        frequencies = {}
+        def compute():
+            frequencies['list'] = inter.frequencies_from_list(analysis)
+        self.measure('frequencies', compute, self.events)
+        freq = frequencies['list']
+        def dense():
+            odjo.matrixcsv().frequencies_matrix(freq)
+        self.measure('matrixcsv.dense', dense, len(freq))
+        def sparse():
+            odjo.matrixcsv().frequencies_matrix(freq, sparse=True)
+        self.measure('matrixcsv.sparse', sparse, len(freq))
+        def files():
+            odjo.graph(formats=['dot', 'graphml', 'edges'],
+                    render=False).draw_list(freq)
+        self.measure('graph.files', files, len(freq))
+        def draw():
+            odjo.graph().draw_list(freq)
+            # the image is skipped if graphviz is not installed
+            if not os.path.isfile('graph.png'):
+                raise OSError('graphviz is not installed')
+        self.measure('graph', draw, len(freq))
+
+    def synthetic_analysis(self):
+        """Returns an analysis (list of {name, interactants}) with
+        self.events interactions between self.domains domains, each domain
+        having a few partners."""
+        generator = random.Random(0)
+        names = ['PF9%04d' % i for i in range(self.domains)]
+        partners = {}
+        for name in names:
+            partners[name] = generator.sample(names, min(10, len(names)))
+        analysis = {}
+        for i in xrange(self.events):
+            name = generator.choice(names)
+            analysis.setdefault(name, []).append(
+                    generator.choice(partners[name]))
+        return [{'name': name, 'interactants': analysis[name]}
+                for name in names if name in analysis]
+
+    def measure(self, name, function, items=None):
+        """Times a stage self.repeat times (wall and cpu time). The outputs
+        of the stage are hidden, and its errors are recorded."""
+        walls = []
+        cpus = []
+        stage = {'items': items}
+        stdout = sys.stdout
+        for i in range(self.repeat):
+            sys.stdout = open(os.devnull, 'w')
+            cpu = sum(os.times()[:2])
+            start = time.time()
+            try:
+                function()
+            except Exception, error:
+                # a missing tool (graphviz...) only skips its stage
+                stage['error'] = error.__class__.__name__+': '+str(error)
+                break
+            finally:
+                wall = time.time() - start
+                cpu = sum(os.times()[:2]) - cpu
+                sys.stdout.close()
+                sys.stdout = stdout
+            walls.append(wall)
+            cpus.append(cpu)
+        if walls:
+            stage['wall'] = walls
+            stage['cpu'] = cpus
+            stage['min'] = min(walls)
+            stage['median'] = sorted(walls)[len(walls)/2]
+        self.stages[name] = stage
+        print '%-32s %s' % (name, self._format(stage))
+
+    def results(self):
+        """Returns the results dict: the versions, the settings and the
+        timings of the stages."""
+        results = {}
+        results['date'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        results['revision'] = self._revision()
+        results['python'] = platform.python_version()
+        results['platform'] = platform.platform()
+        results['numpy'] = numpy.__version__
+        results['settings'] = {'repeat': self.repeat,
+                'structures': self.structures, 'engines': self.engines,
+                'pairs': self.pairs, 'fetch_ids': self.fetch_ids,
+                'latency': self.latency, 'domains': self.domains,
+                'events': self.events, 'startup_budget': self.startup_budget}
+        results['stages'] = self.stages
+        return results
+
+    # private functions
+
+    def _format(self, stage):
+        """Returns the summary line of a stage."""
+        if 'error' in stage:
+            return 'skipped ('+stage['error']+')'
+        line = 'median %8.4fs  min %8.4fs' % (stage['median'], stage['min'])
+        if stage['items']:
+            line += '  (%d items)' % stage['items']
+        return line
+
+    def _revision(self):
+        """Returns the git revision of the code, or None."""
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                    cwd=ROOT_DIR, stderr=open(os.devnull, 'w')).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def compare(old, new, threshold):
+    """Prints the ratio of the median times of two results and returns the
+    names of the stages slower than the threshold."""
+    regressions = []
+    if old.get('settings') != new['settings']:
+        print "Warning: the settings of the two results are different"
+    for name in sorted(new['stages']):
+        stage = new['stages'][name]
+        previous = old['stages'].get(name)
+        if not previous or 'median' not in previous or 'median' not in stage:
+            continue
+        ratio = stage['median'] / max(previous['median'], 1e-9)
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print '%-32s %8.4fs -> %8.4fs  x%.2f%s' % (name, previous['median'],
+                stage['median'], ratio, flag)
+    return regressions
+
+
+def main():
+
+    output = pop_option(sys.argv, '--output', 'bench.json')
+    baseline = pop_option(sys.argv, '--compare', None)
+    threshold = float(pop_option(sys.argv, '--threshold', 1.25))
+    structures = pop_option(sys.argv, '--structures', None)
+    if structures is not None:
+        structures = structures.split(',')
+    benchmark = bench(
+            repeat=int(pop_option(sys.argv, '--repeat', 3)),
+            structures=structures,
+            engines=pop_option(sys.argv, '--engines',
+                'kdtree,compact').split(','),
+            pairs=int(pop_option(sys.argv, '--pairs', 50)),
+            fetch_ids=int(pop_option(sys.argv, '--fetch-ids', 100)),
+            latency=float(pop_option(sys.argv, '--latency', 20))/1000,
+            domains=int(pop_option(sys.argv, '--domains', 500)),
+            events=int(pop_option(sys.argv, '--events', 200000)),
+            startup_budget=float(pop_option(sys.argv, '--startup-budget',
+                300))/1000)
+    keep = pop_flag(sys.argv, '--keep')
+    startup_only = pop_flag(sys.argv, '--startup')
+
+    if len(sys.argv) != 1:
+        print "Usage:"
+        print "\t./bench/bench.py [options]"
+        print ""
+        print "Times each stage of the pipeline on the fixtures, offline,"
+        print "and writes the results in a json file."
+        print ""
+        print "Options:"
+        print "\t--output <file>\tthe results file (default bench.json)"
+        print "\t--compare <file>\tcompares with older results, exits with"
+        print "\t\t\tan error if a stage is slower than the threshold"
+        print "\t--threshold <r>\tthe slowdown ratio of a regression (1.25)"
+        print "\t--repeat <N>\ttimes each stage N times (default 3)"
+        print "\t--structures <list>\tamong "+ \
+                ','.join(sorted(synthetic.SPECS))+" (all by default)"
+        print "\t--engines <list>\tkdtree,compact by default, nsearch too"
+        print "\t--pairs <N>\tdomain pairs searched per structure (50)"
+        print "\t--fetch-ids <N>\tannotations fetched (default 100)"
+        print "\t--latency <ms>\tdelay of the stand-in server (default 20)"
+        print "\t--domains <N>\tdomains of the frequencies stage (500)"
+        print "\t--events <N>\tinteractions of the frequencies stage"
+        print "\t--startup-budget <ms>\tthe maximum start-up time (300)"
+        print "\t--startup\tonly times the start-up"
+        print "\t--keep\t\tkeeps the work directory"
+        sys.exit()
+
+    results = benchmark.run(keep, startup_only)
+    with open(output, 'w') as handle:
+        json.dump(results, handle, indent=1, sort_keys=True)
+    print "Results written in "+output
+
+    # the start-up is a regression test with an explicit budget
+    problems = benchmark.check_startup()
+    for problem in problems:
+        print "Start-up: "+problem
+    if problems:
+        sys.exit(1)
+
+    if baseline is not None:
+        with open(baseline) as handle:
+            old = json.load(handle)
+        if compare(old, results, threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
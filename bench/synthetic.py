@@ -0,0 +1,156 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" synthetic structures for the benchmarks """
+
+import os
+import math
+import gzip
+
+# pdb id -> size of the structure. The hmmer fixtures of bench/fixtures/hmmer
+# describe the domains of these structures, each chain has two domains.
+SPECS = {
+    # about 2 000 atoms
+    '9SML': {'chains': 2, 'residues': 120, 'format': 'pdb'},
+    # about 11 000 atoms
+    '9MED': {'chains': 4, 'residues': 300, 'format': 'pdb'},
+    # about 43 000 atoms, gzipped
+    '9LRG': {'chains': 8, 'residues': 600, 'format': 'pdb.gz'},
+    # a large assembly, about 135 000 atoms: too many atoms for the serial
+    # numbers of the pdb format, so it is written in mmCIF
+    '9ASM': {'chains': 60, 'residues': 250, 'format': 'cif'},
+}
+
+# the synthetic families of the domains
+FAMILIES = [('PF90001', 'BenchA'), ('PF90002', 'BenchB'),
+        ('PF90003', 'BenchC'), ('PF90004', 'BenchD'), ('PF90005', 'BenchE'),
+        ('PF90006', 'BenchF')]
+
+CHAIN_IDS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+
+# a lysine, the atoms are placed around the position of the residue
+RESIDUE = [('N', 'N', -0.9, 0.6), ('CA', 'C', 0.0, 0.0), ('C', 'C', 0.9, 0.6),
+        ('O', 'O', 1.2, 1.6), ('CB', 'C', 0.0, -1.0), ('CG', 'C', 0.4, -1.6),
+        ('CD', 'C', 0.8, -2.2), ('CE', 'C', 1.2, -2.8), ('NZ', 'N', 1.6, -3.4)]
+
+# the chains are helices on a square grid, close enough to be in contact
+SPACING = 11.0
+RADIUS = 2.3
+RISE = 1.5
+TURN = math.radians(100)
+
+
+def domains(pdb_id):
+    """Returns the domains of a synthetic structure, dicts {id, name, chain,
+    start, end} like the ones of structure.get_domains()."""
+    spec = SPECS[pdb_id]
+    half = spec['residues'] / 2
+    annotations = []
+    for c in range(spec['chains']):
+        for k, (start, end) in enumerate([(1, half),
+                (half+1, spec['residues'])]):
+            pfam_id, name = FAMILIES[(c+k) % len(FAMILIES)]
+            annotations.append({'id': pfam_id, 'name': name,
+                'chain': CHAIN_IDS[c], 'start': str(start), 'end': str(end)})
+    return annotations
+
+
+def hmmer_xml(pdb_id):
+    """Returns the rcsb hmmer xml of a synthetic structure."""
+    lines = ["<?xml version='1.0' standalone='no' ?>", '<hmmer3>']
+    for domain in domains(pdb_id):
+        lines.append('<pfamHit pdbId="'+pdb_id+'" pdbResNumStart="'+
+                domain['start']+'" pdbResNumEnd="'+domain['end']+
+                '" pfamAcc="'+domain['id']+'.1" pfamName="'+domain['name']+
+                '" pfamDesc="synthetic family" eValue="1.0E-20" chainId="'+
+                domain['chain']+'" />')
+    lines.append('</hmmer3>')
+    return '\n'.join(lines)+'\n'
+
+
+def atoms(pdb_id):
+    """Yields the atoms of a synthetic structure: (serial, name, element,
+    chain, residue number, x, y, z)."""
+    spec = SPECS[pdb_id]
+    side = int(math.ceil(math.sqrt(spec['chains'])))
+    serial = 0
+    for c in range(spec['chains']):
+        axis_x = (c % side) * SPACING
+        axis_y = (c / side) * SPACING
+        for number in range(1, spec['residues']+1):
+            angle = number * TURN
+            x = axis_x + RADIUS * math.cos(angle)
+            y = axis_y + RADIUS * math.sin(angle)
+            z = number * RISE
+            for name, element, dx, dz in RESIDUE:
+                serial += 1
+                yield (serial, name, element, CHAIN_IDS[c], number,
+                        x + dx * math.cos(angle), y + dx * math.sin(angle),
+                        z + dz * 0.3)
+
+
+def filename(pdb_id):
+    """Returns the file name of a synthetic structure, the one searched by
+    structure.locate_file()."""
+    spec = SPECS[pdb_id]
+    if spec['format'] == 'cif':
+        return pdb_id.lower()+'.cif'
+    if spec['format'] == 'pdb.gz':
+        return 'pdb'+pdb_id.lower()+'.ent.gz'
+    return 'pdb'+pdb_id.lower()+'.ent'
+
+
+def write(pdb_id, directory):
+    """Writes a synthetic structure in a directory and returns its path."""
+    path = os.path.join(directory, filename(pdb_id))
+    if SPECS[pdb_id]['format'] == 'cif':
+        lines = _cif_lines(pdb_id)
+    else:
+        lines = _pdb_lines(pdb_id)
+    if path.endswith('.gz'):
+        handle = gzip.open(path, 'wb')
+    else:
+        handle = open(path, 'w')
+    try:
+        for line in lines:
+            handle.write(line+'\n')
+    finally:
+        handle.close()
+    return path
+
+
+def write_all(directory):
+    """Writes all the synthetic structures, returns {pdb id: path}."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = {}
+    for pdb_id in sorted(SPECS):
+        paths[pdb_id] = write(pdb_id, directory)
+    return paths
+
+
+def _pdb_lines(pdb_id):
+    """Yields the lines of a pdb file."""
+    yield 'HEADER    SYNTHETIC STRUCTURE                     01-JAN-00   '+ \
+            pdb_id
+    for serial, name, element, chain, number, x, y, z in atoms(pdb_id):
+        yield '%-6s%5d %-4s %3s %1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f' \
+                '          %2s' % ('ATOM', serial, ' '+name, 'LYS', chain,
+                        number, x, y, z, 1.0, 20.0, element)
+    yield 'END'
+
+
+def _cif_lines(pdb_id):
+    """Yields the lines of a mmCIF file."""
+    yield 'data_'+pdb_id
+    yield 'loop_'
+    for field in ['group_PDB', 'id', 'type_symbol', 'label_atom_id',
+            'label_alt_id', 'label_comp_id', 'label_asym_id',
+            'label_entity_id', 'label_seq_id', 'pdbx_PDB_ins_code',
+            'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy', 'B_iso_or_equiv',
+            'auth_seq_id', 'auth_asym_id', 'pdbx_PDB_model_num']:
+        yield '_atom_site.'+field
+    for serial, name, element, chain, number, x, y, z in atoms(pdb_id):
+        yield 'ATOM %d %s %s . LYS %s 1 %d ? %.3f %.3f %.3f 1.00 20.00 %d ' \
+                '%s 1' % (serial, element, name, chain, number, x, y, z,
+                        number, chain)
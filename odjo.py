@@ -3,8 +3,11 @@
 # M2BIBS ITPP project
 # Ariane Odjo & Nourdine Bah
 
-import os, sys
+import os, re, sys
+import atexit
+import logging
 import odjo
+from odjo.instrument import shared_instrument, json_formatter
 
 # a function that opens and reads a file
 def file2list(filename):
@@ -13,96 +16,385 @@ def file2list(filename):
     f.close()
     return l
 
+# a function that removes a flag from the arguments list
+def pop_flag(args, flag):
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
+
+# a function that removes an option and its value from the arguments list
+def pop_option(args, option, default):
+    if option in args:
+        index = args.index(option)
+        # the option is the last argument, without its value
+        if index+1 >= len(args):
+            print "Missing value for "+option
+            print ""
+            usage()
+            sys.exit(1)
+        value = args[index+1]
+        del args[index:index+2]
+        return value
+    return default
+
+# a function that writes the measures of the run
+def write_profile():
+    shared_instrument.write_summary('profile.json')
+    shared_instrument.write_trace('profile.trace.json')
+    print "Profile written in profile.json and profile.trace.json"
+
+# a function that prints the usage
+def usage():
+    print "Usage:"
+    print ""
+    print "For an unique PFAM identifier:"
+    print "\t./odjo.py <PFAM identifier>"
+    print ""
+    print "For example, you can try:"
+    print "\t./odjo.py PF00931 (35 structures, fast)"
+    print "\t./odjo.py PF02180 (92 structures, longer)"
+    print "\t./odjo.py PF00452 (147 structures, longer)"
+    print ""
+    print "For an unique PFAM identifier with iPFAM:"
+    print "\t./odjo.py <PFAM identifier> --ipfam"
+    print ""
+    print "For several PFAM identifiers at once (with or without iPFAM),"
+    print "the files of each one are written in families/<PFAM id>:"
+    print "\t./odjo.py <PFAM identifier> <PFAM identifier>... [--ipfam]"
+    print "\t\t[--families-dir <dir>]"
+    print ""
+    print "For a list of PDB identifiers (one per line):"
+    print "\t./odjo.py <file with list of PDB identifier>"
+    print ""
+    print "For example, you can try:"
+    print "\t./odjo.py list.txt"
+    print ""
+    print "As a service, the jobs are sent to http://127.0.0.1:<port>/jobs:"
+    print "\t./odjo.py --serve <port> [--jobs-dir <dir>]"
+    print ""
+    print "Options:"
+    print "\t--jobs <N>\tanalyses the PDB structures in N processes"
+    print "\t--engine <name>\tkdtree (default), compact (keeps the"
+    print "\t\t\tstructures in .npy files), nsearch (original) or"
+    print "\t\t\tensemble (all the models of the NMR structures)"
+    print "\t--occupancy <f>\twith the ensemble engine, the fraction of"
+    print "\t\t\tthe models where two domains must be in contact"
+    print "\t\t\t(default 0.5)"
+    print "\t--checkpoints <file>\trecords the results of each PDB entry"
+    print "\t\t\tin this file (default checkpoints.sqlite)"
+    print "\t--no-checkpoints\tcomputes again all the PDB entries"
+    print "\t--downloads <N>\tdownloads N PDB files in advance"
+    print "\t--connections <N>\tretrieves N annotations at the same time"
+    print "\t--rate <N>\tsends at most N requests per second to rcsb"
+    print "\t--rcsb <url>\tuses another rcsb rest server"
+    print "\t--store <file>\tkeeps the annotations and the rcsb searches"
+    print "\t\t\tin this file"
+    print "\t--ttl <days>\tdownloads again the annotations and searches"
+    print "\t\t\tolder than this (default 30)"
+    print "\t--refresh\tdownloads again all the annotations and searches"
+    print "\t--images <N>\tdraws a png image of each interaction with N"
+    print "\t\t\tpymol processes (in the PDB files directory)"
+    print "\t--records <file>\twrites the contacts of each interaction"
+    print "\t\t\t(residues, atoms, distance) in a json lines file"
+    print "\t--cluster\tsearches once the PDB entries with the same"
+    print "\t\t\tdomains and chain sequences (list of PDB identifiers)"
+    print "\t--weighting <p>\tthe weight of a group of entries: members"
+    print "\t\t\t(default, its size), cluster (1) or sqrt (square root"
+    print "\t\t\tof its size)"
+    print "\t--profile\twrites the timers and counters of each stage in"
+    print "\t\t\tprofile.json and a timeline in profile.trace.json"
+    print "\t--log-format <f>\ttext (default) or json progress messages"
+    print "\t--quiet\t\tonly prints the warnings"
+    print "\t--sparse\tbuilds the matrix as a sparse matrix"
+    print "\t--matrix-formats <list>\talso writes the matrix in these"
+    print "\t\t\tformats: npy, npz and/or coo (comma separated)"
+    print "\t--graph-formats <list>\talso writes the graph in these"
+    print "\t\t\tformats: dot, graphml and/or edges (comma separated)"
+    print "\t--layout <prog>\tthe graphviz layout: dot, sfdp... (default"
+    print "\t\t\tauto, sfdp for the large graphs)"
+    print "\t--graph-threshold <f>\tonly draws the edges with at least"
+    print "\t\t\tthis frequency"
+    print "\t--graph-top <N>\tonly draws the N nodes with the highest"
+    print "\t\t\tfrequencies"
+    print "\t--no-render\tonly writes the graph files, not graph.png"
+    print ""
+    print "Sharding options (list of PDB identifiers only, not with"
+    print "--cluster):"
+    print "\t--shards <N>\tsplits the list in N shards, runs the"
+    print "\t\t\tmissing ones and merges them"
+    print "\t--shard-index <i>\truns only the shard i (0 to N-1)"
+    print "\t--merge\t\tonly merges the shards already done"
+    print "\t--shard-dir <dir>\tthe partial results directory, shared"
+    print "\t\t\tby all the jobs (default shards)"
+
 
 def main():
 
+    # the options are removed from sys.argv before checking the arguments
+    # the progress messages, as text or as json lines
+    handler = logging.StreamHandler(sys.stdout)
+    if pop_option(sys.argv, '--log-format', 'text') == 'json':
+        handler.setFormatter(json_formatter())
+    logger = logging.getLogger('odjo')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    if pop_flag(sys.argv, '--quiet'):
+        logger.setLevel(logging.WARNING)
+    # the timers and counters of the stages are written at the end
+    if pop_flag(sys.argv, '--profile'):
+        shared_instrument.enable()
+        atexit.register(write_profile)
+    # number of worker processes for the analysis
+    jobs = int(pop_option(sys.argv, '--jobs', 1))
+    # the contact search method (kdtree, compact or nsearch)
+    engine = pop_option(sys.argv, '--engine', 'kdtree')
+    # with the ensemble engine, the fraction of the models where two domains
+    # must be in contact
+    occupancy = float(pop_option(sys.argv, '--occupancy', 0.5))
+    # the results of each pdb entry are recorded, so a search can be resumed
+    checkpoints = odjo.checkpoint(pop_option(sys.argv, '--checkpoints',
+        'checkpoints.sqlite'))
+    if pop_flag(sys.argv, '--no-checkpoints'):
+        checkpoints = None
+    # number of pdb files downloaded in advance at the same time
+    downloads = int(pop_option(sys.argv, '--downloads', 4))
+    # the annotations are kept in a local store
+    store = odjo.store(pop_option(sys.argv, '--store', 'annotations.sqlite'),
+            ttl=float(pop_option(sys.argv, '--ttl', 30))*24*3600,
+            refresh=pop_flag(sys.argv, '--refresh'))
+    # the annotations are retrieved with several connections to rcsb
+    fetcher = odjo.fetcher(
+            base_url=pop_option(sys.argv, '--rcsb',
+                'http://www.rcsb.org/pdb/rest/'),
+            concurrency=int(pop_option(sys.argv, '--connections', 8)),
+            rate=float(pop_option(sys.argv, '--rate', 0)),
+            store=store)
+    # the matrix can also be written in binary formats (npy, npz, coo)
+    matrix_formats = pop_option(sys.argv, '--matrix-formats', '')
+    matrix_formats = [f for f in matrix_formats.split(',') if f]
+    # a sparse matrix for the large lists of domains
+    sparse = pop_flag(sys.argv, '--sparse')
+    # the graph files, its layout and its pruning for the large networks
+    graph_formats = pop_option(sys.argv, '--graph-formats', '')
+    graph_top = pop_option(sys.argv, '--graph-top', None)
+    drawer = odjo.graph(layout=pop_option(sys.argv, '--layout', 'auto'),
+            threshold=float(pop_option(sys.argv, '--graph-threshold', 0)),
+            top=graph_top and int(graph_top),
+            formats=[f for f in graph_formats.split(',') if f],
+            render=not pop_flag(sys.argv, '--no-render'))
+    # the list mode can be split in shards run as independent jobs
+    shards = int(pop_option(sys.argv, '--shards', 0))
+    shard_index = pop_option(sys.argv, '--shard-index', None)
+    shard_dir = pop_option(sys.argv, '--shard-dir', 'shards')
+    merge = pop_flag(sys.argv, '--merge')
+    # the index must be the one of a shard
+    if shard_index is not None and (not re.match(r'^\d+$', shard_index)
+            or int(shard_index) >= shards):
+        if shards > 0:
+            print "Invalid shard index: "+shard_index+" (0 to "+ \
+                    str(shards-1)+" with --shards "+str(shards)+")"
+        else:
+            print "--shard-index needs --shards"
+        print ""
+        usage()
+        sys.exit(1)
+    # the png images of the interactions are drawn by pymol workers
+    renderer = None
+    images = int(pop_option(sys.argv, '--images', 0))
+    if images and not odjo.representation().available():
+        # pymol is optional, only the images are not drawn
+        print "pymol is not installed, the images are not drawn"
+    elif images:
+        renderer = odjo.renderer(images)
+        atexit.register(renderer.close)
+    # the contacts of each structure are written in a records file
+    recorder = None
+    records = pop_option(sys.argv, '--records', None)
+    if records is not None:
+        recorder = odjo.recorder(records)
+        atexit.register(recorder.close)
+    # the list mode can also group the entries with the same content, and
+    # count each group with a weight (members, cluster or sqrt)
+    cluster = pop_flag(sys.argv, '--cluster')
+    weighting = pop_option(sys.argv, '--weighting', 'members')
+    # the daemon mode, the jobs are sent to a local http api
+    serve = pop_option(sys.argv, '--serve', None)
+    # the batch mode writes the files of each PFAM id in this directory
+    families_dir = pop_option(sys.argv, '--families-dir', 'families')
+    jobs_dir = pop_option(sys.argv, '--jobs-dir', 'jobs')
+
+    if serve is not None:
+        """If a port is given with the --serve option, then run the jobs
+        sent to the http api with warm caches until the program is
+        stopped."""
+        server = odjo.service(jobs_dir, fetcher=fetcher, store=store,
+                drawer=drawer, sparse=sparse, formats=matrix_formats,
+                deduplication=odjo.dedup(cluster, weighting,
+                    downloads=downloads),
+                engine=engine, jobs=jobs, downloads=downloads,
+                checkpoints=checkpoints, renderer=renderer, recorder=recorder,
+                occupancy=occupancy)
+        try:
+            server.serve(int(serve))
+        except KeyboardInterrupt:
+            print "Stopped"
+        return
+
     if len(sys.argv) == 2 and not os.path.isfile(sys.argv[1]):
         """If a PFAM id is given as argument, then run the search on this
         id."""
-        # creates a domain object with the pfam id given as argument
-        domain = odjo.domain(sys.argv[1])
+        # creates a domain object with the pfam id given as argument, its
+        # search is kept in the store as the ones of the other modes
+        domain = odjo.domain(sys.argv[1], store)
+        domain.rcsb_resturl = fetcher.base_url
         # gets the pdb ids that correspond to the pfam domain
         pdb_ids = domain.get_pdb_ids()
         # creates an interaction object/class with these informations
         # "whatever" because the last argument is useless
-        inter = odjo.interaction(domain.pfam_id, pdb_ids, "whatever")
+        inter = odjo.interaction(domain.pfam_id, pdb_ids, "whatever",
+                engine=engine, jobs=jobs, downloads=downloads,
+                checkpoints=checkpoints, renderer=renderer, recorder=recorder,
+                occupancy=occupancy)
         # gets domains annotations for all pdb that correspond to the pfam
         # domain of interest
-        annot = inter.get_annotations()
+        annot = inter.get_annotations(fetcher)
         # searches for interacting domains
         analysis = inter.analysis_2(annot)
         # calculate the frequencies for each pair of interacting dommains
         freq = inter.frequencies(analysis)
         # creates a graph based on the frequencies
-        odjo.graph().draw(freq)
+        drawer.draw(freq)
         # creates a matrix based on the frequencies
-        odjo.matrixcsv().frequencies_matrix(freq)
+        odjo.matrixcsv().frequencies_matrix(freq, sparse=sparse,
+                formats=matrix_formats)
     elif len(sys.argv) == 3 and not os.path.isfile(sys.argv[1]) and \
             sys.argv[2] == '--ipfam':
         """If a PFAM id is given as argument with the --ipfam option, then
         run the search on this id, but the search will be limited to the
         domains recorded in the iPFAM database."""
-        domain = odjo.domain(sys.argv[1])
+        domain = odjo.domain(sys.argv[1], store)
+        domain.rcsb_resturl = fetcher.base_url
         # gets the pdb ids that correspond to the pfam domain
         pdb_ids = domain.get_pdb_ids()
         # via iPFAM, gets the domains that interact with the pfam domain
         interacting_domains = domain.get_interactions()
         # creates an interaction object/class with these informations
-        inter = odjo.interaction(domain.pfam_id, pdb_ids, interacting_domains)
+        inter = odjo.interaction(domain.pfam_id, pdb_ids, interacting_domains,
+                engine=engine, jobs=jobs, downloads=downloads,
+                checkpoints=checkpoints, renderer=renderer, recorder=recorder,
+                occupancy=occupancy)
         # gets domains annotations for all pdb that correspond to the pfam
         # domain of interest
-        annot = inter.get_annotations()
+        annot = inter.get_annotations(fetcher)
         # searches for interacting domains within the iPFAM list
         analysis = inter.analysis(annot)
         # calculate the frequencies for each pair of interacting dommains
         freq = inter.frequencies(analysis)
         # creates a graph based on the frequencies
-        odjo.graph().draw(freq)
+        drawer.draw(freq)
         # creates a matrix based on the frequencies
-        odjo.matrixcsv().frequencies_matrix(freq)
+        odjo.matrixcsv().frequencies_matrix(freq, sparse=sparse,
+                formats=matrix_formats)
     elif len(sys.argv) == 2 and os.path.isfile(sys.argv[1]):
         """If the argument is a file containing a list of PDB id, then run the
         program of all this PDB ids list without the iPFAM stuff."""
         # parses the file given as argument
         pdb_ids = file2list(sys.argv[1])
+        # the duplicate entries are searched only once
+        try:
+            deduplication = odjo.dedup(cluster, weighting,
+                    downloads=downloads)
+        except ValueError, error:
+            print str(error)
+            sys.exit(1)
+        pdb_ids = deduplication.unique(pdb_ids)
+        if shards:
+            # the clusters would be made inside each shard, a group of
+            # entries split between two shards would be counted twice
+            if cluster:
+                print "--cluster can't be used with --shards"
+                sys.exit(1)
+            sharding = odjo.shard(shard_dir, shards)
+            # runs one shard, the merge is done by another command
+            if shard_index is not None:
+                sharding.run(pdb_ids, int(shard_index), fetcher,
+                        deduplication, engine=engine, jobs=jobs,
+                        downloads=downloads, checkpoints=checkpoints,
+                        renderer=renderer, recorder=recorder,
+                        occupancy=occupancy)
+                print "Shard "+shard_index+" written in "+ \
+                        sharding.filename(int(shard_index))
+                return
+            # runs here the shards that are not done yet
+            if not merge:
+                for index in sharding.missing(pdb_ids, deduplication):
+                    sharding.run(pdb_ids, index, fetcher, deduplication,
+                            engine=engine, jobs=jobs, downloads=downloads,
+                            checkpoints=checkpoints, renderer=renderer,
+                            recorder=recorder, occupancy=occupancy)
+            try:
+                aggregation = sharding.merge(pdb_ids, deduplication)
+            except ValueError, error:
+                print "Can't merge the shards: "+str(error)
+                sys.exit(1)
+            freq = aggregation.records()
+            # creates a graph and a matrix based on the frequencies
+            drawer.draw_list(freq)
+            odjo.matrixcsv().frequencies_matrix(freq, sparse=sparse,
+                    formats=matrix_formats)
+            return
         # creates a structure object based on the pdb id of the list, but it
         # could have been whatever...
         struct = odjo.structure(pdb_ids[0])
         # gets domains annotations for all pdb ids of the list
-        annotations = struct.get_domains_from_list(pdb_ids)
+        annotations = struct.get_domains_from_list(pdb_ids, fetcher)
+        # only one entry of each group of identical entries is searched
+        annotations, weights = deduplication.reduce(annotations)
         # creates an interaction object/class
         # the arguments are useless
-        inter = odjo.interaction("whatever", "whatever", "whatever")
-        # searches for interacting domains
-        analysis = inter.analysis_3(annotations)
-        # calculate the frequencies for each pair of interacting dommains
-        freq = inter.frequencies_from_list(analysis)
+        inter = odjo.interaction("whatever", "whatever", "whatever",
+                engine=engine, jobs=jobs, downloads=downloads,
+                checkpoints=checkpoints, renderer=renderer, recorder=recorder,
+                occupancy=occupancy)
+        # searches for interacting domains and counts them as the structures
+        # are searched, then calculates the frequencies for each pair of
+        # interacting dommains
+        freq = inter.aggregate_3(annotations, weights=weights).records()
         # creates a graph based on the frequencies
-        odjo.graph().draw_list(freq)
+        drawer.draw_list(freq)
         # creates a matrix based on the frequencies
-        odjo.matrixcsv().frequencies_matrix(freq)
+        odjo.matrixcsv().frequencies_matrix(freq, sparse=sparse,
+                formats=matrix_formats)
+    elif len([arg for arg in sys.argv[1:] if arg != '--ipfam']) > 1 and \
+            all(re.match(r'^PF\d{5}$', arg) for arg in sys.argv[1:]
+                    if arg != '--ipfam'):
+        """If several PFAM ids are given as arguments, then run the search
+        on all of them at once: each structure is fetched, parsed and
+        searched once, and each id gets its own files."""
+        pfam_ids = [arg for arg in sys.argv[1:] if arg != '--ipfam']
+        families = odjo.batch(pfam_ids, store=store, fetcher=fetcher,
+                ipfam='--ipfam' in sys.argv, directory=families_dir,
+                drawer=drawer, sparse=sparse, formats=matrix_formats,
+                engine=engine, jobs=jobs, downloads=downloads,
+                checkpoints=checkpoints, renderer=renderer, recorder=recorder,
+                occupancy=occupancy)
+        families.run()
+        for pfam_id in families.pfam_ids:
+            print pfam_id+": "+str(len(families.pdb_ids[pfam_id]))+ \
+                    " structures, written in "+ \
+                    families.family_directory(pfam_id)
     else:
         """In all other cases, prints the usage."""
-        print "Usage:"
-        print ""
-        print "For an unique PFAM identifier:"
-        print "\t./odjo.py <PFAM identifier>"
-        print ""
-        print "For example, you can try:"
-        print "\t./odjo.py PF00931 (35 structures, fast)"
-        print "\t./odjo.py PF02180 (92 structures, longer)"
-        print "\t./odjo.py PF00452 (147 structures, longer)"
-        print ""
-        print "For an unique PFAM identifier with iPFAM:"
-        print "\t./odjo.py <PFAM identifier> --ipfam"
-        print ""
-        print "For a list of PDB identifiers (one per line):"
-        print "\t./odjo.py <file with list of PDB identifier>"
-        print ""
-        print "For example, you can try:"
-        print "\t./odjo.py list.txt"
+        usage()
         sys.exit()
 
+    # how many annotations came from the local store
+    stats = store.stats()
+    print "Annotations store: "+str(stats['hits'])+" hits, "+ \
+            str(stats['misses'])+" misses ("+str(stats['expired'])+ \
+            " expired)"
+
 
 if __name__ == '__main__':
     main()
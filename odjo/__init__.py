@@ -1,6 +1,49 @@
-from .structure import structure
-from .domain import domain
-from .interaction import interaction
-from .graph import graph
-from .matrixcsv import matrixcsv
-from .representation import representation
+import sys
+import types
+import logging
+import importlib
+
+# the package only logs, the program chooses where the messages go
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+# each class of the package is in the module of the same name. The modules
+# are imported when their class is used for the first time, so a run only
+# loads the backends (Bio.PDB, scipy, lxml, pymol...) of its stages.
+_classes = ['structure', 'domain', 'interaction', 'graph', 'matrixcsv',
+        'representation', 'cache', 'contact', 'executor', 'fetcher', 'store',
+        'prefetcher', 'compact', 'interval_index', 'checkpoint', 'aggregate',
+        'shard', 'instrument', 'renderer', 'service', 'recorder',
+        'dedup', 'batch', 'ensemble']
+
+class _package(types.ModuleType):
+
+    """
+    The odjo package, its classes are imported on demand.
+    """
+
+    def __getattr__(self, name):
+        if name not in _classes:
+            raise AttributeError("'module' object has no attribute '"+name+"'")
+        module = importlib.import_module('.'+name, self.__name__)
+        value = getattr(module, name)
+        types.ModuleType.__setattr__(self, name, value)
+        return value
+
+    def __getattribute__(self, name):
+        value = types.ModuleType.__getattribute__(self, name)
+        # the import of a module adds it in the package, the attribute is its
+        # class
+        if isinstance(value, types.ModuleType) and name in _classes:
+            value = getattr(value, name)
+            types.ModuleType.__setattr__(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_classes))
+
+
+_module = _package(__name__)
+_module.__dict__.update(globals())
+# the original module must be kept, its globals would be cleared otherwise
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
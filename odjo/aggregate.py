@@ -0,0 +1,77 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" aggregate class """
+
+from collections import Counter
+
+class aggregate:
+
+    """
+    This class counts the interacting domains of each domain. Each contact
+    event is counted once in a Counter, so the frequencies are computed in
+    linear time, and the partial aggregates of several runs (or shards, or
+    processes) can be merged.
+    """
+
+    def __init__(self):
+        # domain -> Counter of its interacting domains
+        self.counts = {}
+        # the domains in the order they have been seen
+        self.names = []
+
+    def add(self, name_1, name_2, weight=1):
+        """Counts an interaction of the domain name_1 with the domain
+        name_2."""
+        if name_1 not in self.counts:
+            self.counts[name_1] = Counter()
+            self.names.append(name_1)
+        self.counts[name_1][name_2] += weight
+
+    def add_analysis(self, analysis):
+        """Counts the interactants of an interaction analysis dict
+        {name, interactants}, or of a list of such dicts."""
+        if isinstance(analysis, dict):
+            analysis = [analysis]
+        for entry in analysis:
+            for interactant in entry['interactants']:
+                self.add(entry['name'], interactant)
+
+    def merge(self, other):
+        """Adds the counts of another aggregate to this one."""
+        for name in other.names:
+            for interactant, count in other.counts[name].items():
+                self.add(name, interactant, count)
+        return self
+
+    def get_counts(self):
+        """Returns a dict {domain: {interacting domain: count}}."""
+        counts = {}
+        for name in self.names:
+            counts[name] = dict(self.counts[name])
+        return counts
+
+    def get_denominators(self):
+        """Returns a dict {domain: number of interactions}, the denominators
+        of the frequencies."""
+        denominators = {}
+        for name in self.names:
+            denominators[name] = sum(self.counts[name].values())
+        return denominators
+
+    def records(self):
+        """Returns the frequencies of the interaction pairs, a list of dicts
+        {domain_1, domain_2, frequency}."""
+        frequencies = []
+        for name in self.names:
+            counter = self.counts[name]
+            total = sum(counter.values())
+            # sorted, so the outputs don't depend on the hash order
+            for interactant in sorted(counter):
+                frequency = float(counter[interactant]) / float(total)
+                entry = {}
+                entry['domain_1'] = name
+                entry['domain_2'] = interactant
+                entry['frequency'] = str(round(frequency, 2))
+                frequencies.append(entry)
+        return frequencies
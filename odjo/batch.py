@@ -0,0 +1,185 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" batch class """
+
+import os
+import json
+import logging
+
+# local imports
+from .structure import structure
+from .domain import domain
+from .interaction import interaction
+from .graph import graph
+from .matrixcsv import matrixcsv
+
+logger = logging.getLogger(__name__)
+
+class batch:
+
+    """
+    This class searches the interactions of several PFAM domains at once (a
+    whole family, like PF00452, PF02180 and PF00931). The PDB ids of all
+    the domains come from one rcsb search, their annotations are fetched
+    once, and each structure of the union is parsed and searched once for
+    all the domains of interest it contains. A structure belongs to the
+    PDB set of a domain if the domain is in its annotations. Each domain
+    gets its own frequencies, matrix and graph, the same as a search on
+    this domain alone.
+
+    @param pfam_ids: the PFAM ids of the domains of interest
+    @type pfam_ids: list
+
+    @param store: the local store of the annotations, the iPFAM tables and
+    the rcsb searches
+    @type store: store
+
+    @param fetcher: the fetcher of the annotations
+    @type fetcher: fetcher
+
+    @param ipfam: only searches the iPFAM partners of each domain, as the
+    --ipfam option
+    @type ipfam: bool
+
+    @param directory: the output directory, each domain writes its files in
+    its own subdirectory
+    @type directory: string
+
+    @param drawer: the graph writer, a default one if None
+    @type drawer: graph
+
+    @param sparse: builds the matrices as sparse matrices
+    @type sparse: bool
+
+    @param formats: the other formats of the matrices (npy, npz, coo)
+    @type formats: list
+
+    The other options are given to the interaction object (engine, jobs,
+    downloads, checkpoints, renderer...).
+    """
+
+    def __init__(self, pfam_ids, store=None, fetcher=None, ipfam=False,
+            directory='families', drawer=None, sparse=False, formats=[],
+            **options):
+        # each domain once, in order
+        self.pfam_ids = []
+        for pfam_id in pfam_ids:
+            if pfam_id not in self.pfam_ids:
+                self.pfam_ids.append(pfam_id)
+        self.store = store
+        self.fetcher = fetcher
+        self.ipfam = ipfam
+        self.directory = directory
+        self.drawer = drawer or graph()
+        self.sparse = sparse
+        self.formats = formats
+        self.options = options
+        # PFAM id -> PDB ids of the domain
+        self.pdb_ids = {}
+
+    def get_pdb_ids(self):
+        """Returns the union of the PDB ids of the domains, with one rcsb
+        search."""
+        search = domain(self.pfam_ids[0], self.store)
+        if self.fetcher is not None:
+            search.rcsb_resturl = self.fetcher.base_url
+        return search.get_pdb_ids_from_list(self.pfam_ids)
+
+    def get_partners(self):
+        """Returns a dict {PFAM id: sorted list of its iPFAM partners}."""
+        if self.store is not None:
+            partners = domain(self.pfam_ids[0],
+                    self.store).get_interactions_from_list(self.pfam_ids)
+        else:
+            partners = {}
+            for pfam_id in self.pfam_ids:
+                partners[pfam_id] = domain(pfam_id).get_interactions()
+        for pfam_id in self.pfam_ids:
+            partners[pfam_id] = sorted(partners[pfam_id] or [])
+        return partners
+
+    def get_entries(self, pdb_ids):
+        """Returns the entries of interaction.aggregate_batch() for a list
+        of PDB ids: the annotations of each structure with its domains of
+        interest. The PDB ids of each domain are kept in self.pdb_ids."""
+        if self.fetcher is not None:
+            all_domains = self.fetcher.get_domains(pdb_ids)
+        partners = None
+        if self.ipfam:
+            partners = self.get_partners()
+        self.pdb_ids = dict((pfam_id, []) for pfam_id in self.pfam_ids)
+        entries = []
+        for pdb_id in pdb_ids:
+            if self.fetcher is not None:
+                # the fetcher has already warned about the missing ids
+                if pdb_id not in all_domains:
+                    continue
+                domains = all_domains[pdb_id]
+            else:
+                domains = structure(pdb_id, self.store).get_domains()
+            ids = set(domain['id'] for domain in domains)
+            families = [pfam_id for pfam_id in self.pfam_ids
+                    if pfam_id in ids]
+            if not families:
+                logger.warning("No domain of interest in %s", pdb_id,
+                        extra={'pdb_id': pdb_id})
+                continue
+            for pfam_id in families:
+                self.pdb_ids[pfam_id].append(pdb_id)
+            entry = {}
+            entry['pdb_id'] = pdb_id
+            entry['domains'] = domains
+            entry['families'] = families
+            if partners is not None:
+                entry['partners'] = dict((pfam_id, partners[pfam_id])
+                        for pfam_id in families)
+            entries.append(entry)
+        return entries
+
+    def run(self):
+        """Searches for the interactions of all the domains and writes the
+        files of each domain, returns a dict {PFAM id: frequencies}."""
+        pdb_ids = self.get_pdb_ids()
+        entries = self.get_entries(pdb_ids)
+        logger.info("%d structures for %d domains", len(entries),
+                len(self.pfam_ids))
+        # the arguments are useless in the batch mode
+        inter = interaction("whatever", pdb_ids, "whatever", **self.options)
+        aggregations = inter.aggregate_batch(entries)
+        all_freq = {}
+        for pfam_id in self.pfam_ids:
+            freq = []
+            if pfam_id in aggregations:
+                freq = aggregations[pfam_id].records()
+            self.write(pfam_id, freq)
+            all_freq[pfam_id] = freq
+        return all_freq
+
+    def write(self, pfam_id, freq):
+        """Writes the frequencies, the matrix and the graph of a domain in
+        its directory."""
+        directory = self.family_directory(pfam_id)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'frequencies.json'), 'w') as handle:
+            json.dump(freq, handle, indent=1)
+        with open(os.path.join(directory, 'pdb_ids.txt'), 'w') as handle:
+            handle.write(''.join(pdb_id+'\n'
+                for pdb_id in self.pdb_ids.get(pfam_id, [])))
+        if not freq:
+            logger.warning("No interaction found for %s", pfam_id,
+                    extra={'pfam_id': pfam_id})
+            return
+        matrixcsv().frequencies_matrix(freq, os.path.join(directory,
+            'matrix.csv'), sparse=self.sparse, formats=self.formats)
+        try:
+            self.drawer.draw(freq, os.path.join(directory, 'graph.png'))
+        except OSError, error:
+            # the other files are still useful without the image
+            logger.warning("Can't draw the graph of %s: %s", pfam_id, error,
+                    extra={'pfam_id': pfam_id})
+
+    def family_directory(self, pfam_id):
+        """Returns the output directory of a domain."""
+        return os.path.join(self.directory, pfam_id)
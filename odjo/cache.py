@@ -0,0 +1,191 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" cache class """
+
+import os
+import numpy
+from collections import OrderedDict
+
+# local imports
+from .structure import structure
+from .compact import compact
+from .interval_index import interval_index
+from .ensemble import ensemble
+from .instrument import shared_instrument
+
+# biopyton imports
+from Bio.PDB import Selection
+from Bio.PDB import NeighborSearch
+
+class cache:
+
+    """
+    This class keeps the parsed PDB models in memory, so a structure file is
+    parsed only once per run even if a lot of domain pairs are tested in it.
+    The least recently used models are dropped when the total number of
+    cached atoms goes over the limit.
+    It also keeps the compact representations of the structures, which are
+    saved in .npy files next to the structure files and memory-mapped by the
+    next runs.
+
+    @param max_atoms: the maximum number of atoms kept in memory
+    @type max_atoms: int
+    """
+
+    def __init__(self, max_atoms=2000000):
+        self.max_atoms = max_atoms
+        # filename -> {'model': ..., 'atoms': [...], 'nsearch': ...,
+        #              'intervals': ..., 'size': n}
+        # ('compact', filename) -> {'compact': ..., 'intervals': ...,
+        #                           'size': n}
+        # ('ensemble', filename) -> {'ensemble': ..., 'intervals': ...,
+        #                            'size': models x n}
+        self.entries = OrderedDict()
+        self.atoms_num = 0
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rel_path, pdb_id):
+        """Returns a dict with the model, its atoms list and its neighbor
+        search tree for a pdb file. The file is parsed only if it is not
+        already in the cache."""
+        if rel_path in self.entries:
+            # moves the entry at the end, it is now the most recent one
+            entry = self.entries.pop(rel_path)
+            self.entries[rel_path] = entry
+            self.hits += 1
+            shared_instrument.count('cache.hits')
+            return entry
+        self.misses += 1
+        shared_instrument.count('cache.misses')
+        model = structure(pdb_id).get_model(rel_path, pdb_id)
+        entry = {}
+        entry['model'] = model
+        entry['atoms'] = Selection.unfold_entities(model, 'A')
+        # the tree is built only when somebody asks for it
+        entry['nsearch'] = None
+        entry['intervals'] = None
+        entry['size'] = len(entry['atoms'])
+        self._add(rel_path, entry)
+        return entry
+
+    def get_compact(self, rel_path, pdb_id):
+        """Returns the compact representation of a structure file. It is
+        read from its .npy file if the file is up to date, otherwise the
+        structure is parsed and the .npy file is written."""
+        key = ('compact', rel_path)
+        if key in self.entries:
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+            self.hits += 1
+            shared_instrument.count('cache.hits')
+            return entry['compact']
+        self.misses += 1
+        shared_instrument.count('cache.misses')
+        cache_path = rel_path+'.npy'
+        if os.path.isfile(cache_path) and \
+                os.path.getmtime(cache_path) >= os.path.getmtime(rel_path):
+            with shared_instrument.stage('compact.load', pdb_id=pdb_id):
+                model = compact(numpy.load(cache_path, mmap_mode='r'))
+        else:
+            model = compact(structure(pdb_id).get_model(rel_path, pdb_id))
+            with shared_instrument.stage('compact.save', pdb_id=pdb_id):
+                model.save(cache_path)
+        entry = {}
+        entry['compact'] = model
+        entry['intervals'] = None
+        entry['size'] = len(model)
+        self._add(key, entry)
+        return model
+
+    def get_ensemble(self, rel_path, pdb_id):
+        """Returns the ensemble of all the models of a structure file."""
+        key = ('ensemble', rel_path)
+        if key in self.entries:
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+            self.hits += 1
+            shared_instrument.count('cache.hits')
+            return entry['ensemble']
+        self.misses += 1
+        shared_instrument.count('cache.misses')
+        with shared_instrument.stage('parse', pdb_id=pdb_id):
+            source = structure(pdb_id).read_structure(rel_path, pdb_id)
+        with shared_instrument.stage('ensemble', pdb_id=pdb_id):
+            models = ensemble(source)
+        entry = {}
+        entry['ensemble'] = models
+        entry['intervals'] = None
+        entry['size'] = models.models_num * len(models)
+        self._add(key, entry)
+        return models
+
+    def get_model(self, rel_path, pdb_id):
+        """Returns the first model of a pdb file."""
+        return self.get(rel_path, pdb_id)['model']
+
+    def get_atoms(self, rel_path, pdb_id):
+        """Returns all the atoms of the first model of a pdb file."""
+        return self.get(rel_path, pdb_id)['atoms']
+
+    def get_nsearch(self, rel_path, pdb_id):
+        """Returns a NeighborSearch object built on all the atoms of the first
+        model of a pdb file."""
+        entry = self.get(rel_path, pdb_id)
+        if entry['nsearch'] is None:
+            entry['nsearch'] = NeighborSearch(entry['atoms'])
+            shared_instrument.count('atoms.indexed', len(entry['atoms']))
+        return entry['nsearch']
+
+    def get_interval_index(self, rel_path, pdb_id, compact_model=False,
+            ensemble_model=False):
+        """Returns the interval index of the residues of the first model (or
+        of the compact model, or of the ensemble) of a pdb file, it is built
+        once and used for all the domains of the structure."""
+        if ensemble_model:
+            key = ('ensemble', rel_path)
+            if key not in self.entries:
+                self.get_ensemble(rel_path, pdb_id)
+            entry = self.entries[key]
+            model = entry['ensemble'].model
+        elif compact_model:
+            key = ('compact', rel_path)
+            if key not in self.entries:
+                self.get_compact(rel_path, pdb_id)
+            entry = self.entries[key]
+            model = entry['compact']
+        else:
+            # the model was usually just taken, it is not counted again
+            if rel_path not in self.entries:
+                self.get(rel_path, pdb_id)
+            entry = self.entries[rel_path]
+            model = entry['model']
+        if entry['intervals'] is None:
+            entry['intervals'] = interval_index(model)
+        return entry['intervals']
+
+    def clear(self):
+        """Empties the cache."""
+        self.entries.clear()
+        self.atoms_num = 0
+
+    # private functions
+
+    def _add(self, key, entry):
+        """Adds an entry and drops the old ones if necessary."""
+        self.entries[key] = entry
+        self.atoms_num += entry['size']
+        self._evict()
+
+    def _evict(self):
+        """Drops the least recently used models until the cache fits in its
+        atoms limit. The last added model is always kept."""
+        while self.atoms_num > self.max_atoms and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            self.atoms_num -= entry['size']
+
+
+# the cache shared by all the interaction objects of a run
+shared_cache = cache()
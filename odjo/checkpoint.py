@@ -0,0 +1,109 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" checkpoint class """
+
+import os
+import json
+import hashlib
+import sqlite3
+
+class checkpoint:
+
+    """
+    This class keeps the result of the analysis of each PDB entry in a
+    SQLite database, as soon as it is computed. A result is keyed by the PDB
+    id, the hash of the structure file, the version of the domain annotation,
+    the contact cutoff and the analysis settings, so a new run only computes
+    the entries that are missing or that have changed. Several processes can
+    use the same database.
+
+    @param filename: the SQLite database file
+    @type filename: string
+    """
+
+    def __init__(self, filename='checkpoints.sqlite'):
+        self.filename = filename
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        # the database is opened when it is used for the first time
+        self.connection = None
+
+    def key(self, pdb_id, rel_path, annotation, cutoff, settings):
+        """Returns the key of a result: (pdb id, file hash, annotation
+        version, cutoff, settings version). The file hash is None if the
+        file doesn't exist."""
+        file_hash = None
+        if rel_path is not None and os.path.isfile(rel_path):
+            file_hash = self.file_hash(rel_path)
+        return (pdb_id, file_hash, self.version(annotation), float(cutoff),
+                self.version(settings))
+
+    def get(self, key):
+        """Returns the result recorded for a key, or None."""
+        row = self._connect().execute('SELECT result FROM results WHERE '
+                'pdb_id = ? AND file_hash IS ? AND annotation = ? AND '
+                'cutoff = ? AND settings = ?', key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """Records the result of a key."""
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO results (pdb_id, '
+                'file_hash, annotation, cutoff, settings, result) VALUES '
+                '(?, ?, ?, ?, ?, ?)', key+(json.dumps(result),))
+        connection.commit()
+
+    def version(self, data):
+        """Returns a hash of data that can be converted to json."""
+        return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+    def file_hash(self, rel_path):
+        """Returns the sha1 of a file, it is computed again only if the size
+        or the modification time of the file have changed."""
+        stat = os.stat(rel_path)
+        connection = self._connect()
+        row = connection.execute('SELECT sha1 FROM files WHERE path = ? AND '
+                'size = ? AND mtime = ?', (rel_path, stat.st_size,
+                    stat.st_mtime)).fetchone()
+        if row is not None:
+            return row[0]
+        sha1 = hashlib.sha1()
+        with open(rel_path, 'rb') as handle:
+            for block in iter(lambda: handle.read(1 << 20), ''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        connection.execute('INSERT OR REPLACE INTO files (path, size, mtime, '
+                'sha1) VALUES (?, ?, ?, ?)', (rel_path, stat.st_size,
+                    stat.st_mtime, digest))
+        connection.commit()
+        return digest
+
+    def close(self):
+        """Closes the database."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    # private functions
+
+    def _connect(self):
+        """Returns the connection to the database, the database is created
+        if necessary."""
+        if self.connection is None:
+            # the other processes can hold the lock for a while
+            self.connection = sqlite3.connect(self.filename, timeout=60)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                    '(pdb_id TEXT, file_hash TEXT, annotation TEXT, '
+                    'cutoff REAL, settings TEXT, result TEXT, PRIMARY KEY '
+                    '(pdb_id, file_hash, annotation, cutoff, settings))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files '
+                    '(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                    'sha1 TEXT)')
+            self.connection.commit()
+        return self.connection
@@ -0,0 +1,100 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" compact class """
+
+import os
+import numpy
+
+class compact:
+
+    """
+    This class is a compact representation of the first model of a
+    structure: only the columns needed by the analysis are kept in NumPy
+    arrays, one row per atom. It is built once from a parsed model and saved
+    in a .npy file next to the structure file, which is memory-mapped by the
+    next runs instead of parsing the structure again.
+
+    @param source: a Bio.PDB model, or a structured array with the fields
+    coords, chain, resseq, icode, hetero and serial (for example a
+    memory-mapped .npy file)
+    @type source: Model or numpy.ndarray
+    """
+
+    # the columns of the atoms array
+    dtype = numpy.dtype([('coords', 'f4', 3), ('chain', 'S4'),
+        ('resseq', 'i4'), ('icode', 'S1'), ('hetero', '?'), ('serial', 'i4')])
+
+    def __init__(self, source):
+        if isinstance(source, numpy.ndarray):
+            atoms = source
+        else:
+            atoms = self._build(source)
+        self.atoms = atoms
+        self.coords = atoms['coords']
+        self.resseq = atoms['resseq']
+        self.icode = atoms['icode']
+        self.serial = atoms['serial']
+        # each atom gets the index of its chain in self.chains
+        self.chains, self.chain_index = numpy.unique(atoms['chain'],
+                return_inverse=True)
+        # and the index of its residue
+        residue_keys = numpy.empty(len(atoms), dtype=[('chain', 'i4'),
+            ('resseq', 'i4'), ('icode', 'S1'), ('hetero', '?')])
+        residue_keys['chain'] = self.chain_index
+        residue_keys['resseq'] = self.resseq
+        residue_keys['icode'] = self.icode
+        residue_keys['hetero'] = atoms['hetero']
+        residues, self.residue_index = numpy.unique(residue_keys,
+                return_inverse=True)
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def save(self, cache_path):
+        """Saves the atoms array in a .npy file, the file is written under
+        another name and then renamed so another process never reads half a
+        file."""
+        tmp_path = cache_path+'.'+str(os.getpid())+'.tmp'
+        with open(tmp_path, 'wb') as handle:
+            numpy.save(handle, numpy.asarray(self.atoms))
+        os.rename(tmp_path, cache_path)
+
+    def get_chain_index(self, chain_id):
+        """Returns the index of a chain, a KeyError is raised if the chain
+        doesn't exist."""
+        position = numpy.searchsorted(self.chains, chain_id)
+        if position >= len(self.chains) or self.chains[position] != chain_id:
+            raise KeyError(chain_id)
+        return position
+
+    def residue_ids(self, indexes):
+        """Returns the list of the (chain, number, insertion code) of the
+        residues of a list of atom indexes, each residue once and in the
+        order of the atoms."""
+        ids = []
+        seen = set()
+        for index in indexes:
+            residue = self.residue_index[index]
+            if residue not in seen:
+                seen.add(residue)
+                ids.append((self.chains[self.chain_index[index]],
+                    int(self.resseq[index]), self.icode[index] or ' '))
+        return ids
+
+    # private functions
+
+    def _build(self, model):
+        """Returns the atoms array of a model."""
+        from Bio.PDB import Selection
+        model_atoms = Selection.unfold_entities(model, 'A')
+        atoms = numpy.empty(len(model_atoms), dtype=self.dtype)
+        for i, atom in enumerate(model_atoms):
+            residue = atom.get_parent()
+            hetero, number, icode = residue.get_id()
+            serial = atom.get_serial_number()
+            if serial is None:
+                serial = -1
+            atoms[i] = (atom.get_coord(), residue.get_parent().get_id(),
+                    number, icode, hetero != ' ', serial)
+        return atoms
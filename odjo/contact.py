@@ -0,0 +1,200 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" contact class """
+
+import numpy
+from scipy.spatial import cKDTree
+from scipy import sparse
+
+# local imports
+from .instrument import shared_instrument
+
+class contact:
+
+    """
+    This class contains methods to detect the atoms in contact between two
+    sets of atoms. Only the atoms of the two sets are indexed, and the search
+    is done in one vectorized query instead of one query per atom.
+
+    @param cutoff: the maximal distance (in angstroms) between two atoms in
+    contact
+    @type cutoff: float
+    """
+
+    def __init__(self, cutoff=5):
+        self.cutoff = cutoff
+
+    def coordinates(self, atoms):
+        """Returns a (n, 3) array with the coordinates of an atoms list."""
+        coords = numpy.empty((len(atoms), 3), dtype='d')
+        for i, atom in enumerate(atoms):
+            coords[i] = atom.get_coord()
+        return coords
+
+    def search(self, atoms_1, atoms_2):
+        """Returns, for each atom of the first list, the list of the indexes
+        of the atoms of the second list that are in contact with it."""
+        return self.search_coords(self.coordinates(atoms_1),
+                self.coordinates(atoms_2))
+
+    def search_coords(self, coords_1, coords_2):
+        """Same as search() with two (n, 3) arrays of coordinates."""
+        # nothing to search
+        if len(coords_1) == 0 or len(coords_2) == 0:
+            return [[] for coords in coords_1]
+        tree_1 = cKDTree(coords_1)
+        tree_2 = cKDTree(coords_2)
+        shared_instrument.count('atoms.indexed', len(coords_1)+len(coords_2))
+        shared_instrument.count('neighbor.queries', len(coords_1))
+        # one query for all the atoms of the first domain
+        return tree_1.query_ball_tree(tree_2, self.cutoff)
+
+    def min_distance(self, coords_1, coords_2, neighbors):
+        """Returns the minimum distance between the atoms in contact (the
+        neighbors found by search_coords()), or None if there is no
+        contact."""
+        pairs_1 = [i for i, indexes in enumerate(neighbors) for j in indexes]
+        pairs_2 = [j for indexes in neighbors for j in indexes]
+        if not pairs_1:
+            return None
+        deltas = numpy.asarray(coords_1[pairs_1], dtype='d') - \
+                numpy.asarray(coords_2[pairs_2], dtype='d')
+        return float(numpy.sqrt((deltas * deltas).sum(axis=1).min()))
+
+    def search_ensemble(self, coords_1, coords_2):
+        """Returns a (models, n1) array with, for each model and each atom
+        of the first set, the distance to the nearest atom of the second set
+        in the same model, inf if there is none within the cutoff. The
+        coordinates are (models, n1, 3) and (models, n2, 3) arrays, all the
+        models are searched in one query."""
+        models_num, atoms_num = coords_1.shape[:2]
+        if atoms_num == 0 or coords_2.shape[1] == 0:
+            return numpy.inf * numpy.ones((models_num, atoms_num))
+        coords_1 = numpy.array(coords_1, dtype='d')
+        coords_2 = numpy.array(coords_2, dtype='d')
+        # the models are moved apart along x, farther than the cutoff, so
+        # one tree holds all of them and no contact is found between two
+        # models
+        low = min(coords_1[..., 0].min(), coords_2[..., 0].min())
+        high = max(coords_1[..., 0].max(), coords_2[..., 0].max())
+        shifts = numpy.arange(models_num) * (high - low + 2*self.cutoff + 1)
+        coords_1[..., 0] += shifts[:, None]
+        coords_2[..., 0] += shifts[:, None]
+        tree = cKDTree(coords_2.reshape(-1, 3))
+        shared_instrument.count('atoms.indexed', coords_2.shape[0] *
+                coords_2.shape[1])
+        shared_instrument.count('neighbor.queries', models_num * atoms_num)
+        # the bound is included, as in search_coords()
+        distances, nearest = tree.query(coords_1.reshape(-1, 3), k=1,
+                distance_upper_bound=numpy.nextafter(self.cutoff,
+                    numpy.inf))
+        return distances.reshape(models_num, atoms_num)
+
+    def occupancy_map(self, coords, domains_atoms):
+        """Returns the domain x domain matrix of the number of models where
+        two domains are in contact, for the (models, atoms, 3) coordinates
+        of an ensemble and a list of domains (arrays of atom indexes)."""
+        domains_num = len(domains_atoms)
+        models = numpy.zeros((domains_num, domains_num), dtype='i')
+        for i in range(domains_num):
+            for j in range(i+1, domains_num):
+                distances = self.search_ensemble(coords[:, domains_atoms[i]],
+                        coords[:, domains_atoms[j]])
+                models[i, j] = models[j, i] = numpy.isfinite(
+                        distances).any(axis=1).sum()
+            # a domain is in contact with itself if it has atoms
+            if len(domains_atoms[i]):
+                models[i, i] = len(coords)
+        return models
+
+    def contact_map(self, domains_atoms):
+        """Returns the domain x domain contact matrices for a list of domains
+        (one atoms list per domain) in one spatial pass. The 'atoms' matrix
+        counts the atom pairs in contact and the 'residues' matrix counts the
+        residue pairs in contact, for each couple of domains."""
+        all_atoms = [atom for domain_atoms in domains_atoms
+                for atom in domain_atoms]
+        # each atom once, the domains can overlap
+        keys = numpy.array([id(atom) for atom in all_atoms], dtype=numpy.uintp)
+        keys, first, rows = numpy.unique(keys, return_index=True,
+                return_inverse=True)
+        atoms = [all_atoms[i] for i in first]
+        # numbers the residues of the labelled atoms
+        parents = numpy.array([id(atom.get_parent()) for atom in atoms],
+                dtype=numpy.uintp)
+        residues, residue_indexes = numpy.unique(parents,
+                return_inverse=True)
+        return self._contact_map(self.coordinates(atoms), rows,
+                self._domain_columns(domains_atoms), residue_indexes,
+                len(domains_atoms))
+
+    def contact_map_indexes(self, coords, domains_atoms, residue_index):
+        """Same as contact_map() for a compact structure: coords are the
+        coordinates of all the atoms, each domain is an array of atom
+        indexes, and residue_index gives the residue of each atom."""
+        # each atom once, the domains can overlap
+        atoms, rows = numpy.unique(numpy.concatenate([numpy.asarray(
+            domain_atoms, dtype='l') for domain_atoms in domains_atoms] +
+            [numpy.empty(0, dtype='l')]), return_inverse=True)
+        # renumbers the residues of the labelled atoms from 0
+        residues, residue_indexes = numpy.unique(residue_index[atoms],
+                return_inverse=True)
+        return self._contact_map(numpy.asarray(coords[atoms], dtype='d'),
+                rows, self._domain_columns(domains_atoms), residue_indexes,
+                len(domains_atoms))
+
+    # private functions
+
+    def _domain_columns(self, domains_atoms):
+        """Returns the domain of each atom of the domains, in the order of
+        the domains."""
+        return numpy.repeat(numpy.arange(len(domains_atoms)),
+                [len(domain_atoms) for domain_atoms in domains_atoms])
+
+    def _contact_map(self, coords, rows, columns, residue_indexes,
+            domains_num):
+        """Returns the contact matrices from the coordinates of the
+        labelled atoms, the (atom, domain) labels as two arrays of rows and
+        columns, and the residue index of each labelled atom."""
+        atoms_num = len(coords)
+        # sparse, the rows of the pairs can be millions on the large
+        # assemblies
+        membership = sparse.csr_matrix((numpy.ones(len(rows), dtype='i'),
+            (rows, columns)), shape=(atoms_num, domains_num))
+        # an atom listed twice in a domain is labelled once
+        membership.data[:] = 1
+        residues_num = 0
+        if atoms_num > 0:
+            residues_num = int(residue_indexes.max()) + 1
+        # the atoms of a residue have the same labels
+        residue_membership = sparse.csr_matrix((numpy.ones(len(rows),
+            dtype='i'), (residue_indexes[rows], columns)),
+            shape=(residues_num, domains_num))
+        residue_membership.data[:] = 1
+        contacts = {}
+        contacts['atoms'] = numpy.zeros((domains_num, domains_num), dtype='i')
+        contacts['residues'] = numpy.zeros((domains_num, domains_num),
+                dtype='i')
+        if atoms_num == 0:
+            return contacts
+        # one self query for all the labelled atoms of the model
+        tree = cKDTree(coords)
+        pairs = tree.query_pairs(self.cutoff, output_type='ndarray')
+        shared_instrument.count('atoms.indexed', atoms_num)
+        shared_instrument.count('neighbor.queries', atoms_num)
+        # each atom is in contact with itself, and each pair is taken in the
+        # two directions
+        itself = numpy.arange(atoms_num)
+        first = numpy.concatenate((pairs[:, 0], pairs[:, 1], itself))
+        second = numpy.concatenate((pairs[:, 1], pairs[:, 0], itself))
+        contacts['atoms'] = membership[first].T.dot(
+                membership[second]).toarray()
+        # the same with the residue pairs, each one counted once
+        residue_pairs = numpy.unique(residue_indexes[first] * residues_num
+                + residue_indexes[second])
+        first = residue_pairs // residues_num
+        second = residue_pairs % residues_num
+        contacts['residues'] = residue_membership[first].T.dot(
+                residue_membership[second]).toarray()
+        return contacts
@@ -0,0 +1,216 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" dedup class """
+
+import json
+import gzip
+import math
+import hashlib
+import logging
+from collections import OrderedDict
+
+# local imports
+from .structure import structure
+from .prefetcher import prefetcher
+from .cache import shared_cache
+from .instrument import shared_instrument
+
+logger = logging.getLogger(__name__)
+
+class dedup:
+
+    """
+    This class removes the redundant entries of a list of PDB ids before the
+    analysis, so they are not fetched, parsed and searched again. The
+    duplicate PDB ids are always collapsed. With the cluster option, the
+    entries with the same content (the same domain annotations on the same
+    chain sequences, whatever the chain names) are also grouped: only the
+    first entry of each cluster is searched, and its interactions are
+    counted with the weight of the cluster.
+
+    @param cluster: groups the entries by content
+    @type cluster: bool
+
+    @param weighting: the weight of a cluster in the frequencies, 'members'
+    (the number of entries of the cluster, the frequencies are the ones of
+    a search of all the entries), 'cluster' (each cluster counts once) or
+    'sqrt' (the square root of the number of entries)
+    @type weighting: string
+
+    @param directory: the directory of the PDB files, the sequences of the
+    chains are read from them
+    @type directory: string
+
+    @param downloads: the number of PDB files downloaded at the same time
+    for the clustering
+    @type downloads: int
+
+    @param models: the cache of the parsed PDB models, the files without
+    SEQRES records are parsed with it (so the analysis reuses them)
+    @type models: cache
+    """
+
+    policies = ['members', 'cluster', 'sqrt']
+
+    def __init__(self, cluster=False, weighting='members',
+            directory='pdb_and_png', downloads=4, models=None):
+        if weighting not in self.policies:
+            raise ValueError('unknown weighting policy: '+weighting+
+                    ' (members, cluster or sqrt)')
+        self.cluster = cluster
+        self.weighting = weighting
+        self.directory = directory
+        self.downloads = downloads
+        if models is None:
+            models = shared_cache
+        self.models = models
+        # representative PDB id -> PDB ids of its cluster
+        self.clusters = OrderedDict()
+        # statistics
+        self.duplicates = 0
+
+    def unique(self, pdb_ids):
+        """Returns the PDB ids of a list without the duplicates (whatever
+        the case) and the empty lines, in order."""
+        seen = set()
+        unique = []
+        for pdb_id in pdb_ids:
+            key = pdb_id.strip().upper()
+            if not key:
+                continue
+            if key in seen:
+                self.duplicates += 1
+                continue
+            seen.add(key)
+            unique.append(pdb_id.strip())
+        if len(unique) < len(pdb_ids):
+            logger.info("%d duplicate PDB ids removed",
+                    len(pdb_ids) - len(unique))
+        shared_instrument.count('dedup.duplicates',
+                len(pdb_ids) - len(unique))
+        return unique
+
+    def reduce(self, annotations):
+        """Returns the annotations of the entries to search (one for each
+        PDB id, or one for each cluster) and a dict {PDB id: weight} of the
+        weights of their interactions."""
+        # the first annotation of each PDB id
+        entries = OrderedDict()
+        for annotation in annotations:
+            entries.setdefault(annotation['pdb_id'].strip().upper(),
+                    annotation)
+        entries = entries.values()
+        self.duplicates += len(annotations) - len(entries)
+        self.clusters = OrderedDict()
+        if not self.cluster:
+            for annotation in entries:
+                self.clusters[annotation['pdb_id']] = [annotation['pdb_id']]
+            return entries, dict((pdb_id, 1) for pdb_id in self.clusters)
+        # content hash -> first entry
+        representatives = {}
+        kept = []
+        with shared_instrument.stage('dedup'):
+            # the PDB files are downloaded in advance
+            prefetch = prefetcher(self.directory, self._locate,
+                    self.downloads)
+            for annotation in prefetch.iterate(entries):
+                pdb_id = annotation['pdb_id']
+                key = self.content_key(annotation)
+                if key in representatives:
+                    self.clusters[representatives[key]].append(pdb_id)
+                    continue
+                representatives[key] = pdb_id
+                self.clusters[pdb_id] = [pdb_id]
+                kept.append(annotation)
+        weights = {}
+        for pdb_id, members in self.clusters.items():
+            weights[pdb_id] = self.weight(len(members))
+        logger.info("%d entries in %d clusters", len(entries), len(kept))
+        shared_instrument.count('dedup.clustered', len(entries) - len(kept))
+        return kept, weights
+
+    def weight(self, size):
+        """Returns the weight of a cluster of size entries."""
+        if self.weighting == 'cluster':
+            return 1
+        if self.weighting == 'sqrt':
+            return math.sqrt(size)
+        return size
+
+    def content_key(self, annotation):
+        """Returns the content hash of an entry: its domain annotations (the
+        PFAM ids and names and the residue ranges) and the sequences of the
+        chains of the domains. The chain names are not used, so the same
+        complex is recognized in other chains."""
+        sequences = self.sequences(annotation['pdb_id'])
+        content = []
+        for domain in annotation['domains']:
+            content.append([domain['id'], domain['name'], domain['start'],
+                domain['end'], sequences.get(domain['chain'], '')])
+        content.sort()
+        return hashlib.sha1(json.dumps(content)).hexdigest()
+
+    def sequences(self, pdb_id):
+        """Returns a dict {chain: sequence} of a structure, the sequences
+        are the residue names separated by '-'. They come from the SEQRES
+        records of the pdb files, or from the first model of the
+        structure."""
+        rel_path = self._get_pdb_path(pdb_id)
+        if rel_path is None:
+            # the search will report the missing file
+            return {}
+        sequences = self._seqres(rel_path)
+        if sequences:
+            return sequences
+        model = self.models.get_model(rel_path, pdb_id)
+        for chain in model:
+            names = [residue.get_resname() for residue in chain
+                    if residue.id[0] == ' ']
+            sequences[chain.id] = '-'.join(names)
+        return sequences
+
+    # private functions
+
+    def _seqres(self, rel_path):
+        """Returns the sequences of the SEQRES records of a pdb file, an
+        empty dict for the other formats."""
+        base_path = rel_path[:-3] if rel_path.endswith('.gz') else rel_path
+        if not (base_path.endswith('.ent') or base_path.endswith('.pdb')):
+            return {}
+        if rel_path.endswith('.gz'):
+            handle = gzip.open(rel_path, 'rb')
+        else:
+            handle = open(rel_path)
+        residues = OrderedDict()
+        with handle:
+            for line in handle:
+                if line.startswith('SEQRES'):
+                    residues.setdefault(line[11], []).extend(
+                            line[19:].split())
+                # the SEQRES records are in the header
+                elif line.startswith('ATOM'):
+                    break
+        sequences = {}
+        for chain, names in residues.items():
+            sequences[chain] = '-'.join(names)
+        return sequences
+
+    def _locate(self, pdb_id):
+        """Returns the path of the structure file of a PDB id, an empty
+        string if there is no file."""
+        return structure(pdb_id).locate_file(self.directory) or ''
+
+    def _get_pdb_path(self, pdb_id):
+        """Returns the path of the structure file of a PDB id, the file is
+        downloaded if necessary. None is returned if it can't be
+        downloaded."""
+        rel_path = structure(pdb_id).locate_file(self.directory)
+        if rel_path is None:
+            try:
+                structure(pdb_id).get_pdb_file(self.directory)
+            except Exception, error:
+                logger.warning("Can't download %s: %s", pdb_id, error,
+                        extra={'pdb_id': pdb_id})
+            rel_path = structure(pdb_id).locate_file(self.directory)
+        return rel_path
@@ -5,7 +5,12 @@
 
 import csv
 import urllib2
-from lxml import etree
+import logging
+
+# local imports
+from .instrument import shared_instrument
+
+logger = logging.getLogger(__name__)
 
 class domain:
 
@@ -14,9 +19,13 @@ class domain:
 
     @param pfam_id: the PFAM identifier for the domain
     @type pfam_id: string
+
+    @param store: the local store where the iPFAM tables are imported, if
+    None the tables are read from the iPFAM server at each search
+    @type store: store
     """
 
-    def __init__(self, pfam_id):
+    def __init__(self, pfam_id, store=None):
         self.xml_dir = 'xml'
         # pfam domain accession number
         self.pfam_id = pfam_id
@@ -25,43 +34,113 @@ class domain:
         # ipfam variables
         self.ipfam_url = 'ftp://selab.janelia.org/pub/ipfam/Current_Release/'
         self.hetero_filename = 'heterodomain_interaction.csv'
-        self.homo_filename = 'heterodomain_interaction.csv'
+        self.homo_filename = 'homodomain_interaction.csv'
+        self.store = store
 
     def get_pdb_ids(self):
         """Returns a list of pdb id codes for a pfam access number."""
-        # builds the a query in xml format
-        tree = etree.parse(self.xml_dir+'/pfamtopdb_query.xml')
-        query_field = tree.xpath('pfamID')
-        query_field[0].text = self.pfam_id
-        xml_query = etree.tostring(tree, encoding='UTF-8',
-                xml_declaration=True)
+        return self.get_pdb_ids_from_list([self.pfam_id])
+
+    def get_pdb_ids_from_list(self, pfam_ids):
+        """Returns the list of the pdb id codes of all the pfam access numbers
+        of a list (the union of their structures), with one request to the
+        rcsb server. The result is kept in the local store, if any."""
+        key = ','.join(sorted(set(pfam_ids)))
+        # another rcsb server may give other results
+        query = self.rcsb_resturl+'search '+key
+        if self.store is not None:
+            pdb_ids = self.store.get_search(query)
+            if pdb_ids is not None:
+                return pdb_ids
+        # lxml is only needed for the searches on the rcsb server
+        from lxml import etree
+        xml_query = etree.tostring(self.build_query(pfam_ids),
+                encoding='UTF-8', xml_declaration=True)
         # request to rcsb server
-        print "Connexion to rcsb to get pbds for "+self.pfam_id+"..."
+        logger.info("Connexion to rcsb to get pbds for %s...", key,
+                extra={'pfam_id': key})
         req = urllib2.Request(self.rcsb_resturl+'search', data=xml_query)
-        socket = urllib2.urlopen(req)
-        result = socket.read()
+        with shared_instrument.stage('search', pfam_id=key):
+            socket = urllib2.urlopen(req)
+            result = socket.read()
+        shared_instrument.count('http.requests')
+        shared_instrument.count('http.bytes', len(result))
         # build the list
         pdb_ids = result.split('\n')
         pdb_ids = filter(None, pdb_ids)
+        if self.store is not None:
+            self.store.put_search(query, pdb_ids)
         return pdb_ids
 
+    def build_query(self, pfam_ids):
+        """Returns the xml tree of the rcsb query of a list of pfam access
+        numbers, a composite query (or) if there are several of them."""
+        from lxml import etree
+        queries = []
+        for pfam_id in pfam_ids:
+            # builds the a query in xml format
+            tree = etree.parse(self.xml_dir+'/pfamtopdb_query.xml')
+            query_field = tree.xpath('pfamID')
+            query_field[0].text = pfam_id
+            queries.append(tree.getroot())
+        if len(queries) == 1:
+            return queries[0]
+        composite = etree.Element('orgPdbCompositeQuery', version='1.0')
+        for level, query in enumerate(queries):
+            refinement = etree.SubElement(composite, 'queryRefinement')
+            etree.SubElement(refinement, 'queryRefinementLevel').text = \
+                    str(level)
+            if level > 0:
+                etree.SubElement(refinement, 'conjunctionType').text = 'or'
+            refinement.append(query)
+        return composite
+
 
     def get_interactions(self):
-        """Returns a list of interacting domains based on the ipfam
+        """Returns a set of interacting domains based on the ipfam
         database."""
-        # the returned ids list
-        ids = []
-        # opens sockets to get csv files
-        print "Connexion to ipfam..."
-        hetero_socket = urllib2.urlopen(self.ipfam_url+self.hetero_filename)
-        homo_socket = urllib2.urlopen(self.ipfam_url+self.hetero_filename)
-        # parses csv files
-        table = csv.reader(hetero_socket, delimiter='\t')
-        for row in table:
-            if row[0] == self.pfam_id:
-                ids.append(row[2])
+        if self.store is not None:
+            ids = self.get_interactions_from_list([self.pfam_id])[self.pfam_id]
+        else:
+            ids = set()
+            # opens a socket to get the csv file
+            logger.info("Connexion to ipfam...")
+            with shared_instrument.stage('ipfam'):
+                hetero_socket = urllib2.urlopen(self.ipfam_url+
+                        self.hetero_filename)
+                # parses csv files
+                table = csv.reader(hetero_socket, delimiter='\t')
+                for row in table:
+                    if row[0] == self.pfam_id:
+                        ids.add(row[2])
+            shared_instrument.count('http.requests')
         if len(ids) > 0:
             return ids
         else:
-            print "This domain has no known interactions"
+            logger.warning("This domain has no known interactions",
+                    extra={'pfam_id': self.pfam_id})
+
+    def get_interactions_from_list(self, pfam_ids):
+        """Returns a dict with the set of interacting domains of each pfam id
+        of a list, based on the ipfam tables of the local store."""
+        if not self.store.has_ipfam([self.hetero_filename,
+                self.homo_filename]):
+            self.import_ipfam()
+        return self.store.get_partners_many(pfam_ids)
 
+    def import_ipfam(self):
+        """Imports the heterodomain and homodomain ipfam tables in the local
+        store."""
+        logger.info("Connexion to ipfam...")
+        with shared_instrument.stage('ipfam'):
+            hetero_socket = urllib2.urlopen(self.ipfam_url+
+                    self.hetero_filename)
+            table = csv.reader(hetero_socket, delimiter='\t')
+            self.store.import_ipfam(self.hetero_filename,
+                    ((row[0], row[2]) for row in table if len(row) > 2))
+            # a homodomain interaction is a domain with itself
+            homo_socket = urllib2.urlopen(self.ipfam_url+self.homo_filename)
+            table = csv.reader(homo_socket, delimiter='\t')
+            self.store.import_ipfam(self.homo_filename,
+                    ((row[0], row[0]) for row in table if len(row) > 0))
+        shared_instrument.count('http.requests', 2)
@@ -0,0 +1,57 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" ensemble class """
+
+import logging
+import numpy
+
+# local imports
+from .compact import compact
+
+logger = logging.getLogger(__name__)
+
+class ensemble:
+
+    """
+    This class keeps all the models of a structure (the conformers of a NMR
+    entry) in one (models x atoms x 3) array of coordinates, so the contacts
+    of two domains are searched in all the models at once. The other
+    columns of the atoms (chain, residue, serial number...) are the ones of
+    the first model, in a compact model, so the domains are selected as in
+    a compact structure. Only the atoms found in all the models are kept.
+
+    @param source: a Bio.PDB structure
+    @type source: Structure
+    """
+
+    def __init__(self, source):
+        from Bio.PDB import Selection
+        models = source.get_list()
+        first_atoms = Selection.unfold_entities(models[0], 'A')
+        # the same atom in the other models, by chain, residue and name
+        keys = {}
+        for i, atom in enumerate(first_atoms):
+            keys[atom.get_full_id()[2:]] = i
+        coords = numpy.zeros((len(models), len(first_atoms), 3), dtype='f4')
+        found = numpy.zeros((len(models), len(first_atoms)), dtype=bool)
+        for m, model in enumerate(models):
+            for atom in model.get_atoms():
+                i = keys.get(atom.get_full_id()[2:])
+                if i is not None:
+                    coords[m, i] = atom.get_coord()
+                    found[m, i] = True
+        kept = found.all(axis=0)
+        atoms = compact(models[0]).atoms
+        if not kept.all():
+            logger.debug("%d atoms are not in all the models of %s",
+                    len(kept) - int(kept.sum()), source.get_id())
+            atoms = atoms[kept]
+            coords = coords[:, kept]
+        # the columns of the atoms of the first model
+        self.model = compact(atoms)
+        self.coords = coords
+        self.models_num = len(models)
+
+    def __len__(self):
+        return len(self.model)
@@ -0,0 +1,47 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" executor class """
+
+import multiprocessing
+
+class executor:
+
+    """
+    This class runs a function on a list of independent tasks, in several
+    worker processes. The function and the tasks must be picklable, and the
+    results are returned in the order of the tasks.
+
+    @param jobs: the number of worker processes, with 1 the tasks are run in
+    the current process
+    @type jobs: int
+    """
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+
+    def map(self, function, tasks):
+        """Returns the list of the results of the function for each task."""
+        return list(self.imap(function, tasks))
+
+    def imap(self, function, tasks):
+        """Yields the results of the function for each task, in the order of
+        the tasks and as soon as they are ready, so they don't need to be
+        kept."""
+        if self.jobs <= 1:
+            for task in tasks:
+                yield function(task)
+            return
+        # the tasks can be a generator, they are consumed while the workers
+        # run
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            # one task at a time, the entries can be very different in size
+            for result in pool.imap(function, tasks, chunksize=1):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
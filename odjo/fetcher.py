@@ -0,0 +1,217 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" fetcher class """
+
+import time
+import socket
+import logging
+import httplib
+import threading
+from Queue import Queue, Empty
+from urlparse import urlparse
+
+# local imports
+from .structure import structure
+from .instrument import shared_instrument
+
+logger = logging.getLogger(__name__)
+
+class fetcher:
+
+    """
+    This class retrieves the pfam annotations (hmmer) of a lot of PDB
+    structures from the rcsb server. Several requests are kept in flight, each
+    one on a persistent (keep-alive) connection, and the failed requests are
+    retried.
+
+    @param base_url: the url of the rcsb rest interface, it can point to a
+    local server for the tests
+    @type base_url: string
+
+    @param concurrency: the maximum number of requests in flight
+    @type concurrency: int
+
+    @param retries: the number of times a failed request is retried
+    @type retries: int
+
+    @param backoff: the waiting time (in seconds) before the first retry, it
+    is doubled for each new retry
+    @type backoff: float
+
+    @param rate: the maximum number of requests per second, 0 for no limit
+    @type rate: float
+
+    @param timeout: the timeout (in seconds) of the connections
+    @type timeout: float
+
+    @param store: the local annotations store, only the missing or expired
+    entries are retrieved from the server
+    @type store: store
+    """
+
+    def __init__(self, base_url='http://www.rcsb.org/pdb/rest/', concurrency=8,
+            retries=3, backoff=0.5, rate=0, timeout=30, store=None):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.rate = rate
+        self.timeout = timeout
+        self.store = store
+        # pdb id -> error of the ids that couldn't be retrieved by the last
+        # fetch
+        self.failed = {}
+        # the rate limit is shared by all the connections
+        self._rate_lock = threading.Lock()
+        self._next_request = 0
+
+    def fetch(self, pdb_ids):
+        """Returns a dict with the hmmer xml of each pdb id. The ids that
+        can't be retrieved are left out with a warning, and kept with their
+        error in self.failed. An IOError listing them is raised if none of
+        the ids can be retrieved."""
+        self.failed = {}
+        # each id is retrieved only once, in order
+        seen = set()
+        unique_ids = []
+        for pdb_id in pdb_ids:
+            if pdb_id not in seen:
+                seen.add(pdb_id)
+                unique_ids.append(pdb_id)
+        if len(unique_ids) == 0:
+            return {}
+        tasks = Queue()
+        for pdb_id in unique_ids:
+            tasks.put(pdb_id)
+        results = {}
+        errors = {}
+        threads = []
+        with shared_instrument.stage('fetch', pdb_ids=len(unique_ids)):
+            for i in range(min(self.concurrency, len(unique_ids))):
+                thread = threading.Thread(target=self._worker,
+                        args=(tasks, results, errors))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        if errors:
+            self.failed = errors
+            shared_instrument.count('fetch.failed', len(errors))
+            failed_ids = [pdb_id for pdb_id in unique_ids if pdb_id in errors]
+            if not results:
+                raise IOError("Can't retrieve the annotations of "+
+                        ', '.join(failed_ids)+': '+str(errors[failed_ids[0]]))
+            for pdb_id in failed_ids:
+                logger.warning("Can't retrieve the annotations of %s: %s",
+                        pdb_id, errors[pdb_id], extra={'pdb_id': pdb_id})
+        return results
+
+    def get_hits(self, pdb_ids):
+        """Returns a dict with the pfamHit records of each pdb id, the
+        records are taken from the store if possible."""
+        hits = {}
+        if self.store is not None:
+            hits = self.store.get_many(pdb_ids)
+        missing = [pdb_id for pdb_id in pdb_ids if pdb_id not in hits]
+        fetched = {}
+        for pdb_id, xml in self.fetch(missing).items():
+            fetched[pdb_id] = structure(pdb_id).parse_hits(xml)
+        if self.store is not None and fetched:
+            self.store.put_many(fetched)
+        hits.update(fetched)
+        return hits
+
+    def get_domains(self, pdb_ids):
+        """Returns a dict with the pfam domain annotations of each pdb id,
+        the ids that can't be retrieved are not in it."""
+        domains = {}
+        for pdb_id, hits in self.get_hits(pdb_ids).items():
+            domains[pdb_id] = structure(pdb_id).domains_from_hits(hits)
+        return domains
+
+    def get_pfam_ids(self, pdb_ids):
+        """Returns a dict with the pfam domain ids of each pdb id."""
+        pfam_ids = {}
+        for pdb_id, hits in self.get_hits(pdb_ids).items():
+            pfam_ids[pdb_id] = structure(pdb_id).pfam_ids_from_hits(hits)
+        return pfam_ids
+
+    # private functions
+
+    def _worker(self, tasks, results, errors):
+        """Takes pdb ids from the queue and retrieves their annotations on the
+        same connection until the queue is empty."""
+        connection = None
+        while True:
+            try:
+                pdb_id = tasks.get_nowait()
+            except Empty:
+                break
+            logger.info("Connexion to rcsb for %s...", pdb_id,
+                    extra={'pdb_id': pdb_id})
+            attempt = 0
+            while True:
+                try:
+                    if connection is None:
+                        connection = self._connect()
+                    self._wait_rate()
+                    status, xml = self._request(connection, pdb_id)
+                    if status == 200:
+                        results[pdb_id] = xml
+                        break
+                    error = IOError('rcsb returned '+str(status)+' for '+
+                            pdb_id)
+                    # only the server errors are worth a retry
+                    if status < 500 and status != 429:
+                        errors[pdb_id] = error
+                        break
+                    raise error
+                except (socket.error, httplib.HTTPException, IOError), error:
+                    # the connection can't be used anymore
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+                    if attempt >= self.retries:
+                        errors[pdb_id] = error
+                        break
+                    shared_instrument.count('http.retries')
+                    time.sleep(self.backoff * 2 ** attempt)
+                    attempt += 1
+        if connection is not None:
+            connection.close()
+
+    def _connect(self):
+        """Returns a new connection to the server of the base url."""
+        url = urlparse(self.base_url)
+        if url.scheme == 'https':
+            return httplib.HTTPSConnection(url.netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(url.netloc, timeout=self.timeout)
+
+    def _request(self, connection, pdb_id):
+        """Returns the http status and the hmmer xml of a pdb id, the
+        connection is kept open."""
+        path = urlparse(self.base_url).path
+        with shared_instrument.stage('http', pdb_id=pdb_id):
+            connection.request('GET', path+'hmmer?structureId='+pdb_id,
+                    headers={'Connection': 'keep-alive'})
+            response = connection.getresponse()
+            # the body must be read before reusing the connection
+            xml = response.read()
+        shared_instrument.count('http.requests')
+        shared_instrument.count('http.bytes', len(xml))
+        if response.getheader('connection', '').lower() == 'close':
+            connection.close()
+        return response.status, xml
+
+    def _wait_rate(self):
+        """Waits until a new request is allowed by the rate limit."""
+        if not self.rate:
+            return
+        with self._rate_lock:
+            now = time.time()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + 1.0/self.rate
+        if wait > 0:
+            time.sleep(wait)
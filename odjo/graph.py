@@ -3,51 +3,202 @@
 
 """ graph class """
 
-import pydot
+import os
+import errno
+import logging
+import subprocess
+from xml.sax.saxutils import escape, quoteattr
+
+# local imports
+from .instrument import shared_instrument
+
+logger = logging.getLogger(__name__)
 
 class graph:
 
     """
     This class contains methods for the graphs draw with the interaction
-    frequencies.
+    frequencies. The nodes and the edges are deduplicated once, then the
+    graph files (DOT, GraphML, edges list) are written line by line and the
+    image is rendered by graphviz, so the large networks can be drawn.
+
+    The interactions are a list of dict and each contains {domain_1:x,
+    domain_2:y, frequency:f}.
+
+    @param layout: the graphviz layout program, 'auto' uses dot for the small
+    graphs and sfdp (much faster) for the graphs with more than large nodes
+    @type layout: string
+
+    @param threshold: the edges with a lower frequency are not drawn
+    @type threshold: float
 
-    @param interactions: a list of dict and each contains {domain_1:x,
-    domain_2:y, frequency:f}
-    @type interaction: list
+    @param top: if given, only the subgraph of the top nodes with the highest
+    sum of frequencies is drawn
+    @type top: int
+
+    @param formats: the graph files written next to the image, among 'dot',
+    'graphml' and 'edges' (the dot file is always written if the image is
+    rendered)
+    @type formats: list
+
+    @param render: renders the image, or only writes the graph files. The
+    image is not rendered (with a warning) if graphviz is not installed
+    @type render: bool
+
+    @param large: the number of nodes of a large graph for the 'auto' layout
+    @type large: int
     """
 
-    def draw_list(self, interactions):
+    def __init__(self, layout='auto', threshold=0.0, top=None, formats=[],
+            render=True, large=300):
+        self.layout = layout
+        self.threshold = threshold
+        self.top = top
+        self.formats = formats
+        self.render_image = render
+        self.large = large
+
+    def draw_list(self, interactions, filename='graph.png'):
         """Draws an oriented graph for an interaction frequencies analysis."""
-        # creates graph
-        g = pydot.Dot(graph_type='digraph')
-        # the nodes are the domains and the edges are annotated with the
-        # frequencies
-        for entry in interactions:
-            node1 = pydot.Node(name=entry['domain_1'])
-            node2 = pydot.Node(name=entry['domain_2'])
-            edge = pydot.Edge(node1, node2, label=entry['frequency'],
-                    fontsize="12")
-            g.add_node(node1)
-            g.add_node(node2)
-            g.add_edge(edge)
-        # write png
-        g.write_png('graph.png')
-
-    def draw(self, interactions):
+        self._draw(interactions, filename, True)
+
+    def draw(self, interactions, filename='graph.png'):
         """Draws a non-oriented graph for an interaction frequencies
         analysis."""
-        # creates graph
-        g = pydot.Dot(graph_type='graph')
-        # the nodes are the domains and the edges are annotated with the
-        # frequencies
+        self._draw(interactions, filename, False)
+
+    def build(self, interactions, directed=True):
+        """Returns the nodes list and the edges list (node_1, node_2, label,
+        weight) of the graph, each one once and in the order of the
+        interactions. In a non-oriented graph, the two directions of a pair
+        are one edge labelled with the two frequencies. The edges under the
+        threshold and the nodes out of the top nodes are removed."""
+        edges = {}
+        order = []
         for entry in interactions:
-            node1 = pydot.Node(name=entry['domain_1'])
-            node2 = pydot.Node(name=entry['domain_2'])
-            edge = pydot.Edge(node1, node2, label=entry['frequency'],
-                    fontsize="12")
-            g.add_node(node1)
-            g.add_node(node2)
-            g.add_edge(edge)
-        # write png
-        g.write_png('graph.png')
+            weight = float(entry['frequency'])
+            if weight < self.threshold:
+                continue
+            key = (entry['domain_1'], entry['domain_2'])
+            if not directed and key not in edges and \
+                    (key[1], key[0]) in edges:
+                # the other direction of an existing edge
+                reverse = edges[(key[1], key[0])]
+                if key[0] != key[1]:
+                    reverse[2] = reverse[2]+' / '+entry['frequency']
+                    reverse[3] += weight
+                continue
+            if key in edges:
+                continue
+            edges[key] = [key[0], key[1], entry['frequency'], weight]
+            order.append(key)
+        # the sum of the frequencies of each node
+        nodes = {}
+        nodes_order = []
+        for key in order:
+            for node in key:
+                if node not in nodes:
+                    nodes[node] = 0.0
+                    nodes_order.append(node)
+                nodes[node] += edges[key][3]
+        if self.top is not None and len(nodes_order) > self.top:
+            kept = set(sorted(nodes_order, key=lambda node: -nodes[node])
+                    [:self.top])
+            nodes_order = [node for node in nodes_order if node in kept]
+            order = [key for key in order if key[0] in kept and
+                    key[1] in kept]
+        return nodes_order, [tuple(edges[key]) for key in order]
+
+    def write_dot(self, nodes, edges, filename, directed=True, layout='dot'):
+        """Writes a graph in a DOT file."""
+        if directed:
+            kind, link = 'digraph', ' -> '
+        else:
+            kind, link = 'graph', ' -- '
+        with open(filename, 'w') as handle:
+            handle.write(kind+' G {\n')
+            if layout != 'dot':
+                # the options of the force directed layouts for large graphs
+                handle.write('graph [overlap=prism, outputorder=edgesfirst, '
+                        'splines=false];\n')
+            for node in nodes:
+                handle.write(self._quote(node)+';\n')
+            for node_1, node_2, label, weight in edges:
+                handle.write(self._quote(node_1)+link+self._quote(node_2)+
+                        ' [label='+self._quote(label)+', fontsize=12];\n')
+            handle.write('}\n')
+
+    def write_graphml(self, nodes, edges, filename, directed=True):
+        """Writes a graph in a GraphML file, the edges have a frequency
+        (the label) and a weight."""
+        with open(filename, 'w') as handle:
+            handle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            handle.write('<graphml xmlns="http://graphml.graphdrawing.org/'
+                    'xmlns">\n')
+            handle.write('<key id="frequency" for="edge" '
+                    'attr.name="frequency" attr.type="string"/>\n')
+            handle.write('<key id="weight" for="edge" attr.name="weight" '
+                    'attr.type="double"/>\n')
+            handle.write('<graph id="G" edgedefault="'+
+                    (directed and 'directed' or 'undirected')+'">\n')
+            for node in nodes:
+                handle.write('<node id='+quoteattr(node)+'/>\n')
+            for node_1, node_2, label, weight in edges:
+                handle.write('<edge source='+quoteattr(node_1)+' target='+
+                        quoteattr(node_2)+'><data key="frequency">'+
+                        escape(label)+'</data><data key="weight">'+
+                        repr(weight)+'</data></edge>\n')
+            handle.write('</graph>\n</graphml>\n')
+
+    def write_edges(self, nodes, edges, filename):
+        """Writes the edges in a text file, one line per edge: node_1,
+        node_2 and frequency separated by tabs."""
+        with open(filename, 'w') as handle:
+            for node_1, node_2, label, weight in edges:
+                handle.write(node_1+'\t'+node_2+'\t'+label+'\n')
+
+    def render(self, dot_filename, filename, layout='dot'):
+        """Renders a DOT file in an image with a graphviz program, the
+        format is given by the extension of the image."""
+        image_format = os.path.splitext(filename)[1][1:] or 'png'
+        try:
+            process = subprocess.Popen([layout, '-T'+image_format, '-o',
+                filename, dot_filename], stderr=subprocess.PIPE)
+        except OSError, error:
+            raise OSError(error.errno, '"'+layout+'" not found in path.')
+        errors = process.communicate()[1]
+        if process.returncode != 0:
+            raise OSError('"'+layout+'" has failed: '+errors.strip())
+
+    # private functions
+
+    def _draw(self, interactions, filename, directed):
+        """Writes the graph files and renders the image."""
+        nodes, edges = self.build(interactions, directed)
+        layout = self.layout
+        if layout == 'auto':
+            layout = 'dot'
+            if len(nodes) > self.large:
+                layout = 'sfdp'
+        base = os.path.splitext(filename)[0]
+        if 'dot' in self.formats or self.render_image:
+            self.write_dot(nodes, edges, base+'.dot', directed, layout)
+        if 'graphml' in self.formats:
+            self.write_graphml(nodes, edges, base+'.graphml', directed)
+        if 'edges' in self.formats:
+            self.write_edges(nodes, edges, base+'.edges.tsv')
+        if self.render_image:
+            try:
+                with shared_instrument.stage('graph', nodes=len(nodes),
+                        edges=len(edges), layout=layout):
+                    self.render(base+'.dot', filename, layout)
+            except OSError, error:
+                if error.errno != errno.ENOENT:
+                    raise
+                # graphviz is optional, the graph files are still written
+                logger.warning("%s is not installed, %s is not drawn",
+                        layout, filename)
 
+    def _quote(self, name):
+        """Returns a DOT identifier."""
+        return '"'+name.replace('\\', '\\\\').replace('"', '\\"')+'"'
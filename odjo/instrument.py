@@ -0,0 +1,174 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" instrument class """
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+class instrument:
+
+    """
+    This class measures where the time of a run goes. Each stage (http
+    request, download, parsing, contact search, outputs...) is timed (wall
+    and CPU time, the CPU time is the one of the whole process) and the
+    counters (http requests and bytes, cache hits, atoms indexed, neighbor
+    queries, domain pairs tested and in contact...) are added up. When it is
+    enabled, each stage is also recorded as an event of a timeline, which
+    can be written in the Chrome trace format (chrome://tracing or
+    https://ui.perfetto.dev).
+
+    The worker processes have their own instrument, its snapshot is merged
+    in the one of the main process.
+    """
+
+    def __init__(self):
+        # the timeline is only recorded when it is enabled
+        self.enabled = False
+        # the stages and counters are updated by several threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets all the measures."""
+        self.start = time.time()
+        # the process that owns the measures
+        self.pid = os.getpid()
+        # stage name -> {'calls': n, 'wall': s, 'cpu': s}
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+
+    def enable(self, enabled=True):
+        """Enables or disables the timeline."""
+        self.enabled = enabled
+
+    @contextmanager
+    def stage(self, name, **args):
+        """Times the code of a with statement as a stage. The args are
+        recorded with the event of the timeline."""
+        start = time.time()
+        cpu = self._cpu()
+        try:
+            yield
+        finally:
+            wall = time.time() - start
+            cpu = self._cpu() - cpu
+            with self.lock:
+                stage = self.stages.setdefault(name, {'calls': 0,
+                    'wall': 0.0, 'cpu': 0.0})
+                stage['calls'] += 1
+                stage['wall'] += wall
+                stage['cpu'] += cpu
+                if self.enabled:
+                    event = {'name': name, 'ph': 'X', 'pid': os.getpid(),
+                            'tid': threading.current_thread().ident,
+                            'ts': int(start * 1e6), 'dur': int(wall * 1e6)}
+                    if args:
+                        event['args'] = args
+                    self.events.append(event)
+
+    def count(self, name, value=1):
+        """Adds a value to a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def forget_parent(self):
+        """Forgets the measures inherited from the parent process, in a
+        forked worker process."""
+        if self.pid != os.getpid():
+            with self.lock:
+                self.reset()
+
+    def take(self):
+        """Returns a snapshot of the measures (a picklable dict) and forgets
+        them, so each snapshot of a worker only contains its new
+        measures."""
+        with self.lock:
+            snapshot = {'stages': self.stages, 'counters': self.counters,
+                    'events': self.events}
+            self.stages = {}
+            self.counters = {}
+            self.events = []
+        return snapshot
+
+    def merge(self, snapshot):
+        """Adds the measures of a snapshot (of a worker process)."""
+        with self.lock:
+            for name, other in snapshot['stages'].items():
+                stage = self.stages.setdefault(name, {'calls': 0,
+                    'wall': 0.0, 'cpu': 0.0})
+                for key in ['calls', 'wall', 'cpu']:
+                    stage[key] += other[key]
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.events.extend(snapshot['events'])
+
+    def summary(self):
+        """Returns a dict with the total time of the run, the stages and the
+        counters. The time of a stage includes the time of the stages run
+        inside it, and the time of the stages run in parallel (threads,
+        processes) is added up."""
+        with self.lock:
+            summary = {}
+            summary['wall'] = time.time() - self.start
+            summary['stages'] = dict((name, dict(stage))
+                    for name, stage in self.stages.items())
+            summary['counters'] = dict(self.counters)
+        return summary
+
+    def write_summary(self, filename):
+        """Writes the summary in a json file."""
+        with open(filename, 'w') as handle:
+            json.dump(self.summary(), handle, indent=1, sort_keys=True)
+
+    def write_trace(self, filename):
+        """Writes the timeline in a json file of the Chrome trace format, the
+        counters are added at the end of the timeline."""
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        end = int(time.time() * 1e6)
+        for name, value in sorted(counters.items()):
+            events.append({'name': name, 'ph': 'C', 'pid': os.getpid(),
+                'ts': end, 'args': {'value': value}})
+        with open(filename, 'w') as handle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                    handle)
+
+    # private functions
+
+    def _cpu(self):
+        """Returns the CPU time (user and system) of the process."""
+        times = os.times()
+        return times[0] + times[1]
+
+
+class json_formatter(logging.Formatter):
+
+    """
+    A logging formatter that writes each record as a json object on one
+    line, with the extra fields of the record (pdb_id...).
+    """
+
+    # the attributes of all the records
+    standard = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__)
+
+    def format(self, record):
+        entry = {}
+        entry['time'] = record.created
+        entry['level'] = record.levelname
+        entry['logger'] = record.name
+        entry['message'] = record.getMessage()
+        for key, value in record.__dict__.items():
+            if key not in self.standard and key != 'message':
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+# the instrument shared by all the objects of a process
+shared_instrument = instrument()
@@ -5,15 +5,22 @@
 
 # local imports
 from .structure import structure
-from .domain import domain
 from .representation import representation
+from .cache import shared_cache
+from .contact import contact
+from .executor import executor
+from .prefetcher import prefetcher
+from .checkpoint import checkpoint
+from .aggregate import aggregate
+from .instrument import shared_instrument
 
 # regular imports
 import re, os
-from Bio.PDB import PDBList
-from Bio.PDB import PDBParser
+import logging
+import numpy
 from Bio.PDB import Selection
-from Bio.PDB import NeighborSearch
+
+logger = logging.getLogger(__name__)
 
 class interaction:
 
@@ -26,44 +33,122 @@ class interaction:
     @param pdb_ids: the list of PDB structure that contains the PFAM domain
     @type pdb_ids: list
 
-    @param pfam_ids: the list of PFAM domains that interacts with the domain,
-    this list comes from the iPFAM database
-    @type pfam_ids: list
+    @param pfam_ids: the set of PFAM domains that interacts with the domain,
+    this set comes from the iPFAM database
+    @type pfam_ids: set
+
+    @param models: the cache of the parsed PDB models, by default the one
+    shared by all the interaction objects
+    @type models: cache
+
+    @param engine: the contact search method, 'kdtree' searches only between
+    the atoms of the two domains, 'compact' does the same on the compact
+    representation of the structures (no parsing when its .npy file exists),
+    'nsearch' is the original search on all the atoms of the model,
+    'ensemble' searches all the models of the structures (the NMR
+    conformers) at once
+    @type engine: string
+
+    @param jobs: the number of worker processes used for the analysis of the
+    PDB entries
+    @type jobs: int
+
+    @param downloads: the number of PDB files downloaded at the same time
+    while the analysis runs, 0 to download them one by one when needed
+    @type downloads: int
+
+    @param checkpoints: the store where the result of each PDB entry is
+    recorded, so an interrupted or updated search only computes the missing
+    entries
+    @type checkpoints: checkpoint
+
+    @param cutoff: the maximal distance (in angstroms) between two atoms in
+    contact
+    @type cutoff: float
+
+    @param renderer: if given, a png image of each interaction is drawn with
+    it after the search
+    @type renderer: renderer
+
+    @param recorder: if given, the contacts of each structure (residues,
+    atoms, minimum distance) are written in its records file as soon as the
+    structure has been searched, and the analyses only keep the counts
+    @type recorder: recorder
+
+    @param occupancy: with the ensemble engine, the minimal fraction of the
+    models where two domains are in contact to count them as interacting
+    @type occupancy: float
 
     """
 
-    def __init__(self, pfam_id, pdb_ids, pfam_ids):
+    def __init__(self, pfam_id, pdb_ids, pfam_ids, models=None,
+            engine='kdtree', jobs=1, downloads=4, checkpoints=None, cutoff=5,
+            renderer=None, recorder=None, occupancy=0.5):
         self.pfam_id = pfam_id
         self.pdb_ids = pdb_ids
-        # a pfam domain ids list for iPFAM
+        # a pfam domain ids set for iPFAM
+        if isinstance(pfam_ids, (list, tuple)):
+            pfam_ids = set(pfam_ids)
         self.pfam_ids = pfam_ids
         self.directory = 'pdb_and_png'
+        # each pdb file is parsed once, then the model is taken from here
+        if models is None:
+            models = shared_cache
+        self.models = models
+        self.engine = engine
+        self.jobs = jobs
+        self.downloads = downloads
+        self.checkpoints = checkpoints
+        # This is how we detect an interaction, we put 5 angstroms here.
+        self.cutoff = cutoff
+        self.renderer = renderer
+        self.recorder = recorder
+        self.occupancy = occupancy
 
     def get_pdb_files(self):
         """Retrieves all pdb files corresponding the domains of interest."""
-        pdb_list = PDBList()
-        for pdb in self.pdb_ids:
-            # put files in the directory pointed by the self.directory variable
-            pdb_list.retrieve_pdb_file(pdb, pdir=self.directory)
+        # put files in the directory pointed by the self.directory variable,
+        # with several downloads at the same time
+        prefetch = prefetcher(self.directory, self._pdb_path,
+                max(self.downloads, 1))
+        for pdb in prefetch.iterate(self.pdb_ids, key=lambda pdb: pdb):
+            pass
 
-    def get_filtered_pdb_ids(self):
-        """Returns the list of pdb ids corresponding to an interaction."""
+    def get_filtered_pdb_ids(self, fetcher=None):
+        """Returns the list of pdb ids corresponding to an interaction. If a
+        fetcher is given, all the pfam ids are retrieved with it at once."""
+        if fetcher is not None:
+            all_acc_nums = fetcher.get_pfam_ids(self.pdb_ids)
         ids = []
         # get pfam ids for each pdb file
         for pdb_id in self.pdb_ids:
-            acc_nums = structure(pdb_id).get_pfam_ids()
+            if fetcher is not None:
+                # the fetcher has already warned about the missing ids
+                acc_nums = all_acc_nums.get(pdb_id, [])
+            else:
+                acc_nums = structure(pdb_id).get_pfam_ids()
             # check if a pfam id is in the known domains list
             for acc_num in acc_nums:
                 if acc_num in self.pfam_ids and pdb_id not in ids:
                     ids.append(pdb_id)
         return ids
 
-    def get_annotations(self):
-        """Returns a list of pfam domains annotations for a list of PDB."""
+    def get_annotations(self, fetcher=None):
+        """Returns a list of pfam domains annotations for a list of PDB. If a
+        fetcher is given, all the annotations are retrieved with it at
+        once."""
+        if fetcher is not None:
+            all_domains = fetcher.get_domains(self.pdb_ids)
         pdbs = []
         for pdb_id in self.pdb_ids:
-            # a function from the structure class
-            domains = structure(pdb_id).get_domains()
+            if fetcher is not None:
+                # the fetcher has already warned about the missing ids
+                if pdb_id not in all_domains:
+                    continue
+                domains = all_domains[pdb_id]
+            else:
+                # a function from the structure class
+                domains = structure(pdb_id).get_domains()
             entry = {}
             entry['pdb_id'] = pdb_id
             entry['domains'] = domains
@@ -75,187 +160,581 @@ class interaction:
 
     def analysis(self, annotations):
         """Returns an interaction analysis dict based on iPFAM."""
-        analysis = {}
-        analysis['interactants'] = []
-        pfam_id = annotations['pfam_id']
-        pdbs = annotations['pdbs']
-        for pdb in pdbs:
-            pdb_id = pdb['pdb_id']
-            domains = pdb['domains']
-            # just extracts the informations for the domain passed as an
-            # argument
-            main_domain = self._get_domain_of_interest(domains)
-            main_name = main_domain['name']
-            analysis['name'] = main_name
-            for domain in domains:
-                name = domain['name']
-                # checks the iPFAM list
-                if domain['id'] in self.pfam_ids:
-                    filename = self._id2filename(pdb_id)
-                    rel_path = self.directory+'/'+filename
-                    if not os.path.isfile(rel_path):
-                        # downloads the PDB file
-                        structure(pdb_id).get_pdb_file(self.directory)
-                    # searches for interactions between this two domains and
-                    # in this PDB structure
-                    inter = self.interaction(rel_path, pdb_id, main_domain,
-                            domain)
-                    if inter:
-                        # export an annotated structure in a png, but we have
-                        # problems with that : pymol does the job for a few
-                        # structures but bugs for a lot of structures.
-                        # Please uncomment if you wanna test
-                        #representation().export_png(rel_path, pdb_id, inter)
-                        analysis['interactants'].append(name)
+        jobs = []
+        results = self.run_entries(annotations['pdbs'], 'analysis')
+        analysis = self._merge_analysis(self.stream(results, jobs))
+        self.render_jobs(jobs)
         return analysis
-                    
+
     def analysis_2(self, annotations):
         """Returns an interaction analysis dict without a priori."""
-        analysis = {}
-        analysis['interactants'] = []
-        pfam_id = annotations['pfam_id']
-        pdbs = annotations['pdbs']
-        for pdb in pdbs:
-            pdb_id = pdb['pdb_id']
-            domains = pdb['domains']
-            # just extracts the informations for the domain passed as an
-            # argument
-            main_domain = self._get_domain_of_interest(domains)
-            main_name = main_domain['name']
-            analysis['name'] = main_name
-            for domain in domains:
-                # to not test the main domain with itself
-                if domain['id'] != main_domain['id']:
-                    name = domain['name']
-                    filename = self._id2filename(pdb_id)
-                    rel_path = self.directory+'/'+filename
-                    if not os.path.isfile(rel_path):
-                        # downloads the PDB file
-                        structure(pdb_id).get_pdb_file(self.directory)
-                    # searches for interactions between this two domains and
-                    # in this PDB structure
-                    inter = self.interaction(rel_path, pdb_id, main_domain,
-                            domain)
-                    if inter:
-                        # export an annotated structure in a png, but we have
-                        # problems with that : pymol does the job for a few
-                        # structures but bugs for a lot of structures.
-                        # Please uncomment if you wanna test
-                        #representation().export_png(rel_path, pdb_id, inter)
-                        analysis['interactants'].append(name)
+        jobs = []
+        results = self.run_entries(annotations['pdbs'], 'analysis_2')
+        analysis = self._merge_analysis(self.stream(results, jobs))
+        self.render_jobs(jobs)
         return analysis
 
-    def analysis_3(self, annotations):
-        analysis = []
-        for annotation in annotations:
-            pdb_id = annotation['pdb_id']
-            domains = annotation['domains']
-            # converts a PDB id to a filename
-            filename = self._id2filename(pdb_id)
-            rel_path = self.directory+'/'+filename
-            if not os.path.isfile(rel_path):
-                # downloads the PDB file
-                structure(pdb_id).get_pdb_file(self.directory)
+    def analysis_3(self, annotations, single_pass=True):
+        """Returns a list of interaction analysis dicts, one for each domain
+        found in the annotations. With the single_pass option, all the domain
+        pairs of a structure are searched at once with contact_map(). The
+        images and the records need the interacting residues, so with a
+        renderer or a recorder the pairs are searched one by one."""
+        jobs = []
+        results = self.run_entries(annotations, 'analysis_3',
+                self._single_pass(single_pass))
+        analysis = self._merge_analysis_3(self.stream(results, jobs))
+        self.render_jobs(jobs)
+        return analysis
+
+    def aggregate_3(self, annotations, single_pass=True, weights=None):
+        """Same as aggregate(analysis_3()), but the interactions are
+        counted as the structures are searched, so the memory use doesn't
+        grow with the number of structures. The interactions of a PDB entry
+        can be counted with a weight, given by a dict {PDB id: weight} (see
+        dedup), 1 by default."""
+        jobs = []
+        results = self.run_entries(annotations, 'analysis_3',
+                self._single_pass(single_pass))
+        aggregation = aggregate()
+        for result in self.stream(results, jobs):
+            weight = 1
+            if weights is not None:
+                weight = weights.get(result['pdb_id'], 1)
+            with shared_instrument.stage('frequencies'):
+                for interaction in result['interactions']:
+                    aggregation.add(interaction['domain_1'],
+                            interaction['domain_2'], weight)
+                    aggregation.add(interaction['domain_2'],
+                            interaction['domain_1'], weight)
+        self.render_jobs(jobs)
+        return aggregation
+
+    def aggregate_batch(self, entries, single_pass=True):
+        """Returns a dict {PFAM id: aggregate} with the counts of the
+        analysis_2() (or analysis(), with iPFAM partners) of several PFAM
+        domains of interest. Each entry is a dict {pdb_id, domains, families,
+        partners}: the PFAM ids of the domains of interest found in the
+        structure and, for iPFAM, a dict {PFAM id: list of its partners}
+        (None otherwise). A structure is searched once for all its domains
+        of interest."""
+        jobs = []
+        results = self.run_entries(entries, 'batch',
+                self._single_pass(single_pass))
+        aggregations = {}
+        for result in self.stream(results, jobs):
+            with shared_instrument.stage('frequencies'):
+                for interaction in result['interactions']:
+                    family = interaction['family']
+                    if family not in aggregations:
+                        aggregations[family] = aggregate()
+                    aggregations[family].add(interaction['domain_1'],
+                            interaction['domain_2'])
+        self.render_jobs(jobs)
+        return aggregations
+
+    def stream(self, results, jobs):
+        """Yields the results of analyse_entry() one by one: the records of
+        each result are written and its render jobs are added to the jobs
+        list, so the results don't need to be kept."""
+        names = set()
+        for result in results:
+            if self.recorder is not None:
+                self.recorder.write(result)
+            if self.renderer is not None:
+                jobs.extend(self.image_jobs(result, names))
+            yield result
+
+    def render(self, results):
+        """Draws a png image of each interaction of the results of
+        analyse_entry() with the renderer, if any. The images are written
+        next to the structure files."""
+        if self.renderer is None:
+            return
+        jobs = []
+        names = set()
+        for result in results:
+            jobs.extend(self.image_jobs(result, names))
+        self.render_jobs(jobs)
+
+    def image_jobs(self, result, names):
+        """Returns the render jobs of the interactions of a result of
+        analyse_entry(). The names set contains the png files already
+        used."""
+        jobs = []
+        rel_path = self._pdb_path(result['pdb_id'])
+        for interaction in result['interactions']:
+            if 'residues_1' not in interaction:
+                continue
+            infos = {}
+            infos['1'] = {'residues': interaction['residues_1']}
+            infos['2'] = {'residues': interaction['residues_2']}
+            png = self._png_path(rel_path, interaction, names)
+            jobs.append(representation().job(rel_path, result['pdb_id'],
+                infos, png))
+        return jobs
+
+    def render_jobs(self, jobs):
+        """Draws the render jobs with the renderer, if any."""
+        if self.renderer is None or not jobs:
+            return
+        for rendered in self.renderer.render(jobs):
+            if rendered['error'] is not None:
+                logger.warning("Can't draw %s: %s", rendered['job']['png'],
+                        rendered['error'], extra={'png':
+                            rendered['job']['png']})
+
+    def run_entries(self, entries, mode, single_pass=True):
+        """Runs analyse_entry() on each PDB entry, in self.jobs worker
+        processes, and yields the results in the order of the entries as soon
+        as they are ready. The PDB files of the next entries are downloaded
+        in the meantime."""
+        entries = prefetcher(self.directory, self._pdb_path,
+                self.downloads).iterate(entries)
+        if self.jobs <= 1:
+            for entry in entries:
+                yield self.analyse_entry(entry, mode, single_pass)
+            return
+        # the workers only get picklable informations
+        settings = {}
+        settings['pfam_id'] = self.pfam_id
+        settings['pfam_ids'] = self.pfam_ids
+        settings['directory'] = self.directory
+        settings['engine'] = self.engine
+        settings['single_pass'] = single_pass
+        settings['cutoff'] = self.cutoff
+        settings['occupancy'] = self.occupancy
+        settings['checkpoints'] = None
+        if self.checkpoints is not None:
+            # each worker opens the database
+            settings['checkpoints'] = self.checkpoints.filename
+        settings['profile'] = shared_instrument.enabled
+        tasks = self._tasks(entries, settings, mode)
+        for result, snapshot in executor(self.jobs).imap(_analyse_entry,
+                tasks):
+            # the measures of the workers are added to the ones of the run
+            shared_instrument.merge(snapshot)
+            yield result
+
+    def analyse_entry(self, entry, mode, single_pass=True):
+        """Searches for interacting domains in one PDB entry and returns a
+        compact result: {pdb_id, name, interactions}, each interaction being
+        a dict {domain_1, domain_2, residues_1, residues_2} with the domain
+        names and the (chain, number, insertion code) of the interacting
+        residues. The mode is the name of the analysis ('analysis',
+        'analysis_2' or 'analysis_3'). If there is a checkpoint store, the
+        result is taken from it or recorded in it."""
+        if 'combinations' in entry:
+            # the combinations can come from itertools, and are read twice
+            entry = dict(entry)
+            entry['combinations'] = list(entry['combinations'])
+        with shared_instrument.stage('entry', pdb_id=entry['pdb_id']):
+            if self.checkpoints is None:
+                return self._search_entry(entry, mode, single_pass)
+            key = self._checkpoint_key(entry, mode, single_pass)
+            result = self.checkpoints.get(key)
+            if result is not None:
+                shared_instrument.count('checkpoint.hits')
+                return result
+            result = self._search_entry(entry, mode, single_pass)
+            # the structure file may have been downloaded in the meantime
+            key = self._checkpoint_key(entry, mode, single_pass)
+            self.checkpoints.put(key, result)
+            return result
+
+    def _search_entry(self, entry, mode, single_pass):
+        """Does the job of analyse_entry()."""
+        pdb_id = entry['pdb_id']
+        domains = entry['domains']
+        result = {}
+        result['pdb_id'] = pdb_id
+        result['interactions'] = []
+        if mode == 'batch':
+            return self._search_batch(entry, result, single_pass)
+        if mode == 'analysis_3':
+            pairs = []
             # all possible domains combinations (2) for an annotation
-            combs = annotation['combinations']
-            for comb in combs:
+            for comb in entry['combinations']:
                 # extracts domain annotations for an id of the combination
                 domain_1 = self._get_domain_from_id(comb[0], domains)
                 domain_2 = self._get_domain_from_id(comb[1], domains)
-                name_1 = domain_1['name']
-                name_2 = domain_2['name']
-                # searches for interactions between this two domains and
-                # in this PDB structure
-                inter = self.interaction(rel_path, pdb_id, domain_1, domain_2)
-                if inter:
-                    # export an annotated structure in a png, but we have
-                    # problems with that : pymol does the job for a few
-                    # structures but bugs for a lot of structures.
-                    # Please uncomment if you wanna test
-                    #representation().export_png(rel_path, pdb_id, inter)
-                    # appends the interaction in a list of entries
-                    self._append_interactants(name_1, name_2, analysis)
-                    self._append_interactants(name_2, name_1, analysis)
-        return analysis
+                pairs.append((domain_1, domain_2))
+        else:
+            # just extracts the informations for the domain passed as an
+            # argument
+            main_domain = self._get_domain_of_interest(domains)
+            result['name'] = main_domain['name']
+            pairs = []
+            for domain in domains:
+                # checks the iPFAM list, the homodomain interactions are
+                # searched with the other copies of the main domain
+                if mode == 'analysis' and domain['id'] in self.pfam_ids \
+                        and domain is not main_domain:
+                    pairs.append((main_domain, domain))
+                # to not test the main domain with itself
+                elif mode == 'analysis_2' and \
+                        domain['id'] != main_domain['id']:
+                    pairs.append((main_domain, domain))
+        if len(pairs) == 0:
+            return result
+        shared_instrument.count('pairs.tested', len(pairs))
+        rel_path = self._get_pdb_path(pdb_id)
+        contacts = None
+        i = j = None
+        if mode == 'analysis_3' and single_pass and self.engine != 'nsearch':
+            # the contacts between all the domains of the structure
+            contacts = self.contact_map(rel_path, pdb_id, domains)
+        for domain_1, domain_2 in pairs:
+            if mode == 'analysis_3' and single_pass and \
+                    self.engine != 'nsearch':
+                # just reads the matrix
+                i = domains.index(domain_1)
+                j = domains.index(domain_2)
+                inter = self._in_contact(contacts, i, j)
+            else:
+                # searches for interactions between this two domains and in
+                # this PDB structure
+                inter = self.interaction(rel_path, pdb_id, domain_1,
+                        domain_2)
+            if inter:
+                shared_instrument.count('pairs.contact')
+                # the annotated structures are exported in png files by
+                # render(), after the search (pymol can't be launched for
+                # each interaction)
+                interaction = {}
+                interaction['domain_1'] = domain_1['name']
+                interaction['domain_2'] = domain_2['name']
+                # the single pass search only counts the contacts
+                if isinstance(inter, dict):
+                    interaction['residues_1'] = inter['1']['residues']
+                    interaction['residues_2'] = inter['2']['residues']
+                    interaction['atoms_1'] = inter['1']['atoms']
+                    interaction['atoms_2'] = inter['2']['atoms']
+                    interaction['distance'] = inter['distance']
+                self._add_occupancy(interaction, inter, contacts, i, j)
+                result['interactions'].append(interaction)
+        return result
+
+    def _search_batch(self, entry, result, single_pass):
+        """Does the job of analyse_entry() for the batch mode: the pairs of
+        all the domains of interest of the structure are searched in one
+        pass, each pair of domains once."""
+        domains = entry['domains']
+        partners = entry.get('partners')
+        # (family, domain of interest, other domain)
+        pairs = []
+        for family in entry['families']:
+            main_domain = self._get_domain_from_id(family, domains)
+            if main_domain is None:
+                continue
+            for domain in domains:
+                # the same rules as analysis() and analysis_2()
+                if partners is not None:
+                    if domain['id'] in partners[family] and \
+                            domain is not main_domain:
+                        pairs.append((family, main_domain, domain))
+                elif domain['id'] != family:
+                    pairs.append((family, main_domain, domain))
+        if len(pairs) == 0:
+            return result
+        shared_instrument.count('pairs.tested', len(pairs))
+        rel_path = self._get_pdb_path(result['pdb_id'])
+        contacts = None
+        if single_pass and self.engine != 'nsearch':
+            # the contacts between all the domains of the structure
+            contacts = self.contact_map(rel_path, result['pdb_id'], domains)
+        # the pairs already searched, by (index, index) of the domains
+        searched = {}
+        for family, domain_1, domain_2 in pairs:
+            i = domains.index(domain_1)
+            j = domains.index(domain_2)
+            # the pair of two domains of interest is found twice
+            key = (min(i, j), max(i, j))
+            first = key not in searched
+            if not first:
+                inter = searched[key]
+            elif single_pass and self.engine != 'nsearch':
+                # just reads the matrix
+                inter = self._in_contact(contacts, i, j)
+            else:
+                inter = self.interaction(rel_path, result['pdb_id'],
+                        domain_1, domain_2)
+            searched[key] = inter
+            if inter:
+                shared_instrument.count('pairs.contact')
+                interaction = {}
+                interaction['family'] = family
+                interaction['domain_1'] = domain_1['name']
+                interaction['domain_2'] = domain_2['name']
+                # the residues are only kept once for a pair, so the images
+                # and the records are not written twice
+                if isinstance(inter, dict) and first:
+                    interaction['residues_1'] = inter['1']['residues']
+                    interaction['residues_2'] = inter['2']['residues']
+                    interaction['atoms_1'] = inter['1']['atoms']
+                    interaction['atoms_2'] = inter['2']['atoms']
+                    interaction['distance'] = inter['distance']
+                self._add_occupancy(interaction, inter, contacts, i, j)
+                result['interactions'].append(interaction)
+        return result
+
+    def contact_map(self, pdb_id, filename, domains):
+        """Returns a dict with the domains and the domain x domain matrices of
+        the atom and residue contacts ('atoms' and 'residues') for all the
+        domains of a structure, computed in one pass. With the ensemble
+        engine, the matrices are the number of models where two domains are
+        in contact ('models') and its fraction ('occupancy')."""
+        logger.info("Searching for interactions in %s...", pdb_id,
+                extra={'path': pdb_id})
+        if self.engine == 'ensemble':
+            models = self.models.get_ensemble(pdb_id, filename)
+            index = self.models.get_interval_index(pdb_id, filename,
+                    ensemble_model=True)
+            domains_atoms = []
+            for domain in domains:
+                domains_atoms.append(structure(pdb_id).get_residues(
+                    models.model, domain, index))
+            # the number of models where each pair of domains is in contact
+            contacts = {}
+            with shared_instrument.stage('contact_map', path=pdb_id):
+                contacts['models'] = contact(self.cutoff).occupancy_map(
+                        models.coords, domains_atoms)
+            contacts['models_num'] = models.models_num
+            contacts['occupancy'] = contacts['models'] / \
+                    float(models.models_num)
+            contacts['domains'] = domains
+            return contacts
+        if self.engine == 'compact':
+            model = self.models.get_compact(pdb_id, filename)
+            index = self.models.get_interval_index(pdb_id, filename, True)
+            # the atoms of the domains are indexes in the arrays
+            domains_atoms = []
+            for domain in domains:
+                domains_atoms.append(structure(pdb_id).get_residues(model,
+                    domain, index))
+            with shared_instrument.stage('contact_map', path=pdb_id):
+                contacts = contact(self.cutoff).contact_map_indexes(
+                        model.coords, domains_atoms, model.residue_index)
+            contacts['domains'] = domains
+            return contacts
+        model = self.models.get_model(pdb_id, filename)
+        index = self.models.get_interval_index(pdb_id, filename)
+        domains_atoms = []
+        for domain in domains:
+            residues = structure(pdb_id).get_residues(model, domain, index)
+            domains_atoms.append(Selection.unfold_entities(residues, 'A'))
+        with shared_instrument.stage('contact_map', path=pdb_id):
+            contacts = contact(self.cutoff).contact_map(domains_atoms)
+        contacts['domains'] = domains
+        return contacts
 
     def interaction(self, pdb_id, filename, domain_1, domain_2):
-        """Returns a dict with informations (atoms, residues...) if two domains
-        interact with each other, and returns False if not."""
-        print "Searching for interactions in "+pdb_id+"..."
-        # creates a strucuture object/class to extract atoms of the two domains
-        model = structure(pdb_id).get_model(pdb_id, filename)
-        residues_1 = structure(pdb_id).get_residues(model, domain_1)
-        residues_2 = structure(pdb_id).get_residues(model, domain_2)
-        atoms_1 = Selection.unfold_entities(residues_1, 'A')
-        atoms_2 = Selection.unfold_entities(residues_2, 'A')
-        # gets the serial numbers of the atoms
-        numbers_1 = structure(pdb_id).serial_numbers(atoms_1)
-        numbers_2 = structure(pdb_id).serial_numbers(atoms_2)
+        """Returns a dict with informations if two domains interact with
+        each other, and returns False if not: for each domain ('1' and '2')
+        the serial numbers of the interacting atoms and the (chain, number,
+        insertion code) of the interacting residues, and the minimum
+        distance between the two domains. There is no reference to the
+        parsed model."""
+        logger.info("Searching for interactions in %s...", pdb_id,
+                extra={'path': pdb_id})
+        if self.engine == 'compact':
+            # the arrays of the structure, the atoms are indexes in them
+            model = self.models.get_compact(pdb_id, filename)
+            index = self.models.get_interval_index(pdb_id, filename, True)
+            atoms_1 = structure(pdb_id).get_residues(model, domain_1, index)
+            atoms_2 = structure(pdb_id).get_residues(model, domain_2, index)
+        elif self.engine == 'ensemble':
+            # the same with the coordinates of all the models
+            models = self.models.get_ensemble(pdb_id, filename)
+            model = models.model
+            index = self.models.get_interval_index(pdb_id, filename,
+                    ensemble_model=True)
+            atoms_1 = structure(pdb_id).get_residues(model, domain_1, index)
+            atoms_2 = structure(pdb_id).get_residues(model, domain_2, index)
+        else:
+            # the model, its atoms and its search tree come from the cache,
+            # so the file is parsed only once for all the domain pairs
+            model = self.models.get_model(pdb_id, filename)
+            index = self.models.get_interval_index(pdb_id, filename)
+            residues_1 = structure(pdb_id).get_residues(model, domain_1,
+                    index)
+            residues_2 = structure(pdb_id).get_residues(model, domain_2,
+                    index)
+            atoms_1 = Selection.unfold_entities(residues_1, 'A')
+            atoms_2 = Selection.unfold_entities(residues_2, 'A')
         # the search starts here !
-        atoms = Selection.unfold_entities(model, 'A')
-        nsearch = NeighborSearch(atoms)
-        interacting_atoms_1 = []
-        interacting_atoms_2 = []
-        for atom in atoms:
-            if atom.get_serial_number() in numbers_1:
-                point = atom.get_coord()
-                # This is how we detect an interaction, we put 5 angstroms
-                # here.
-                # This is the simplest method we can use, and we're not sure
-                # that it is correct.
-                # Originally we have planned to go further by doing a surface
-                # and accesssion analysis, but we had no time.
-                # We hope we can talk about that during the talk.
-                neighbors = nsearch.search(point, 5)
-                for neighbor in neighbors:
-                    if neighbor.get_serial_number() in numbers_2:
-                        interacting_atoms_2.append(neighbor)
-                        if atom not in interacting_atoms_1:
-                            interacting_atoms_1.append(atom)
+        # This is how we detect an interaction, we put 5 angstroms here.
+        # This is the simplest method we can use, and we're not sure that it
+        # is correct.
+        # Originally we have planned to go further by doing a surface and
+        # accesssion analysis, but we had no time.
+        # We hope we can talk about that during the talk.
+        with shared_instrument.stage('contacts', path=pdb_id):
+            if self.engine == 'nsearch':
+                interacting_atoms_1, interacting_atoms_2, distance = \
+                        self._search_nsearch(pdb_id, filename, atoms_1,
+                                atoms_2)
+            elif self.engine == 'compact':
+                interacting_atoms_1, interacting_atoms_2, distance = \
+                        self._search_compact(model, atoms_1, atoms_2)
+            elif self.engine == 'ensemble':
+                interacting_atoms_1, interacting_atoms_2, distance, \
+                        contact_models = self._search_ensemble(models,
+                                atoms_1, atoms_2)
+            else:
+                interacting_atoms_1, interacting_atoms_2, distance = \
+                        self._search_kdtree(atoms_1, atoms_2)
         # returns a dict with all residues and atoms
         if len(interacting_atoms_2) > 0:
+            # each atom once and in the order of the structure, whatever the
+            # order of the search, so all the engines give the same results
+            interacting_atoms_1 = self._structure_order(interacting_atoms_1)
+            interacting_atoms_2 = self._structure_order(interacting_atoms_2)
             infos = {}
             infos['1'] = {}
             infos['2'] = {}
             # just get the parent residues for the list of atoms
-            interacting_residues_1 = structure(pdb_id).atoms2residues(
-                    interacting_atoms_1)
-            interacting_residues_2 = structure(pdb_id).atoms2residues(
-                    interacting_atoms_2)
-            infos['1']['atoms'] = interacting_atoms_1
-            infos['2']['atoms'] = interacting_atoms_2
+            interacting_residues_1 = structure(pdb_id).residue_ids(
+                    structure(pdb_id).atoms2residues(interacting_atoms_1,
+                        model))
+            interacting_residues_2 = structure(pdb_id).residue_ids(
+                    structure(pdb_id).atoms2residues(interacting_atoms_2,
+                        model))
+            # the serial numbers instead of the atoms (or the indexes)
+            if self.engine in ['compact', 'ensemble']:
+                serials_1 = model.serial[interacting_atoms_1].tolist()
+                serials_2 = model.serial[interacting_atoms_2].tolist()
+            else:
+                serials_1 = structure(pdb_id).serial_numbers(
+                        interacting_atoms_1)
+                serials_2 = structure(pdb_id).serial_numbers(
+                        interacting_atoms_2)
+            infos['1']['atoms'] = sorted(serials_1)
+            infos['2']['atoms'] = sorted(serials_2)
             infos['1']['residues'] = interacting_residues_1
             infos['2']['residues'] = interacting_residues_2
+            infos['distance'] = round(distance, 3)
+            if self.engine == 'ensemble':
+                # the fraction of the models where the domains are in
+                # contact
+                infos['models'] = models.models_num
+                infos['occupancy'] = round(float(contact_models) /
+                        models.models_num, 3)
             return infos
         else: return False
 
     def frequencies(self, analysis):
         """Returns the frequencies of interaction pairs based on the number
         of occurences of each domain in the interacting domain list."""
-        frequencies = []
-        interactants = analysis['interactants']
-        # uniquify the list
-        unique_interactants = list(set(interactants))
-        for interactant in unique_interactants:
-            occurence_num = interactants.count(interactant)
-            frequency = float(occurence_num) / float(len(interactants))
-            entry = {}
-            entry['domain_1'] = analysis['name']
-            entry['domain_2'] = interactant
-            entry['frequency'] = str(round(frequency, 2))
-            frequencies.append(entry)
-        return frequencies
+        return self.aggregate(analysis).records()
 
     def frequencies_from_list(self, analysis):
         """Calls the frequencies() function for a list of interactions."""
-        frequencies = []
-        for entry in analysis:
-            entry_freq = self.frequencies(entry)
-            frequencies += entry_freq
-        return frequencies
+        return self.aggregate(analysis).records()
 
+    def aggregate(self, analysis):
+        """Returns an aggregate object with the counts of an interaction
+        analysis dict or of a list of them. It gives the frequencies, the raw
+        counts and the denominators, and can be merged with others."""
+        with shared_instrument.stage('frequencies'):
+            aggregation = aggregate()
+            aggregation.add_analysis(analysis)
+        return aggregation
 
     # private functions
+
+    def _search_kdtree(self, atoms_1, atoms_2):
+        """Returns the interacting atoms of two domains and their minimum
+        distance, only the atoms of the two domains are searched."""
+        search = contact(self.cutoff)
+        coords_1 = search.coordinates(atoms_1)
+        coords_2 = search.coordinates(atoms_2)
+        neighbors = search.search_coords(coords_1, coords_2)
+        interacting_atoms_1 = []
+        interacting_atoms_2 = []
+        for i, indexes in enumerate(neighbors):
+            if indexes:
+                interacting_atoms_1.append(atoms_1[i])
+                for j in indexes:
+                    interacting_atoms_2.append(atoms_2[j])
+        return interacting_atoms_1, interacting_atoms_2, \
+                search.min_distance(coords_1, coords_2, neighbors)
+
+    def _search_compact(self, model, atoms_1, atoms_2):
+        """Returns the interacting atoms (indexes) of two domains of a compact
+        model and their minimum distance."""
+        search = contact(self.cutoff)
+        coords_1 = model.coords[atoms_1]
+        coords_2 = model.coords[atoms_2]
+        neighbors = search.search_coords(coords_1, coords_2)
+        interacting_atoms_1 = []
+        interacting_atoms_2 = []
+        for i, indexes in enumerate(neighbors):
+            if indexes:
+                interacting_atoms_1.append(atoms_1[i])
+                for j in indexes:
+                    interacting_atoms_2.append(atoms_2[j])
+        return interacting_atoms_1, interacting_atoms_2, \
+                search.min_distance(coords_1, coords_2, neighbors)
+
+    def _search_ensemble(self, models, atoms_1, atoms_2):
+        """Returns the interacting atoms (indexes) of two domains of an
+        ensemble, their minimum distance and the number of models where they
+        are in contact. The atoms in contact in at least one model are
+        returned, and no atom if the domains are in contact in too few
+        models."""
+        search = contact(self.cutoff)
+        coords_1 = models.coords[:, atoms_1]
+        coords_2 = models.coords[:, atoms_2]
+        # all the models in one query for each domain
+        distances_1 = search.search_ensemble(coords_1, coords_2)
+        distances_2 = search.search_ensemble(coords_2, coords_1)
+        in_contact_1 = numpy.isfinite(distances_1)
+        in_contact_2 = numpy.isfinite(distances_2)
+        contact_models = int(in_contact_1.any(axis=1).sum())
+        if contact_models == 0 or float(contact_models) / \
+                models.models_num < self.occupancy:
+            return [], [], None, contact_models
+        atoms_1 = numpy.asarray(atoms_1)
+        atoms_2 = numpy.asarray(atoms_2)
+        interacting_atoms_1 = atoms_1[in_contact_1.any(axis=0)].tolist()
+        interacting_atoms_2 = atoms_2[in_contact_2.any(axis=0)].tolist()
+        distance = float(distances_1[in_contact_1].min())
+        return interacting_atoms_1, interacting_atoms_2, distance, \
+                contact_models
+
+    def _search_nsearch(self, pdb_id, filename, atoms_1, atoms_2):
+        """Returns the interacting atoms of two domains and their minimum
+        distance, all the atoms of the model are searched (the original
+        method, kept to cross-check the results)."""
+        # gets the serial numbers of the atoms
+        numbers_1 = structure(pdb_id).serial_numbers(atoms_1)
+        numbers_2 = structure(pdb_id).serial_numbers(atoms_2)
+        atoms = self.models.get_atoms(pdb_id, filename)
+        nsearch = self.models.get_nsearch(pdb_id, filename)
+        # sets, the lists are searched for each atom
+        numbers_1 = set(numbers_1)
+        numbers_2 = set(numbers_2)
+        interacting_atoms_1 = []
+        interacting_atoms_2 = []
+        distance = None
+        for atom in atoms:
+            if atom.get_serial_number() in numbers_1:
+                point = atom.get_coord()
+                neighbors = nsearch.search(point, self.cutoff)
+                shared_instrument.count('neighbor.queries')
+                found = False
+                for neighbor in neighbors:
+                    if neighbor.get_serial_number() in numbers_2:
+                        interacting_atoms_2.append(neighbor)
+                        found = True
+                        # the distance between two atoms
+                        gap = atom - neighbor
+                        if distance is None or gap < distance:
+                            distance = gap
+                if found:
+                    interacting_atoms_1.append(atom)
+        return interacting_atoms_1, interacting_atoms_2, distance
     
     def _ids2filenames(self, pdb_ids):
         """Returns a list of filenames from a pdb id list."""
@@ -274,6 +753,147 @@ class interaction:
         filename = re.sub('$', '.ent', filename)
         return filename
 
+    def _pdb_path(self, pdb_id):
+        """Returns the path of the structure file of a structure, whatever
+        its format, or the path of the pdb file if there is no file."""
+        rel_path = structure(pdb_id).locate_file(self.directory)
+        if rel_path is None:
+            # converts a PDB id to a filename
+            filename = self._id2filename(pdb_id)
+            rel_path = self.directory+'/'+filename
+        return rel_path
+
+    def _get_pdb_path(self, pdb_id):
+        """Returns the path of the pdb file of a structure, the file is
+        downloaded if necessary."""
+        rel_path = self._pdb_path(pdb_id)
+        if not os.path.isfile(rel_path):
+            # downloads the PDB file
+            structure(pdb_id).get_pdb_file(self.directory)
+            rel_path = self._pdb_path(pdb_id)
+        return rel_path
+
+    def _png_path(self, rel_path, interaction, names):
+        """Returns the name of the png image of an interaction, a set of
+        the names already given is needed to not overwrite an image."""
+        base = rel_path
+        if base.endswith('.gz'):
+            base = base[:-3]
+        # the domain names can contain any character
+        name_1 = re.sub('[^\w.-]', '_', interaction['domain_1'])
+        name_2 = re.sub('[^\w.-]', '_', interaction['domain_2'])
+        base = os.path.splitext(base)[0]+'_'+name_1+'_'+name_2
+        png = base+'.png'
+        number = 1
+        # the same domains can interact several times in a structure
+        while png in names:
+            number += 1
+            png = base+'_'+str(number)+'.png'
+        names.add(png)
+        return png
+
+    def _checkpoint_key(self, entry, mode, single_pass):
+        """Returns the key of the result of an entry in the checkpoint
+        store."""
+        annotation = {}
+        annotation['domains'] = entry['domains']
+        annotation['combinations'] = entry.get('combinations')
+        # the domains of interest of the batch mode
+        if mode == 'batch':
+            annotation['families'] = entry['families']
+            annotation['partners'] = entry.get('partners')
+        settings = {}
+        settings['mode'] = mode
+        settings['single_pass'] = single_pass
+        settings['pfam_id'] = self.pfam_id
+        # the atoms and the residues of the results are in the order of the
+        # structure since this version, the older results are not replayed
+        settings['results'] = 2
+        # the other engines give the same results
+        if self.engine == 'ensemble':
+            settings['engine'] = self.engine
+            settings['occupancy'] = self.occupancy
+        if mode == 'analysis':
+            settings['pfam_ids'] = sorted(self.pfam_ids)
+        rel_path = self._pdb_path(entry['pdb_id'])
+        return self.checkpoints.key(entry['pdb_id'], rel_path, annotation,
+                self.cutoff, settings)
+
+    def _tasks(self, entries, settings, mode):
+        """Yields the tasks given to the worker processes, one for each
+        entry, as soon as the entry is ready."""
+        for entry in entries:
+            entry = dict(entry)
+            # the combinations come from itertools and can't be pickled
+            if 'combinations' in entry:
+                entry['combinations'] = list(entry['combinations'])
+            yield (settings, mode, entry)
+
+    def _merge_analysis(self, results):
+        """Returns an interaction analysis dict from the results of
+        analyse_entry() for analysis() and analysis_2()."""
+        analysis = {}
+        analysis['interactants'] = []
+        for result in results:
+            if 'name' in result:
+                analysis['name'] = result['name']
+            for interaction in result['interactions']:
+                analysis['interactants'].append(interaction['domain_2'])
+        return analysis
+
+    def _merge_analysis_3(self, results):
+        """Returns the list of interaction analysis dicts from the results
+        of analyse_entry() for analysis_3()."""
+        analysis = []
+        # the entries of the list by domain name
+        index = {}
+        for result in results:
+            for interaction in result['interactions']:
+                # appends the interaction in a list of entries
+                self._append_interactants(interaction['domain_1'],
+                        interaction['domain_2'], analysis, index)
+                self._append_interactants(interaction['domain_2'],
+                        interaction['domain_1'], analysis, index)
+        return analysis
+
+    def _in_contact(self, contacts, i, j):
+        """Returns True if the domains i and j are in contact in the
+        matrices of contact_map()."""
+        if 'occupancy' in contacts:
+            # the ensemble engine
+            return bool(contacts['models'][i, j] > 0 and
+                    contacts['occupancy'][i, j] >= self.occupancy)
+        return bool(contacts['atoms'][i, j] > 0)
+
+    def _add_occupancy(self, interaction, inter, contacts, i, j):
+        """Adds the number of models and the occupancy of a pair of domains
+        to an interaction, with the ensemble engine."""
+        if isinstance(inter, dict) and 'occupancy' in inter:
+            interaction['models'] = inter['models']
+            interaction['occupancy'] = inter['occupancy']
+        elif contacts is not None and 'occupancy' in contacts:
+            interaction['models'] = contacts['models_num']
+            interaction['occupancy'] = round(float(
+                contacts['occupancy'][i, j]), 3)
+
+    def _single_pass(self, single_pass):
+        """Returns the single pass option of analysis_3(): the images and
+        the records need the residues, which are only found by the search of
+        the pairs one by one."""
+        if self.renderer is not None or self.recorder is not None:
+            return False
+        return single_pass
+
+    def _structure_order(self, atoms):
+        """Returns the interacting atoms of a search, each one once and in
+        the order of the structure: the indexes of a compact model are
+        sorted, the Bio.PDB atoms are sorted by serial number."""
+        if self.engine in ['compact', 'ensemble']:
+            return sorted(set(atoms))
+        unique = dict((id(atom), atom) for atom in atoms)
+        return sorted(unique.values(), key=lambda atom:
+                atom.get_serial_number())
+
     def _get_domain_of_interest(self, domains):
         """Returns the domain of interest from a list of domains."""
         for domain in domains:
@@ -286,15 +906,18 @@ class interaction:
             if domain['id'] == pfam_id:
                 return domain
 
-    def _append_interactants(self, name_1, name_2, analysis):
+    def _append_interactants(self, name_1, name_2, analysis, index=None):
         """Takes two domains and a list of dict that contains all interacting
         domains for each domain. This function creates the dict if necessary
-        and adds the interacting domains."""
-        # the entry for a domain already exists
-        if any(entry['name'] == name_1 for entry in analysis):
+        and adds the interacting domains. The index dict (domain name ->
+        entry) avoids searching the list."""
+        if index is None:
+            index = {}
             for entry in analysis:
-                if entry['name'] == name_1:
-                    entry['interactants'].append(name_2)
+                index.setdefault(entry['name'], entry)
+        # the entry for a domain already exists
+        if name_1 in index:
+            index[name_1]['interactants'].append(name_2)
         # the entry for a domain doesn't exist
         else:
             new_entry = {}
@@ -302,4 +925,22 @@ class interaction:
             new_entry['interactants'] = []
             new_entry['interactants'].append(name_2)
             analysis.append(new_entry)
+            index[name_1] = new_entry
 
+def _analyse_entry(task):
+    """Runs interaction.analyse_entry() for a task (settings, mode, entry) in
+    a worker process, returns the result and the snapshot of the instrument
+    of the worker."""
+    settings, mode, entry = task
+    shared_instrument.forget_parent()
+    shared_instrument.enable(settings['profile'])
+    checkpoints = None
+    if settings['checkpoints'] is not None:
+        checkpoints = checkpoint(settings['checkpoints'])
+    inter = interaction(settings['pfam_id'], [], settings['pfam_ids'],
+            engine=settings['engine'], checkpoints=checkpoints,
+            cutoff=settings['cutoff'], occupancy=settings['occupancy'])
+    inter.directory = settings['directory']
+    result = inter.analyse_entry(entry, mode, settings['single_pass'])
+    # only the measures of this task
+    return result, shared_instrument.take()
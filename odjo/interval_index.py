@@ -0,0 +1,117 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" interval_index class """
+
+import re
+import numpy
+from bisect import bisect_left, bisect_right
+
+# local imports
+from .compact import compact
+
+class interval_index:
+
+    """
+    This class finds the residues of a domain in a model. It is built once
+    per model: the residues of each chain are sorted by (number, insertion
+    code), so the residues between the pdbResNumStart and pdbResNumEnd of a
+    Pfam hit are found by two binary searches instead of testing all the
+    residues of the chain for each domain.
+
+    The residue numbers of the hits may be negative and may have an
+    insertion code ('52A'). An end without insertion code includes all the
+    insertion codes of its number.
+
+    @param model: a Bio.PDB model or a compact model
+    @type model: Model or compact
+    """
+
+    # an insertion code greater than all the others
+    last_icode = '\x7f'
+
+    def __init__(self, model):
+        # chain id -> (sorted keys, position of the residue of each key)
+        self.chains = {}
+        # chain id -> residues (Bio.PDB model)
+        self.residues = {}
+        # the atom indexes grouped by residue (compact model)
+        self.atom_order = None
+        self.atom_bounds = None
+        if isinstance(model, compact):
+            self._build_compact(model)
+        else:
+            self._build_model(model)
+
+    def select(self, domain):
+        """Returns the residues of a domain, in the order of the chain. For
+        a compact model, returns the sorted array of the indexes of the
+        atoms of these residues. A KeyError is raised if the chain doesn't
+        exist."""
+        positions = self.lookup(domain['chain'], domain['start'],
+                domain['end'])
+        if self.atom_order is not None:
+            if not positions:
+                return numpy.array([], dtype=numpy.intp)
+            # the residues of a range are consecutive in a compact model
+            return numpy.sort(self.atom_order[
+                self.atom_bounds[positions[0]]:
+                self.atom_bounds[positions[-1]+1]])
+        residues = self.residues[domain['chain']]
+        return [residues[position] for position in positions]
+
+    def lookup(self, chain_id, start, end):
+        """Returns the sorted positions of the residues of a chain between
+        two residue numbers (included)."""
+        keys, positions = self.chains[chain_id]
+        low = bisect_left(keys, self.parse(start))
+        high = bisect_right(keys, self.parse(end, True))
+        return sorted(positions[low:high])
+
+    def parse(self, number, end=False):
+        """Returns the (number, insertion code) key of a residue number like
+        '52', '-3' or '52A'. A ValueError is raised if the number is not
+        valid."""
+        match = re.match(r'^\s*(-?\d+)\s*([A-Za-z]?)\s*$', str(number))
+        if match is None:
+            raise ValueError('invalid residue number: '+repr(number))
+        icode = match.group(2)
+        if not icode and end:
+            icode = self.last_icode
+        return (int(match.group(1)), icode)
+
+    # private functions
+
+    def _build_model(self, model):
+        """Indexes the residues of a Bio.PDB model."""
+        for chain in model:
+            residues = chain.get_list()
+            keys = []
+            for residue in residues:
+                hetero, number, icode = residue.get_id()
+                keys.append((number, icode.strip()))
+            # the residues are usually already sorted
+            positions = sorted(range(len(keys)), key=keys.__getitem__)
+            self.chains[chain.get_id()] = ([keys[p] for p in positions],
+                    positions)
+            self.residues[chain.get_id()] = residues
+
+    def _build_compact(self, model):
+        """Indexes the residues of a compact model."""
+        residues_num = int(model.residue_index.max()) + 1 if len(model) \
+                else 0
+        # the atoms of residue r are atom_order[atom_bounds[r]:
+        # atom_bounds[r+1]]
+        self.atom_order = numpy.argsort(model.residue_index, kind='mergesort')
+        self.atom_bounds = numpy.zeros(residues_num+1, dtype=numpy.intp)
+        numpy.cumsum(numpy.bincount(model.residue_index,
+            minlength=residues_num), out=self.atom_bounds[1:])
+        # the residues are numbered in the (chain, number, insertion code)
+        # order, so they are already sorted in each chain
+        first = self.atom_order[self.atom_bounds[:-1]]
+        for chain, chain_id in enumerate(model.chains):
+            in_chain = numpy.nonzero(model.chain_index[first] == chain)[0]
+            keys = zip(model.resseq[first[in_chain]].tolist(),
+                    [icode.strip() for icode in
+                        model.icode[first[in_chain]].tolist()])
+            self.chains[chain_id] = (keys, in_chain.tolist())
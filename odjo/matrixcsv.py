@@ -4,49 +4,147 @@
 """ matrixcsv class """
 
 import csv
+import numpy
+from scipy import sparse as scipy_sparse
+
+# local imports
+from .instrument import shared_instrument
 
 class matrixcsv:
 
     """
-    This class contains methods for CSV files I/O.
+    This class contains methods for CSV files I/O. The frequencies matrix is
+    built in one pass over the frequencies list, as a dense NumPy array or a
+    SciPy sparse matrix, and it can also be saved in binary formats.
     """
 
-    def frequencies_matrix(self, frequencies_list):
-        """Writes a csv file for frequencies analysis."""
-        # we take a copy
-        frequencies = frequencies_list[:]
-        header = self._domains_from_frequencies(frequencies)
-        row_names = header[:]
-        with open('matrix.csv', 'wb') as csvfile:
-            writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-            writer.writerow(['']+header)
-            # checks for all domains couples
-            for domain_1 in row_names:
-                current_row = []
-                for domain_2 in header:
-                    # the frequency exists
-                    if any(entry['domain_1'] == domain_1 and \
-                            entry['domain_2'] == domain_2 \
-                            for entry in frequencies):
-                        for entry in frequencies:
-                            if entry['domain_1'] == domain_1 and \
-                                    entry['domain_2'] == domain_2:
-                                current_row.append(float(entry['frequency']))
-                    # the frequency doesn't exist so put 0
-                    else:
-                        current_row.append(int(0))
-                writer.writerow([domain_1]+current_row)
+    def frequencies_matrix(self, frequencies_list, filename='matrix.csv',
+            sparse=False, formats=[]):
+        """Writes a csv file for frequencies analysis. The formats list can
+        contain 'npy' (dense matrix), 'npz' (labelled sparse matrix) and 'coo'
+        (labelled triplets text file), these files are written next to the
+        csv file."""
+        with shared_instrument.stage('matrix', filename=filename):
+            header, matrix = self.build_matrix(frequencies_list, sparse)
+            with open(filename, 'wb') as csvfile:
+                writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+                writer.writerow(['']+header)
+                # one row at a time
+                for i, domain_1 in enumerate(header):
+                    writer.writerow([domain_1]+self._csv_row(matrix, i))
+            base = filename
+            if base.endswith('.csv'):
+                base = base[:-4]
+            if 'npy' in formats:
+                self.write_npy(header, matrix, base+'.npy')
+            if 'npz' in formats:
+                self.write_npz(header, matrix, base+'.npz')
+            if 'coo' in formats:
+                self.write_coo(header, matrix, base+'.coo.tsv')
+
+    def build_matrix(self, frequencies_list, sparse=False):
+        """Returns the domains list and the frequencies matrix (rows are the
+        domain_1, columns the domain_2). The dense matrix contains NaN for the
+        missing pairs, the sparse matrix (CSR) only contains the existing
+        pairs."""
+        domains = self._domains_from_frequencies(frequencies_list)
+        # indexes the domains once
+        index = {}
+        for i, domain in enumerate(domains):
+            index[domain] = i
+        size = len(domains)
+        rows = numpy.empty(len(frequencies_list), dtype='i')
+        cols = numpy.empty(len(frequencies_list), dtype='i')
+        values = numpy.empty(len(frequencies_list), dtype='d')
+        for n, entry in enumerate(frequencies_list):
+            rows[n] = index[entry['domain_1']]
+            cols[n] = index[entry['domain_2']]
+            values[n] = float(entry['frequency'])
+        if sparse:
+            matrix = scipy_sparse.csr_matrix((values, (rows, cols)),
+                    shape=(size, size))
+        else:
+            matrix = numpy.empty((size, size), dtype='d')
+            matrix.fill(numpy.nan)
+            matrix[rows, cols] = values
+        return domains, matrix
+
+    def write_npy(self, domains, matrix, filename):
+        """Writes the dense matrix (0 for the missing pairs) in a .npy file,
+        the rows and columns are in the order of the csv header."""
+        if scipy_sparse.issparse(matrix):
+            dense = matrix.toarray()
+        else:
+            dense = numpy.nan_to_num(matrix)
+        numpy.save(filename, dense)
+
+    def write_npz(self, domains, matrix, filename):
+        """Writes the matrix in a compressed .npz file with the domain names
+        and the (row, col, value) triplets of the existing pairs."""
+        rows, cols, values = self._triplets(matrix)
+        numpy.savez_compressed(filename, domains=numpy.array(domains),
+                rows=rows, cols=cols, values=values,
+                shape=numpy.array([len(domains), len(domains)]))
+
+    def write_coo(self, domains, matrix, filename):
+        """Writes the existing pairs in a text file, one line per pair:
+        domain_1, domain_2 and frequency separated by tabs."""
+        rows, cols, values = self._triplets(matrix)
+        with open(filename, 'wb') as handle:
+            writer = csv.writer(handle, delimiter='\t', lineterminator='\n')
+            for row, col, value in zip(rows, cols, values):
+                writer.writerow([domains[row], domains[col], float(value)])
+
+    def read_npz(self, filename, sparse=True):
+        """Returns the domains list and the matrix of a .npz file written by
+        write_npz(), as a sparse (CSR) or a dense matrix."""
+        data = numpy.load(filename)
+        domains = list(data['domains'])
+        shape = tuple(data['shape'])
+        matrix = scipy_sparse.csr_matrix((data['values'], (data['rows'],
+            data['cols'])), shape=shape)
+        if not sparse:
+            matrix = matrix.toarray()
+        return domains, matrix
 
     # private functions
 
+    def _csv_row(self, matrix, i):
+        """Returns a row of the csv file, the frequency when it exists or 0
+        when it doesn't."""
+        if scipy_sparse.issparse(matrix):
+            row = [int(0)] * matrix.shape[1]
+            start, end = matrix.indptr[i], matrix.indptr[i+1]
+            for j, value in zip(matrix.indices[start:end],
+                    matrix.data[start:end]):
+                row[j] = float(value)
+            return row
+        # the frequency doesn't exist so put 0, the whole row at once
+        existing = ~numpy.isnan(matrix[i])
+        row = numpy.zeros(matrix.shape[1], dtype=object)
+        row[existing] = matrix[i][existing].tolist()
+        return row.tolist()
+
+    def _triplets(self, matrix):
+        """Returns the rows, columns and values arrays of the existing pairs
+        of a matrix."""
+        if scipy_sparse.issparse(matrix):
+            coo = matrix.tocoo()
+            return coo.row, coo.col, coo.data
+        rows, cols = numpy.nonzero(~numpy.isnan(matrix))
+        return rows, cols, matrix[rows, cols]
+
     def _domains_from_frequencies(self, frequencies):
         """Returns all domains of a frequencies analysis."""
         domains = []
+        # a set to not search in the list for each frequency
+        seen = set()
         for frequency in frequencies:
             # we want to have a uniquified list
-            if frequency['domain_1'] not in domains:
+            if frequency['domain_1'] not in seen:
+                seen.add(frequency['domain_1'])
                 domains.append(frequency['domain_1'])
-            if frequency['domain_2'] not in domains:
+            if frequency['domain_2'] not in seen:
+                seen.add(frequency['domain_2'])
                 domains.append(frequency['domain_2'])
         return domains
-
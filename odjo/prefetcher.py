@@ -0,0 +1,112 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" prefetcher class """
+
+import os
+import threading
+from Queue import Queue
+from collections import deque
+
+# local imports
+from .structure import structure
+
+# biopyton imports
+from Bio.PDB import PDBList
+
+class prefetcher:
+
+    """
+    This class downloads the PDB files of the next entries in background
+    threads while the current entries are analysed, so the network latency
+    is hidden behind the computations.
+
+    @param directory: the directory of the PDB files
+    @type directory: string
+
+    @param path: a function that returns the path of the PDB file of a PDB
+    id, the file is downloaded if it doesn't exist
+    @type path: function
+
+    @param workers: the number of download threads
+    @type workers: int
+
+    @param depth: the maximum number of entries prefetched in advance
+    @type depth: int
+    """
+
+    def __init__(self, directory, path, workers=4, depth=16):
+        self.directory = directory
+        self.path = path
+        self.workers = workers
+        self.depth = depth
+
+    def iterate(self, entries, key=None):
+        """Yields the entries in the same order, each entry is yielded when
+        its PDB file has been downloaded. The PDB id of an entry is given by
+        the key function, by default the entry is a dict with a 'pdb_id'."""
+        if key is None:
+            key = lambda entry: entry['pdb_id']
+        if self.workers <= 0:
+            for entry in entries:
+                yield entry
+            return
+        # the downloads waiting for a worker, at most depth of them
+        tasks = Queue(maxsize=self.depth)
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, args=(tasks,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        # the entries already submitted, in order
+        window = deque()
+        entries = iter(entries)
+        try:
+            for entry in entries:
+                window.append((entry, self._submit(tasks, key(entry))))
+                if len(window) >= self.depth:
+                    break
+            while window:
+                entry, done = window.popleft()
+                done.wait()
+                # keeps the window full
+                for next_entry in entries:
+                    window.append((next_entry,
+                        self._submit(tasks, key(next_entry))))
+                    break
+                yield entry
+        finally:
+            # stops the workers
+            for thread in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+
+    # private functions
+
+    def _submit(self, tasks, pdb_id):
+        """Submits a download and returns an event set when it is done."""
+        done = threading.Event()
+        if os.path.isfile(self.path(pdb_id)):
+            done.set()
+        else:
+            tasks.put((pdb_id, done))
+        return done
+
+    def _worker(self, tasks):
+        """Downloads the PDB files until a None task is received."""
+        # one PDBList for all the downloads of the thread
+        pdb_list = PDBList()
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            pdb_id, done = task
+            try:
+                if not os.path.isfile(self.path(pdb_id)):
+                    structure(pdb_id).get_pdb_file(self.directory, pdb_list)
+            except Exception:
+                # the analysis will try again and report the error
+                pass
+            done.set()
@@ -0,0 +1,100 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" recorder class """
+
+import json
+import gzip
+
+class recorder:
+
+    """
+    This class streams the contacts found by the search in a JSON lines file,
+    one compact record per pair of interacting domains: the PDB id, the
+    domains and their chains, the interacting residues ('52' or '52A', in
+    the order of the structure), the sorted serial numbers of the
+    interacting atoms and the minimum distance between the two domains. The
+    residues of a domain on another chain than its first residue are
+    written with their chain ('B:52'). A structure thus gives the same
+    records whatever the engine and the run. With the ensemble engine, a
+    record also has the number of models and the fraction of them where the
+    domains are in contact (occupancy). The records of a structure are
+    written as soon as the structure has been searched, so they are not kept
+    in memory during the run. The file is gzipped if its name ends with
+    .gz.
+
+    @param filename: the records file, it is overwritten
+    @type filename: string
+    """
+
+    def __init__(self, filename='contacts.jsonl'):
+        self.filename = filename
+        self.handle = None
+        # statistics
+        self.structures = 0
+        self.records_num = 0
+
+    def write(self, result):
+        """Writes the records of a result of interaction.analyse_entry()."""
+        if self.handle is None:
+            self.open()
+        for interaction in result['interactions']:
+            # the single pass search only counts the contacts
+            if 'residues_1' not in interaction:
+                continue
+            record = self.record(result['pdb_id'], interaction)
+            self.handle.write(json.dumps(record, sort_keys=True)+'\n')
+            self.records_num += 1
+        self.structures += 1
+        # a record is never lost if the run is interrupted
+        self.handle.flush()
+
+    def record(self, pdb_id, interaction):
+        """Returns the record of an interaction, a dict {pdb_id, domain_1,
+        domain_2, chain_1, chain_2, residues_1, residues_2, serials_1,
+        serials_2, distance}, and {models, occupancy} for an ensemble."""
+        record = {}
+        record['pdb_id'] = pdb_id
+        for n in ['1', '2']:
+            # the residues are already in the order of the structure
+            residues = interaction['residues_'+n]
+            chain = residues[0][0]
+            record['domain_'+n] = interaction['domain_'+n]
+            record['chain_'+n] = chain
+            # the chain is only written for the residues of the other chains
+            record['residues_'+n] = [(residue[0]+':' if residue[0] != chain
+                else '')+str(residue[1])+residue[2].strip()
+                for residue in residues]
+            # the results of the older checkpoints have no atoms
+            serials = interaction.get('atoms_'+n)
+            if serials is not None:
+                serials = sorted(serials)
+            record['serials_'+n] = serials
+        record['distance'] = interaction.get('distance')
+        if 'occupancy' in interaction:
+            record['models'] = interaction['models']
+            record['occupancy'] = interaction['occupancy']
+        return record
+
+    def read(self):
+        """Yields the records of the file."""
+        for line in self._open_file('r'):
+            yield json.loads(line)
+
+    def open(self):
+        """Opens the file, it is truncated."""
+        self.handle = self._open_file('w')
+
+    def close(self):
+        """Closes the file."""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    # private functions
+
+    def _open_file(self, mode):
+        """Opens the records file, gzipped or not."""
+        if self.filename.endswith('.gz'):
+            return gzip.open(self.filename, mode+'b')
+        return open(self.filename, mode)
@@ -0,0 +1,168 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" renderer class """
+
+import time
+import logging
+import multiprocessing
+from Queue import Empty
+from collections import deque
+
+# local imports
+from .representation import representation
+from .instrument import shared_instrument
+
+logger = logging.getLogger(__name__)
+
+class renderer:
+
+    """
+    This class draws a lot of png images with pymol. Each worker process
+    keeps its own headless pymol session running and takes its render jobs
+    (see representation.job()) one by one, the session is reinitialized
+    between two jobs. A worker that crashes or that is stuck on a job is
+    replaced by a new one, and its job is tried again.
+
+    @param workers: the number of pymol worker processes
+    @type workers: int
+
+    @param timeout: the maximum time (in seconds) of a job
+    @type timeout: float
+
+    @param retries: the number of times a job is tried again after a crash
+    @type retries: int
+    """
+
+    def __init__(self, workers=2, timeout=300, retries=1):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        # each slot: {'process', 'tasks', 'key', 'job'}
+        self.slots = []
+        self.results = None
+        # to recognize the messages of the replaced workers
+        self.keys = 0
+        # statistics
+        self.restarts = 0
+
+    def start(self):
+        """Starts the worker processes."""
+        if self.slots:
+            return
+        self.results = multiprocessing.Queue()
+        for i in range(self.workers):
+            self.slots.append(self._start_worker())
+
+    def render(self, jobs):
+        """Draws the jobs and returns, in the order of the jobs, a list of
+        dicts {job, png, error}: the png file, or the error if the job has
+        failed."""
+        self.start()
+        jobs = list(jobs)
+        rendered = [None] * len(jobs)
+        attempts = [0] * len(jobs)
+        pending = deque(range(len(jobs)))
+        remaining = len(jobs)
+        with shared_instrument.stage('render', jobs=len(jobs)):
+            while remaining > 0:
+                # gives a job to each idle worker
+                for slot in self.slots:
+                    if slot['job'] is None and pending:
+                        index = pending.popleft()
+                        slot['tasks'].put((index, jobs[index]))
+                        slot['job'] = (index, time.time())
+                try:
+                    key, index, png, error = self.results.get(timeout=0.5)
+                except Empty:
+                    self._supervise(jobs, rendered, attempts, pending)
+                    remaining = rendered.count(None)
+                    continue
+                for slot in self.slots:
+                    if slot['key'] == key and slot['job'] is not None and \
+                            slot['job'][0] == index:
+                        slot['job'] = None
+                # the job may have been given again to another worker
+                if rendered[index] is None:
+                    if index in pending:
+                        pending.remove(index)
+                    rendered[index] = {'job': jobs[index], 'png': png,
+                            'error': error}
+                    remaining -= 1
+                    if error is None:
+                        shared_instrument.count('images')
+        return rendered
+
+    def close(self):
+        """Stops the worker processes."""
+        for slot in self.slots:
+            if slot['process'].is_alive():
+                slot['tasks'].put(None)
+        for slot in self.slots:
+            slot['process'].join(10)
+            if slot['process'].is_alive():
+                slot['process'].terminate()
+        self.slots = []
+
+    # private functions
+
+    def _start_worker(self):
+        """Starts a worker process and returns its slot."""
+        self.keys += 1
+        tasks = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_render_worker,
+                args=(tasks, self.results, self.keys))
+        process.daemon = True
+        process.start()
+        return {'process': process, 'tasks': tasks, 'key': self.keys,
+                'job': None}
+
+    def _supervise(self, jobs, rendered, attempts, pending):
+        """Replaces the workers that are dead or stuck on their job. The job
+        is tried again, or recorded as failed."""
+        for i, slot in enumerate(self.slots):
+            crashed = not slot['process'].is_alive()
+            stuck = slot['job'] is not None and \
+                    time.time() - slot['job'][1] > self.timeout
+            if not crashed and not stuck:
+                continue
+            if stuck:
+                slot['process'].terminate()
+            slot['process'].join()
+            self.slots[i] = self._start_worker()
+            self.restarts += 1
+            shared_instrument.count('render.restarts')
+            if slot['job'] is None:
+                continue
+            index = slot['job'][0]
+            if rendered[index] is not None:
+                continue
+            attempts[index] += 1
+            logger.warning("The pymol worker has stopped on %s",
+                    jobs[index]['png'], extra={'png': jobs[index]['png']})
+            if attempts[index] <= self.retries:
+                pending.appendleft(index)
+            else:
+                error = 'timeout' if stuck else 'crash'
+                rendered[index] = {'job': jobs[index], 'png': None,
+                        'error': 'the pymol worker has stopped ('+error+')'}
+
+
+def _render_worker(tasks, results, key):
+    """Draws the jobs of a queue in a pymol session, until None is taken
+    from the queue."""
+    drawer = representation()
+    drawer.launch()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, job = task
+        try:
+            drawer.render(job)
+            results.put((key, index, job['png'], None))
+        except Exception, error:
+            results.put((key, index, None, error.__class__.__name__+': '+
+                str(error)))
+        # the next job starts from a clean session
+        drawer.reset()
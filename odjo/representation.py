@@ -4,44 +4,77 @@
 """ representation class """
 
 import re
-import pymol
-from Bio.PDB import PDBParser
+import imp
 
 class representation:
 
     """
     This class contains methods to export an image based on an annotated PDB
-    structure (pymol).
+    structure (pymol). Pymol is only imported when an image is drawn, it is
+    not needed by the rest of the program.
     """
 
+    def available(self):
+        """Returns True if pymol can be imported, without importing it."""
+        try:
+            imp.find_module('pymol')
+        except ImportError:
+            return False
+        return True
+
     def export_png(self, rel_path, pdb_id, infos):
         """Uses pymol to export a png representing a PDB structure. The image
         displays the chains that contains the domains (cartoon) and the
         interacting residues (surface). THE CHOICE HAS BEEN MADE TO NOT
-        HIGHLIGHT THE DOMAINS. """
+        HIGHLIGHT THE DOMAINS. Pymol is launched and stopped for this image,
+        a renderer object keeps it running for a lot of images."""
+        import pymol
+        self.launch()
+        self.render(self.job(rel_path, pdb_id, infos,
+            re.sub('.ent$', '.png', rel_path)))
+        # quit
+        pymol.cmd.quit()
 
+    def job(self, rel_path, pdb_id, infos, png):
+        """Returns a render job, a picklable dict with the informations of an
+        interaction needed to draw it in the png file."""
         # extracts informations for the chain and the residues
         domain_1 = self._extract_info(infos, '1')
         domain_2 = self._extract_info(infos, '2')
+        job = {}
+        job['rel_path'] = rel_path
+        job['pdb_id'] = pdb_id
+        job['png'] = png
+        job['chain_1'] = domain_1['chain']
+        job['chain_2'] = domain_2['chain']
+        job['residues_1'] = '+'.join(domain_1['ids'])
+        job['residues_2'] = '+'.join(domain_2['ids'])
+        return job
+
+    def launch(self):
+        """Launches pymol without its gui."""
+        import pymol
+        pymol.pymol_argv = ['pymol','-qc']
+        pymol.finish_launching()
 
+    def render(self, job):
+        """Draws a render job in its png file, pymol must be launched."""
+        import pymol
         # gets informations
-        chain_1 = domain_1['chain']
-        chain_2 = domain_2['chain']
-        residues_1 = '+'.join(domain_1['ids'])
-        residues_2 = '+'.join(domain_2['ids'])
+        pdb_id = job['pdb_id']
+        chain_1 = job['chain_1']
+        chain_2 = job['chain_2']
+        residues_1 = job['residues_1']
+        residues_2 = job['residues_2']
 
         # build the select command for pymol
         chain_1_obj = 'chain '+chain_1+' and (not resi '+residues_1+')'
         chain_2_obj = 'chain '+chain_2+' and (not resi '+residues_2+')'
         residues_1_obj = 'chain '+chain_1+' and resi '+residues_1
-        residues_2_obj = 'chain '+chain_1+' and resi '+residues_2
-
-        # run pymol without its gui
-        pymol.pymol_argv = ['pymol','-qc']
-        pymol.finish_launching()
+        residues_2_obj = 'chain '+chain_2+' and resi '+residues_2
 
         # the file
-        pymol.cmd.load(rel_path, pdb_id)
+        pymol.cmd.load(job['rel_path'], pdb_id)
 
         pymol.cmd.disable('all')
         pymol.cmd.enable(pdb_id)
@@ -68,10 +101,12 @@ class representation:
         pymol.cmd.create('final', 'chain_1 or chain_2 or res_1 or res_2')
         pymol.cmd.zoom('final')
         # export
-        pymol.cmd.png(re.sub('.ent$', '.png', rel_path))
+        pymol.cmd.png(job['png'])
 
-        # quit
-        pymol.cmd.quit()
+    def reset(self):
+        """Removes everything from the pymol session, for the next job."""
+        import pymol
+        pymol.cmd.reinitialize()
 
     # private functions
 
@@ -80,10 +115,17 @@ class representation:
         PDB file."""
         ids = []
         residues = infos[domain]['residues']
-        # the residues are necessarily in the same chain, so :
-        chain = residues[0].get_parent().get_id()
-        for residue in residues:
-            number = str(residue.get_id()[1])
+        # the residues of a compact structure are (chain, number, insertion
+        # code) tuples
+        # (lists when they come from the checkpoints)
+        if isinstance(residues[0], (tuple, list)):
+            chain = residues[0][0]
+            numbers = [str(residue[1]) for residue in residues]
+        else:
+            # the residues are necessarily in the same chain, so :
+            chain = residues[0].get_parent().get_id()
+            numbers = [str(residue.get_id()[1]) for residue in residues]
+        for number in numbers:
             if number not in ids:
                 ids.append(number)
         return {'chain': chain, 'ids': ids}
@@ -0,0 +1,375 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" service class """
+
+import os
+import re
+import json
+import time
+import Queue
+import shutil
+import logging
+import threading
+import traceback
+import BaseHTTPServer
+from SocketServer import ThreadingMixIn
+from collections import OrderedDict
+
+# local imports
+from .structure import structure
+from .domain import domain
+from .interaction import interaction
+from .graph import graph
+from .matrixcsv import matrixcsv
+from .cache import shared_cache
+from .dedup import dedup
+
+logger = logging.getLogger(__name__)
+
+class service:
+
+    """
+    This class is a long-running query service: the jobs (a PFAM id, a PFAM
+    id with iPFAM or a list of PDB ids) are sent to a local HTTP API, queued
+    and run one after the other by a worker thread. The process keeps its
+    parsed structures (see cache), its annotations store and its fetcher
+    connections between the jobs, so a job doesn't pay for the start-up and
+    the cold caches.
+
+    The API (json):
+        - POST /jobs {"pfam_id": "PF00931"}, {"pfam_id": "PF00931",
+          "ipfam": true} or {"pdb_ids": ["2XHE", ...]}: queues a job and
+          returns its status
+        - GET /jobs: the status of all the jobs
+        - GET /jobs/<id>: the status of a job (queued, running, done or
+          failed) and its artifacts
+        - GET /jobs/<id>/<artifact>: an artifact of a job (frequencies.json,
+          matrix.csv, graph.png...)
+        - GET /status: the queue and the caches statistics
+
+    @param directory: the directory of the job outputs, each job writes its
+    artifacts in its own subdirectory
+    @type directory: string
+
+    @param fetcher: the fetcher of the annotations
+    @type fetcher: fetcher
+
+    @param store: the local store of the annotations and the iPFAM tables
+    @type store: store
+
+    @param drawer: the graph writer, a default one if None
+    @type drawer: graph
+
+    @param sparse: builds the matrices as sparse matrices
+    @type sparse: bool
+
+    @param formats: the other formats of the matrices (npy, npz, coo)
+    @type formats: list
+
+    @param deduplication: removes the redundant entries of the lists of PDB
+    ids, a default one (only the duplicate ids) if None
+    @type deduplication: dedup
+
+    The other options are given to the interaction objects (engine, jobs,
+    downloads, checkpoints, renderer...).
+    """
+
+    # the content types of the artifacts
+    content_types = {'.json': 'application/json', '.csv': 'text/csv',
+            '.png': 'image/png', '.dot': 'text/vnd.graphviz',
+            '.graphml': 'application/xml', '.tsv': 'text/tab-separated-values',
+            '.npy': 'application/octet-stream',
+            '.npz': 'application/octet-stream'}
+
+    def __init__(self, directory='jobs', fetcher=None, store=None,
+            drawer=None, sparse=False, formats=[], deduplication=None,
+            **options):
+        self.directory = directory
+        self.fetcher = fetcher
+        self.store = store
+        self.drawer = drawer or graph()
+        self.sparse = sparse
+        self.formats = formats
+        self.deduplication = deduplication or dedup()
+        self.options = options
+        # job id -> job, in the order of submission
+        self.jobs = OrderedDict()
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        # the ids go on after the ones of the previous runs of the service,
+        # so a new job never reports the artifacts of an older one
+        self.counter = self._last_job_id()
+        self.worker = None
+        self.server = None
+
+    def serve(self, port, host='127.0.0.1'):
+        """Starts the worker thread and answers the HTTP requests until the
+        server is shut down."""
+        self.start()
+        self.server = _server((host, port), _handler)
+        self.server.service = self
+        logger.info("Serving on http://%s:%d/", host,
+                self.server.server_address[1])
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def shutdown(self):
+        """Stops the HTTP server, the running job is finished."""
+        if self.server is not None:
+            self.server.shutdown()
+
+    def start(self):
+        """Starts the worker thread."""
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._work)
+            self.worker.daemon = True
+            self.worker.start()
+
+    def submit(self, request):
+        """Queues a job and returns its status. A ValueError is raised if the
+        request is not valid."""
+        kind, arguments = self._check(request)
+        with self.lock:
+            self.counter += 1
+            job_id = '%06d' % self.counter
+            job = {'id': job_id, 'kind': kind, 'arguments': arguments,
+                    'status': 'queued', 'submitted': time.time(),
+                    'started': None, 'finished': None, 'error': None,
+                    'warnings': [], 'artifacts': []}
+            self.jobs[job_id] = job
+            # the status before the worker can take the job
+            status = self._job_status(job)
+        logger.info("Job %s queued (%s)", job_id, kind,
+                extra={'job': job_id})
+        self.queue.put(job_id)
+        return status
+
+    def status(self, job_id=None):
+        """Returns the status of a job, or the list of the status of all the
+        jobs. A KeyError is raised if the job doesn't exist."""
+        with self.lock:
+            if job_id is None:
+                return [dict(job) for job in self.jobs.values()]
+            return self._job_status(self.jobs[job_id])
+
+    def stats(self):
+        """Returns the statistics of the queue and of the caches."""
+        with self.lock:
+            states = [job['status'] for job in self.jobs.values()]
+        stats = {}
+        for state in ['queued', 'running', 'done', 'failed']:
+            stats[state] = states.count(state)
+        stats['models'] = {'entries': len(shared_cache.entries),
+                'atoms': shared_cache.atoms_num, 'hits': shared_cache.hits,
+                'misses': shared_cache.misses}
+        if self.store is not None:
+            # the store is only used by the worker thread, its counters are
+            # read without the database
+            stats['annotations'] = {'hits': self.store.hits,
+                    'misses': self.store.misses,
+                    'expired': self.store.expired}
+        return stats
+
+    def artifact(self, job_id, name):
+        """Returns the path of an artifact of a job. A KeyError is raised if
+        the job or the artifact doesn't exist."""
+        job = self.status(job_id)
+        if name not in job['artifacts']:
+            raise KeyError(name)
+        return os.path.join(self.job_directory(job_id), name)
+
+    def job_directory(self, job_id):
+        """Returns the output directory of a job."""
+        return os.path.join(self.directory, job_id)
+
+    def run(self, job):
+        """Runs a job and writes its artifacts, returns the frequencies."""
+        directory = self.job_directory(job['id'])
+        # only the files of this job are in its directory
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        arguments = job['arguments']
+        if job['kind'] == 'list':
+            pdb_ids = self.deduplication.unique(arguments['pdb_ids'])
+            annotations = structure(pdb_ids[0]).get_domains_from_list(
+                    pdb_ids, self.fetcher)
+            annotations, weights = self.deduplication.reduce(annotations)
+            # the arguments are useless in the list mode
+            inter = interaction("whatever", "whatever", "whatever",
+                    **self.options)
+            freq = inter.aggregate_3(annotations, weights=weights).records()
+        else:
+            search = domain(arguments['pfam_id'], self.store)
+            if self.fetcher is not None:
+                search.rcsb_resturl = self.fetcher.base_url
+            pdb_ids = search.get_pdb_ids()
+            if job['kind'] == 'ipfam':
+                pfam_ids = search.get_interactions()
+            else:
+                pfam_ids = "whatever"
+            inter = interaction(search.pfam_id, pdb_ids, pfam_ids,
+                    **self.options)
+            annotations = inter.get_annotations(self.fetcher)
+            if job['kind'] == 'ipfam':
+                freq = inter.frequencies(inter.analysis(annotations))
+            else:
+                freq = inter.frequencies(inter.analysis_2(annotations))
+        if self.fetcher is not None and self.fetcher.failed:
+            # the job is done without these structures
+            job['warnings'].append("annotations not retrieved: "+
+                    ', '.join(sorted(self.fetcher.failed)))
+        with open(os.path.join(directory, 'frequencies.json'), 'w') as handle:
+            json.dump(freq, handle, indent=1)
+        matrixcsv().frequencies_matrix(freq, os.path.join(directory,
+            'matrix.csv'), sparse=self.sparse, formats=self.formats)
+        try:
+            if job['kind'] == 'list':
+                self.drawer.draw_list(freq, os.path.join(directory,
+                    'graph.png'))
+            else:
+                self.drawer.draw(freq, os.path.join(directory, 'graph.png'))
+        except OSError, error:
+            # the other artifacts are still useful without the image
+            job['warnings'].append('graph: '+str(error))
+        return freq
+
+    # private functions
+
+    def _job_status(self, job):
+        """Returns a copy of a job with its position in the queue, the lock
+        must be held."""
+        status = dict(job)
+        if status['status'] == 'queued':
+            # the number of jobs to run before this one
+            status['position'] = [other['status'] for other in
+                    self.jobs.values() if other['id'] < job['id']].count(
+                            'queued')
+        return status
+
+    def _last_job_id(self):
+        """Returns the highest job id in the directory of the job outputs, 0
+        if there is none."""
+        if not os.path.isdir(self.directory):
+            return 0
+        job_ids = [int(name) for name in os.listdir(self.directory)
+                if re.match(r'^\d+$', name)]
+        return max(job_ids or [0])
+
+    def _check(self, request):
+        """Returns the kind and the arguments of a job request."""
+        if not isinstance(request, dict):
+            raise ValueError('the request must be a json object')
+        if 'pdb_ids' in request:
+            pdb_ids = request['pdb_ids']
+            if not isinstance(pdb_ids, list) or not pdb_ids or \
+                    not all(isinstance(pdb_id, basestring) and
+                            re.match(r'^\w{4}$', pdb_id)
+                            for pdb_id in pdb_ids):
+                raise ValueError('pdb_ids must be a list of PDB ids')
+            return 'list', {'pdb_ids': [str(pdb_id).upper()
+                for pdb_id in pdb_ids]}
+        pfam_id = request.get('pfam_id')
+        if not isinstance(pfam_id, basestring) or \
+                not re.match(r'^PF\d{5}$', pfam_id):
+            raise ValueError('pfam_id must be a PFAM id (PF00931) or pdb_ids '
+                    'a list of PDB ids')
+        if request.get('ipfam'):
+            return 'ipfam', {'pfam_id': str(pfam_id)}
+        return 'pfam', {'pfam_id': str(pfam_id)}
+
+    def _work(self):
+        """Runs the queued jobs one after the other, the analyses share the
+        caches of the process."""
+        while True:
+            job_id = self.queue.get()
+            with self.lock:
+                job = self.jobs[job_id]
+                job['status'] = 'running'
+                job['started'] = time.time()
+            logger.info("Job %s started", job_id, extra={'job': job_id})
+            try:
+                self.run(job)
+                status, error = 'done', None
+            except Exception, exception:
+                status = 'failed'
+                error = exception.__class__.__name__+': '+str(exception)
+                logger.error("Job %s failed: %s", job_id, error,
+                        extra={'job': job_id,
+                            'traceback': traceback.format_exc()})
+            directory = self.job_directory(job_id)
+            artifacts = []
+            if os.path.isdir(directory):
+                artifacts = sorted(os.listdir(directory))
+            with self.lock:
+                job['status'] = status
+                job['error'] = error
+                job['finished'] = time.time()
+                job['artifacts'] = artifacts
+            logger.info("Job %s %s in %.1f s", job_id, status,
+                    job['finished'] - job['started'], extra={'job': job_id})
+
+
+class _handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """
+    The HTTP interface of the service.
+    """
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        try:
+            if parts == ['status']:
+                return self._reply_json(200, service.stats())
+            if parts == ['jobs']:
+                return self._reply_json(200, service.status())
+            if len(parts) == 2 and parts[0] == 'jobs':
+                return self._reply_json(200, service.status(parts[1]))
+            if len(parts) == 3 and parts[0] == 'jobs':
+                path = service.artifact(parts[1], parts[2])
+                return self._reply_file(path)
+        except KeyError:
+            pass
+        self._reply_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.get('content-length', 0)))
+        if self.path.split('?')[0].rstrip('/') != '/jobs':
+            return self._reply_json(404, {'error': 'not found'})
+        try:
+            job = service.submit(json.loads(body))
+        except ValueError, error:
+            return self._reply_json(400, {'error': str(error)})
+        self._reply_json(202, job)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _reply_json(self, status, content):
+        self._reply(status, json.dumps(content, indent=1), 'application/json')
+
+    def _reply_file(self, path):
+        with open(path, 'rb') as handle:
+            body = handle.read()
+        extension = os.path.splitext(path)[1]
+        self._reply(200, body, service.content_types.get(extension,
+            'application/octet-stream'))
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _server(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    # the status requests are answered while a job is running
+    daemon_threads = True
+    allow_reuse_address = True
@@ -0,0 +1,183 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" shard class """
+
+import os
+import json
+import hashlib
+
+# local imports
+from .structure import structure
+from .interaction import interaction
+from .aggregate import aggregate
+
+class shard:
+
+    """
+    This class splits a list of PDB ids in shards, so the all-vs-all search
+    of the list mode can run as independent jobs (on several cores or on
+    several nodes sharing a filesystem). Each job writes the interaction
+    counts of its shard in a partial result file, and the partial results
+    are merged to build the global frequencies, matrix and graph.
+
+    The shards are contiguous slices of the list of unique PDB ids, so the
+    merged frequencies are the same as the ones of a single run on the
+    whole list. The entries can't be grouped by content (the cluster option
+    of dedup) in shards: the groups would be made inside each shard, and a
+    group split between two shards would be counted in both.
+
+    @param directory: the directory of the partial result files, it must be
+    shared by all the jobs
+    @type directory: string
+
+    @param shards: the number of shards
+    @type shards: int
+    """
+
+    def __init__(self, directory='shards', shards=1):
+        self.directory = directory
+        self.shards = shards
+
+    def split(self, pdb_ids):
+        """Returns the list of the shards of a list of PDB ids."""
+        size = len(pdb_ids)
+        return [pdb_ids[size*i/self.shards:size*(i+1)/self.shards]
+                for i in range(self.shards)]
+
+    def get_pdb_ids(self, pdb_ids, index):
+        """Returns the PDB ids of a shard."""
+        if index < 0 or index >= self.shards:
+            raise ValueError('shard index '+str(index)+' not in 0..'+
+                    str(self.shards-1))
+        return self.split(pdb_ids)[index]
+
+    def filename(self, index):
+        """Returns the partial result file of a shard."""
+        return os.path.join(self.directory, 'shard-%05d-of-%05d.json' %
+                (index, self.shards))
+
+    def missing(self, pdb_ids, deduplication=None):
+        """Returns the indexes of the shards of a list of PDB ids that have
+        no partial result yet. A partial result of another list (or of
+        another split of the list, or made with other dedup settings) is
+        out of date, so its shard is missing too."""
+        return [i for i in range(self.shards)
+                if self.check(pdb_ids, i, deduplication) is not None]
+
+    def check(self, pdb_ids, index, deduplication=None):
+        """Returns None if the partial result file of a shard belongs to the
+        current split of a list of PDB ids and was made with the settings of
+        the dedup object, the reason why not otherwise."""
+        if not os.path.isfile(self.filename(index)):
+            return 'missing'
+        try:
+            with open(self.filename(index)) as handle:
+                result = json.load(handle)
+        except ValueError:
+            return 'unreadable'
+        if result.get('shards') != self.shards or \
+                result.get('list') != self._list_hash(pdb_ids):
+            return 'from another list of PDB ids'
+        if result.get('pdb_ids') != self.get_pdb_ids(pdb_ids, index):
+            return 'from another split of the list'
+        if result.get('dedup') != self._dedup_settings(deduplication):
+            return 'made with other dedup settings'
+        return None
+
+    def run(self, pdb_ids, index, fetcher=None, deduplication=None,
+            **options):
+        """Searches for interacting domains in a shard of the list, writes
+        its partial result file and returns its aggregate. If a dedup object
+        is given, the duplicate entries of the shard are removed before the
+        search. The options are given to the interaction object (engine,
+        jobs, checkpoints...). A ValueError is raised if the dedup object
+        groups the entries by content."""
+        if deduplication is not None and deduplication.cluster:
+            raise ValueError("the entries can't be clustered in shards")
+        shard_ids = self.get_pdb_ids(pdb_ids, index)
+        aggregation = aggregate()
+        if shard_ids:
+            # gets domains annotations for the pdb ids of the shard
+            struct = structure(shard_ids[0])
+            annotations = struct.get_domains_from_list(shard_ids, fetcher)
+            weights = None
+            if deduplication is not None:
+                # only the duplicate entries, the clusters are refused
+                annotations, weights = deduplication.reduce(annotations)
+            # the arguments are useless in the list mode
+            inter = interaction("whatever", "whatever", "whatever", **options)
+            aggregation = inter.aggregate_3(annotations, weights=weights)
+        self.write(index, pdb_ids, shard_ids, aggregation, deduplication)
+        return aggregation
+
+    def write(self, index, pdb_ids, shard_ids, aggregation,
+            deduplication=None):
+        """Writes the partial result file of a shard. The file is written
+        under another name and then renamed, so a merge never reads half a
+        file."""
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another job has just created it
+                if not os.path.isdir(self.directory):
+                    raise
+        result = {}
+        result['index'] = index
+        result['shards'] = self.shards
+        # the shards of different lists must not be merged together
+        result['list'] = self._list_hash(pdb_ids)
+        result['pdb_ids'] = shard_ids
+        # nor the shards with other clusters or weights
+        result['dedup'] = self._dedup_settings(deduplication)
+        result['names'] = aggregation.names
+        result['counts'] = aggregation.get_counts()
+        filename = self.filename(index)
+        tmp_path = filename+'.'+str(os.getpid())+'.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(result, handle)
+        os.rename(tmp_path, filename)
+
+    def read(self, index):
+        """Returns the content of the partial result file of a shard, the
+        counts are in an aggregate object."""
+        with open(self.filename(index)) as handle:
+            result = json.load(handle)
+        aggregation = aggregate()
+        # the names are added in their original order
+        for name in result['names']:
+            for interactant, count in result['counts'][name].items():
+                aggregation.add(str(name), str(interactant), count)
+        result['aggregate'] = aggregation
+        return result
+
+    def merge(self, pdb_ids, deduplication=None):
+        """Returns the aggregate of all the shards of a list of PDB ids. A
+        ValueError is raised if a shard is missing or if it doesn't belong
+        to the current split of the list and dedup settings."""
+        errors = []
+        for index in range(self.shards):
+            error = self.check(pdb_ids, index, deduplication)
+            if error is not None:
+                errors.append('shard '+str(index)+' '+error)
+        if errors:
+            raise ValueError(', '.join(errors))
+        aggregation = aggregate()
+        # in the order of the shards, as a single run would do
+        for index in range(self.shards):
+            aggregation.merge(self.read(index)['aggregate'])
+        return aggregation
+
+    # private functions
+
+    def _list_hash(self, pdb_ids):
+        """Returns a hash of a list of PDB ids."""
+        return hashlib.sha1('\n'.join(pdb_ids)).hexdigest()
+
+    def _dedup_settings(self, deduplication):
+        """Returns the settings of a dedup object that change the counts of
+        a shard, the weighting is only used with the clusters."""
+        if deduplication is None or not deduplication.cluster:
+            return {'cluster': False}
+        return {'cluster': True, 'weighting': deduplication.weighting}
@@ -0,0 +1,200 @@
+# M2BIBS ITPP project
+# Ariane Odjo & Nourdine Bah
+
+""" store class """
+
+import json
+import time
+import sqlite3
+
+class store:
+
+    """
+    This class keeps the pfam annotations (the pfamHit records of the rcsb
+    hmmer service) in a local SQLite database, so they are downloaded only
+    once. An entry older than the ttl is considered as missing.
+    The iPFAM interaction tables are also imported once in the database and
+    indexed by PFAM id, and the results of the rcsb searches (the PDB ids of
+    PFAM ids) are kept with the same ttl.
+
+    @param filename: the SQLite database file
+    @type filename: string
+
+    @param ttl: the time to live (in seconds) of an entry, 0 for no limit
+    @type ttl: float
+
+    @param refresh: if True, all the entries recorded before the creation
+    of the store object are considered as expired and downloaded again
+    @type refresh: bool
+    """
+
+    def __init__(self, filename='annotations.sqlite', ttl=30*24*3600,
+            refresh=False):
+        self.filename = filename
+        self.ttl = ttl
+        self.refresh = refresh
+        # the entries recorded since then are fresh, even with refresh
+        self.started = time.time()
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        # the ipfam tables imported during this run
+        self.imported = set()
+        # the database is opened when it is used for the first time
+        self.connection = None
+
+    def get(self, pdb_id):
+        """Returns the list of pfamHit records (dicts of attributes) of a pdb
+        id, or None if it is not in the store or has expired."""
+        row = self._connect().execute('SELECT hits, fetched FROM hmmer '
+                'WHERE pdb_id = ?', (pdb_id.upper(),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        hits, fetched = row
+        if self._expired(fetched):
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(hits)
+
+    def get_many(self, pdb_ids):
+        """Returns a dict with the pfamHit records of the pdb ids that are in
+        the store and not expired."""
+        records = {}
+        for pdb_id in pdb_ids:
+            if pdb_id in records:
+                continue
+            hits = self.get(pdb_id)
+            if hits is not None:
+                records[pdb_id] = hits
+        return records
+
+    def put(self, pdb_id, hits):
+        """Records the pfamHit records of a pdb id."""
+        self.put_many({pdb_id: hits})
+
+    def put_many(self, records):
+        """Records the pfamHit records of several pdb ids (dict pdb id ->
+        records) in one transaction."""
+        now = time.time()
+        rows = []
+        for pdb_id, hits in records.items():
+            rows.append((pdb_id.upper(), json.dumps(hits), now))
+        connection = self._connect()
+        connection.executemany('INSERT OR REPLACE INTO hmmer '
+                '(pdb_id, hits, fetched) VALUES (?, ?, ?)', rows)
+        connection.commit()
+
+    def get_search(self, query):
+        """Returns the list of PDB ids found by a rcsb search (the search url
+        and the PFAM ids separated by commas), or None if it is not in the
+        store or has expired."""
+        row = self._connect().execute('SELECT pdb_ids, fetched FROM searches '
+                'WHERE query = ?', (query,)).fetchone()
+        if row is None:
+            return None
+        pdb_ids, fetched = row
+        if self._expired(fetched):
+            return None
+        return [str(pdb_id) for pdb_id in json.loads(pdb_ids)]
+
+    def put_search(self, query, pdb_ids):
+        """Records the list of PDB ids found by a rcsb search."""
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO searches '
+                '(query, pdb_ids, fetched) VALUES (?, ?, ?)',
+                (query, json.dumps(pdb_ids), time.time()))
+        connection.commit()
+
+    def has_ipfam(self, sources):
+        """Returns True if all the iPFAM tables of the sources list have been
+        imported and are not expired."""
+        for source in sources:
+            # already imported during this run
+            if source in self.imported:
+                continue
+            row = self._connect().execute('SELECT imported FROM '
+                    'ipfam_imports WHERE source = ?', (source,)).fetchone()
+            if row is None or self._expired(row[0]):
+                return False
+        return True
+
+    def import_ipfam(self, source, rows):
+        """Imports an iPFAM table, rows is an iterable of (pfam id, partner
+        pfam id) couples. The previous rows of the same source are
+        replaced."""
+        connection = self._connect()
+        connection.execute('DELETE FROM ipfam WHERE source = ?', (source,))
+        connection.executemany('INSERT INTO ipfam (pfam_id, partner, source) '
+                'VALUES (?, ?, ?)', ((pfam_id, partner, source)
+                    for pfam_id, partner in rows))
+        connection.execute('INSERT OR REPLACE INTO ipfam_imports '
+                '(source, imported) VALUES (?, ?)', (source, time.time()))
+        connection.commit()
+        self.imported.add(source)
+
+    def get_partners(self, pfam_id):
+        """Returns the set of the PFAM ids that interact with a PFAM id."""
+        return self.get_partners_many([pfam_id])[pfam_id]
+
+    def get_partners_many(self, pfam_ids):
+        """Returns a dict with the set of the interacting PFAM ids of each
+        PFAM id."""
+        partners = {}
+        cursor = self._connect().cursor()
+        for pfam_id in pfam_ids:
+            partners[pfam_id] = set()
+            cursor.execute('SELECT partner FROM ipfam WHERE pfam_id = ?',
+                    (pfam_id,))
+            for row in cursor:
+                partners[pfam_id].add(str(row[0]))
+        return partners
+
+    def stats(self):
+        """Returns a dict with the hits, misses and expired entries numbers
+        and the number of entries in the store."""
+        stats = {}
+        stats['hits'] = self.hits
+        stats['misses'] = self.misses
+        stats['expired'] = self.expired
+        stats['entries'] = self._connect().execute(
+                'SELECT COUNT(*) FROM hmmer').fetchone()[0]
+        return stats
+
+    def close(self):
+        """Closes the database."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    # private functions
+
+    def _expired(self, fetched):
+        """Returns True if an entry recorded at the fetched time is older
+        than the ttl, or was recorded before this run with refresh."""
+        if self.refresh and fetched < self.started:
+            return True
+        return bool(self.ttl) and time.time() - fetched > self.ttl
+
+    def _connect(self):
+        """Returns the connection to the database, the database is created
+        if necessary."""
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.filename)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS hmmer '
+                    '(pdb_id TEXT PRIMARY KEY, hits TEXT, fetched REAL)')
+            # the ipfam interactions, indexed by pfam id
+            self.connection.execute('CREATE TABLE IF NOT EXISTS ipfam '
+                    '(pfam_id TEXT, partner TEXT, source TEXT)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS '
+                    'ipfam_pfam_id ON ipfam (pfam_id)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS '
+                    'ipfam_imports (source TEXT PRIMARY KEY, imported REAL)')
+            # the PDB ids found by the rcsb searches
+            self.connection.execute('CREATE TABLE IF NOT EXISTS searches '
+                    '(query TEXT PRIMARY KEY, pdb_ids TEXT, fetched REAL)')
+            self.connection.commit()
+        return self.connection
@@ -4,14 +4,20 @@
 """ structure class """
 
 # common imports
+import os
 import re
+import gzip
+import logging
 import urllib2
 import xml.etree.ElementTree as et
 from itertools import combinations
 
-# biopyton imports
-from Bio.PDB import PDBList
-from Bio.PDB import PDBParser
+# local imports
+from .compact import compact
+from .interval_index import interval_index
+from .instrument import shared_instrument
+
+logger = logging.getLogger(__name__)
 
 class structure:
 
@@ -22,34 +28,78 @@ class structure:
     @type pdb_id: string
     """
 
-    def __init__(self, pdb_id):
+    def __init__(self, pdb_id, store=None):
         self.pdb_id = pdb_id
         self.rcsb_resturl = 'http://www.rcsb.org/pdb/rest/'
+        # the local annotations store, if any
+        self.store = store
 
     def get_pfam_ids(self):
         """Returns pfam domain ids from a pbd structure id."""
+        return self.pfam_ids_from_hits(self.get_hits())
+
+    def get_hits(self):
+        """Returns the pfamHit records (dicts of attributes) for a pdb
+        structure id. They are taken from the store if possible."""
+        if self.store is not None:
+            hits = self.store.get(self.pdb_id)
+            if hits is not None:
+                return hits
         # uses the rcsb rest interface
         request = self.rcsb_resturl+'hmmer?structureId='+self.pdb_id
-        print "Retrieves pfam informations for "+self.pdb_id+"..."
-        socket = urllib2.urlopen(request)
+        logger.info("Connexion to rcsb for %s...", self.pdb_id,
+                extra={'pdb_id': self.pdb_id})
+        with shared_instrument.stage('http', pdb_id=self.pdb_id):
+            socket = urllib2.urlopen(request)
+            xml = socket.read()
+        shared_instrument.count('http.requests')
+        shared_instrument.count('http.bytes', len(xml))
+        hits = self.parse_hits(xml)
+        if self.store is not None:
+            self.store.put(self.pdb_id, hits)
+        return hits
+
+    def parse_hits(self, xml):
+        """Returns the pfamHit records (dicts of attributes) of a rcsb hmmer
+        xml."""
         # the rcsb server returns a xml file which is parsed with ElementTree
-        xml = socket.read()
         hmmer3 = et.fromstring(xml)
+        hits = []
+        for pfamhit in hmmer3:
+            hits.append(dict(pfamhit.attrib))
+        return hits
+
+    def parse_pfam_ids(self, xml):
+        """Returns pfam domain ids from a rcsb hmmer xml."""
+        return self.pfam_ids_from_hits(self.parse_hits(xml))
+
+    def pfam_ids_from_hits(self, hits):
+        """Returns pfam domain ids from pfamHit records."""
         # iterates on each pfamHit and pushes informartions in a list
         accession_nums = []
-        for pfamhit in hmmer3:
-            accession_num = re.sub("\..*", "", pfamhit.attrib['pfamAcc'])
+        for pfamhit in hits:
+            accession_num = re.sub("\..*", "", pfamhit['pfamAcc'])
             accession_nums.append(accession_num)
         return accession_nums
 
-    def get_domains_from_list(self, pdb_ids):
-        """Calls get_domains for a list of pdb ids, and returns a list."""
+    def get_domains_from_list(self, pdb_ids, fetcher=None):
+        """Calls get_domains for a list of pdb ids, and returns a list. If a
+        fetcher is given, all the annotations are retrieved with it at
+        once, and the pdb ids it can't retrieve are left out."""
+        if fetcher is not None:
+            all_domains = fetcher.get_domains(pdb_ids)
         annotations = []
         for pdb_id in pdb_ids:
             annotation = {}
             annotation['pdb_id'] = pdb_id
-            struct = structure(pdb_id)
-            domains = struct.get_domains()
+            if fetcher is not None:
+                # the fetcher has already warned about the missing ids
+                if pdb_id not in all_domains:
+                    continue
+                domains = all_domains[pdb_id]
+            else:
+                struct = structure(pdb_id, self.store)
+                domains = struct.get_domains()
             annotation['domains'] = domains
             domain_combinations = self.get_domain_combinations(domains)
             annotation['combinations'] = domain_combinations
@@ -69,51 +119,109 @@ class structure:
 
     def get_domains(self):
         """Returns pfam domain annotations for a pdb structure id."""
-        # uses the rcsb rest interface
-        request = self.rcsb_resturl+'hmmer?structureId='+self.pdb_id
-        print "Connexion to rcsb for "+self.pdb_id+"..."
-        socket = urllib2.urlopen(request)
-        # the rcsb server returns a xml file which is parsed with ElementTree
-        xml = socket.read()
-        hmmer3 = et.fromstring(xml)
+        return self.domains_from_hits(self.get_hits())
+
+    def parse_domains(self, xml):
+        """Returns pfam domain annotations from a rcsb hmmer xml."""
+        return self.domains_from_hits(self.parse_hits(xml))
+
+    def domains_from_hits(self, hits):
+        """Returns pfam domain annotations from pfamHit records."""
         # iterates on each pfamHit and pushes informartions in a list
         domains = []
-        for pfamhit in hmmer3:
+        for pfamhit in hits:
             domain = {}
-            domain['id'] = re.sub("\..*", "", pfamhit.attrib['pfamAcc'])
-            domain['name'] = pfamhit.attrib['pfamName']
-            domain['chain'] = pfamhit.attrib['chainId']
-            domain['start'] = pfamhit.attrib['pdbResNumStart']
-            domain['end'] = pfamhit.attrib['pdbResNumEnd']
+            domain['id'] = re.sub("\..*", "", pfamhit['pfamAcc'])
+            domain['name'] = pfamhit['pfamName']
+            domain['chain'] = pfamhit['chainId']
+            domain['start'] = pfamhit['pdbResNumStart']
+            domain['end'] = pfamhit['pdbResNumEnd']
             domains.append(domain)
         return domains
 
-    def get_pdb_file(self, directory):
-        """Retrieves a pdb file."""
-        pdb_list = PDBList()
-        pdb_list.retrieve_pdb_file(self.pdb_id, pdir=directory)
-    
+    def get_pdb_file(self, directory, pdb_list=None):
+        """Retrieves a pdb file, a PDBList object can be given to reuse it
+        for several files."""
+        if pdb_list is None:
+            from Bio.PDB import PDBList
+            pdb_list = PDBList()
+        with shared_instrument.stage('download', pdb_id=self.pdb_id):
+            pdb_list.retrieve_pdb_file(self.pdb_id, pdir=directory)
+            # the large structures don't exist in the pdb format
+            if self.locate_file(directory) is None:
+                pdb_list.retrieve_pdb_file(self.pdb_id, pdir=directory,
+                        file_format='mmCif')
+        rel_path = self.locate_file(directory)
+        if rel_path is not None:
+            shared_instrument.count('downloads')
+            shared_instrument.count('download.bytes',
+                    os.path.getsize(rel_path))
+
+    def locate_file(self, directory):
+        """Returns the path of the structure file in a directory, or None if
+        there is no file. The pdb files are preferred, then the mmCIF and the
+        MMTF files, gzipped or not. The divided layout of the PDB mirrors
+        (ab/pdb1abc.ent.gz) is also searched."""
+        pdb_id = self.pdb_id.lower()
+        names = ['pdb'+pdb_id+'.ent', pdb_id+'.pdb', pdb_id+'.cif',
+                pdb_id+'.mmtf']
+        directories = [directory, os.path.join(directory, pdb_id[1:3])]
+        for name in names:
+            for extension in ['', '.gz']:
+                for current_dir in directories:
+                    rel_path = os.path.join(current_dir, name+extension)
+                    if os.path.isfile(rel_path):
+                        return rel_path
+        return None
+
     def get_model(self, pdb_id, filename):
-        """Returns the first model of a pdb file."""
-        parser = PDBParser(PERMISSIVE=1)
-        structure = parser.get_structure(filename, pdb_id)
+        """Returns the first model of a structure file (pdb, mmCIF or MMTF,
+        gzipped or not)."""
+        with shared_instrument.stage('parse', pdb_id=filename):
+            structure = self.read_structure(pdb_id, filename)
         model = structure[0]
         return model
 
-    def get_residues(self, model, domain):
-        """Returns the list of the residues of a domain."""
-        # extracts domain informations
-        chain_id = domain['chain']
-        start = domain['start']
-        end = domain['end']
-        chain = model[chain_id]
-        # builds the list of residues
-        residues = []
-        residues_id = range(int(start), int(end)+1)
-        for residue in chain.get_list():
-            if residue.get_id()[1] in residues_id:
-                residues.append(residue)
-        return residues
+    def read_structure(self, rel_path, name):
+        """Returns the structure of a file, the format is given by the file
+        extension and the gzipped files are read without being
+        decompressed on the disk."""
+        compressed = rel_path.endswith('.gz')
+        if compressed:
+            base_path = rel_path[:-3]
+        else:
+            base_path = rel_path
+        if base_path.endswith('.mmtf'):
+            # the mmtf-python module is only needed for these files
+            from mmtf import parse, parse_gzip
+            from Bio.PDB.mmtf import get_from_decoded
+            if compressed:
+                return get_from_decoded(parse_gzip(rel_path))
+            return get_from_decoded(parse(rel_path))
+        # Bio.PDB is only imported when a structure is parsed
+        from Bio.PDB import PDBParser
+        from Bio.PDB import MMCIFParser
+        if compressed:
+            handle = gzip.open(rel_path, 'rb')
+        else:
+            handle = open(rel_path)
+        try:
+            if base_path.endswith('.cif'):
+                parser = MMCIFParser(QUIET=True)
+            else:
+                parser = PDBParser(PERMISSIVE=1)
+            return parser.get_structure(name, handle)
+        finally:
+            handle.close()
+
+    def get_residues(self, model, domain, index=None):
+        """Returns the list of the residues of a domain. For a compact model,
+        returns the array of the indexes of the atoms of these residues.
+        The interval index of the model should be given when several domains
+        of a model are searched (see cache.get_interval_index())."""
+        if index is None:
+            index = interval_index(model)
+        return index.select(domain)
 
     def serial_numbers(self, atoms):
         """Returns a list of serial numbers for an atoms list."""
@@ -123,12 +231,31 @@ class structure:
             serial_numbers.append(serial_number)
         return serial_numbers
 
-    def atoms2residues(self, atoms):
-        """Returns a list of residues from a list of atoms."""
+    def residue_ids(self, residues):
+        """Returns a list of (chain, number, insertion code) tuples for a
+        residues list."""
+        ids = []
+        for residue in residues:
+            # the residues of a compact model are already tuples
+            if isinstance(residue, tuple):
+                ids.append(residue)
+                continue
+            hetero, number, icode = residue.get_id()
+            ids.append((residue.get_parent().get_id(), number, icode))
+        return ids
+
+    def atoms2residues(self, atoms, model=None):
+        """Returns a list of residues from a list of atoms. For a compact
+        model, the atoms are indexes and the residues are (chain, number,
+        insertion code) tuples."""
+        if isinstance(model, compact):
+            return model.residue_ids(atoms)
         residues = []
+        # a set to not search in the list for each atom
+        seen = set()
         for atom in atoms:
             residue = atom.get_parent()
-            if residue not in residues:
+            if id(residue) not in seen:
+                seen.add(id(residue))
                 residues.append(residue)
         return residues
-